@@ -16,6 +16,8 @@ list: '[' ']' | '[' literal (',' literal)* ']';
 
 val: literal | 'null';
 
+// Before VAR_NAME, which would match the same text and win the tie
+BOOL: 'true' | 'false';
 VAR_NAME: [a-zA-Z_][a-zA-Z_0-9]*;
 var: VAR_NAME;
 
@@ -57,4 +59,3 @@ WS: [ \r\n\t]+ -> skip;
 INT: [0-9]+;
 CHAR: [a-zA-Z];
 STRING: '"' ~["]* '"';
-BOOL: 'true' | 'false';
@@ -1,8 +1,20 @@
+import project.lru_cache
+from project.lru_cache import *
 import project.graph_utils
 from project.graph_utils import *
 import project.fa_building
 from project.fa_building import *
+import project.compact_graph
+from project.compact_graph import *
+import project.kronecker_operator
+from project.kronecker_operator import *
 import project.boolean_adjacency_matrix
 from project.boolean_adjacency_matrix import *
+import project.prepared_graph
+from project.prepared_graph import *
 import project.reg_querying
 from project.reg_querying import *
+import project.dynamic_index
+from project.dynamic_index import *
+import project.query_plan
+from project.query_plan import *
@@ -1,38 +1,405 @@
-from pyformlang.finite_automaton import EpsilonNFA, State
+import copy
+import operator
+from functools import reduce
+from itertools import chain
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from networkx import MultiDiGraph
+from pyformlang.finite_automaton import EpsilonNFA, State, Symbol
 from scipy import sparse
-from scipy.sparse import dok_matrix, kron
+from scipy.sparse import coo_matrix, dok_matrix, csr_matrix, csc_matrix, spmatrix
+from project.compact_graph import CompactGraph, LabeledGraph
+from project.kronecker_operator import KroneckerOperator
 from project.rfa import RFA
 
+STORAGE_BACKENDS = ("dok", "csr", "csc", "dense")
+
+Matrix = Union[spmatrix, np.ndarray]
+
+
+def convert_matrix(matrix: Matrix, backend: str) -> Matrix:
+    """
+    Converts a boolean matrix to the storage format of the given backend.
+
+    Args:
+        matrix: a scipy sparse matrix or a numpy array to convert
+        backend: one of STORAGE_BACKENDS
+
+    Returns:
+        The same matrix stored as dok_matrix, csr_matrix, csc_matrix
+        or a dense numpy bool array
+    """
+    if backend == "dense":
+        if isinstance(matrix, np.ndarray):
+            return matrix.astype(bool, copy=False)
+        return matrix.toarray().astype(bool, copy=False)
+    if backend == "dok":
+        return dok_matrix(matrix, dtype=bool)
+    if backend in ("csr", "csc"):
+        converted = (csr_matrix if backend == "csr" else csc_matrix)(matrix, dtype=bool)
+        # Sorted indices keep nonzero() order stable between calls
+        converted.sum_duplicates()
+        return converted
+    raise ValueError(
+        f"Unknown storage backend '{backend}', expected one of {STORAGE_BACKENDS}"
+    )
+
+
+def count_nonzero(matrix: Matrix) -> int:
+    # Returns the number of True cells of a sparse or dense boolean matrix
+    if isinstance(matrix, np.ndarray):
+        return int(np.count_nonzero(matrix))
+    return matrix.count_nonzero()
+
+
+def to_array(matrix: Matrix) -> np.ndarray:
+    # Returns a dense numpy copy of a sparse or dense boolean matrix
+    if isinstance(matrix, np.ndarray):
+        return matrix
+    return matrix.toarray()
+
+
+def _kron(lhs: Matrix, rhs: Matrix, backend: str) -> Matrix:
+    # Kronecker product that keeps the result in the storage format of the backend
+    if backend == "dense":
+        return np.kron(to_array(lhs), to_array(rhs))
+    return convert_matrix(sparse.kron(lhs, rhs, format=backend), backend)
+
+
+def _matrix_from_indices(
+    rows: np.ndarray, cols: np.ndarray, shape: Tuple[int, int], backend: str
+) -> Matrix:
+    # Builds a boolean matrix from coordinate arrays in a single COO -> CSR call
+    data = np.ones(len(rows), dtype=bool)
+    matrix = coo_matrix((data, (rows, cols)), shape=shape).tocsr()
+    return convert_matrix(matrix, backend)
+
+
+def _resized(matrix: csr_matrix, shape: Tuple[int, int]) -> csr_matrix:
+    # Returns a copy of the matrix padded with empty rows and columns
+    resized = matrix.copy()
+    resized.resize(shape)
+    return resized
+
+
+CLOSURE_STRATEGIES = ("auto", "squaring", "delta")
+
+# Relations at least this dense are closed faster by squaring than by deltas
+CLOSURE_DENSITY_THRESHOLD = 0.01
+
+
+class ClosureStats(NamedTuple):
+    strategy: str
+    iterations: int
+    nnz_per_step: List[int]
+
+
+def transitive_closure(
+    adjacency: Matrix, strategy: str = "auto"
+) -> Tuple[Matrix, ClosureStats]:
+    """
+    Computes the transitive closure of a square boolean matrix.
+
+    Args:
+        adjacency: a boolean relation as a sparse matrix or a numpy array
+        strategy: "squaring" repeats tc += tc @ tc, which needs few iterations
+            but multiplies all known pairs every time;
+            "delta" multiplies only the newly found pairs by the base relation
+            (semi-naive evaluation), which is cheaper on sparse relations;
+            "auto" picks one of them by the density of the relation.
+
+    Returns:
+        The closure matrix and a ClosureStats with the chosen strategy,
+        the number of matrix products and the number of nonzero cells
+        of the closure before the first and after every product.
+    """
+    if strategy not in CLOSURE_STRATEGIES:
+        raise ValueError(
+            f"Unknown closure strategy '{strategy}', expected one of {CLOSURE_STRATEGIES}"
+        )
+    if isinstance(adjacency, dok_matrix):
+        adjacency = adjacency.tocsr()
+    if strategy == "auto":
+        strategy = _choose_closure_strategy(adjacency)
+    if strategy == "squaring":
+        return _closure_by_squaring(adjacency)
+    return _closure_by_delta(adjacency)
+
+
+def extend_transitive_closure(tc: Matrix, delta: Matrix) -> Tuple[Matrix, Matrix]:
+    """
+    Updates the transitive closure tc after the edges delta were added to the relation.
+    Every new path is tc* (delta tc*)+ where tc* is tc with the empty paths,
+    so only the paths through the new edges are computed.
+
+    Returns:
+        The new closure and the paths that were not in tc.
+    """
+    step = delta + delta @ tc
+    new_paths = (step + tc @ step) > tc
+    front = new_paths
+    tc = tc + new_paths
+    while front.nnz:
+        front = (front @ step) > tc
+        tc = tc + front
+        new_paths = new_paths + front
+    return tc, new_paths
+
+
+def shrink_transitive_closure(
+    tc: csr_matrix, adjacency: csr_matrix, removed: csr_matrix
+) -> Tuple[csr_matrix, csr_matrix]:
+    """
+    Updates the transitive closure tc after the edges removed were deleted from the relation
+    by deleting and rederiving (DRed).
+    Every path of tc that may go through a removed edge, tc* removed tc*, is deleted,
+    then the deleted paths that are still derivable from the remaining relation are rederived.
+    Only the rows with deleted paths are recomputed, the other rows cannot change.
+
+    Args:
+        tc: the closure of the relation before the deletion
+        adjacency: the relation after the deletion
+        removed: the deleted edges
+
+    Returns:
+        The new closure and the paths of tc that are not in it.
+    """
+    step = removed + removed @ tc
+    suspected = (step + tc @ step).multiply(tc).tocsr()
+    kept = tc > suspected
+    rows = np.unique(suspected.nonzero()[0])
+    n = tc.shape[0]
+    selector = coo_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, rows)), shape=(n, n)
+    ).tocsr()
+
+    # The kept paths are all valid, so the closure is their fixpoint under
+    # extension by the remaining edges, and only the selected rows extend
+    known = kept + selector @ adjacency
+    front = (selector @ known @ adjacency) > known
+    while front.nnz:
+        known = known + front
+        front = (front @ adjacency) > known
+    return known, tc > known
+
+
+def _choose_closure_strategy(adjacency: Matrix) -> str:
+    # Dense relations reach the fixpoint in a few squarings, while sparse ones
+    # spend most of the squaring time recomputing already known pairs
+    if isinstance(adjacency, np.ndarray):
+        return "squaring"
+    size = adjacency.shape[0] * adjacency.shape[1]
+    density = count_nonzero(adjacency) / size if size else 1
+    return "squaring" if density >= CLOSURE_DENSITY_THRESHOLD else "delta"
+
+
+def _closure_by_squaring(adjacency: Matrix) -> Tuple[Matrix, ClosureStats]:
+    tc_matrix = adjacency.copy()
+    nnz_per_step = [count_nonzero(tc_matrix)]
+    while True:
+        tc_matrix = tc_matrix + tc_matrix @ tc_matrix
+        nnz_per_step.append(count_nonzero(tc_matrix))
+        if nnz_per_step[-1] == nnz_per_step[-2]:
+            break
+    return tc_matrix, ClosureStats("squaring", len(nnz_per_step) - 1, nnz_per_step)
+
+
+def _closure_by_delta(adjacency: Matrix) -> Tuple[Matrix, ClosureStats]:
+    tc_matrix = adjacency.copy()
+    delta = adjacency
+    nnz_per_step = [count_nonzero(tc_matrix)]
+    while count_nonzero(delta):
+        # Paths that are one edge longer than the new ones and are not known yet
+        delta = (delta @ adjacency) > tc_matrix
+        tc_matrix = tc_matrix + delta
+        nnz_per_step.append(count_nonzero(tc_matrix))
+    return tc_matrix, ClosureStats("delta", len(nnz_per_step) - 1, nnz_per_step)
+
 
 class BooleanAdjacencyMatrix:
-    def __init__(self, nfa: EpsilonNFA = None):
+    def __init__(self, nfa: EpsilonNFA = None, backend: str = "csr"):
+        """
+        Args:
+            nfa: an EpsilonNFA to build the matrices from (empty matrix if None)
+            backend: storage format of the matrices, one of STORAGE_BACKENDS.
+                Matrices are built from index arrays and converted once:
+                "csr"/"csc" suit large automata, "dense" suits small ones.
+        """
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError(
+                f"Unknown storage backend '{backend}', expected one of {STORAGE_BACKENDS}"
+            )
+        self.backend = backend
         self.adj_matrices = {}
         self.num_states = 0
-        self.start_states = dok_matrix((1, 0), dtype=bool)
-        self.final_states = dok_matrix((1, 0), dtype=bool)
+        # states[i] is the automaton state (or graph vertex) of the i-th row
+        self.states = []
+        self.closure_stats = None
+        self.start_states = convert_matrix(dok_matrix((1, 0), dtype=bool), backend)
+        self.final_states = convert_matrix(dok_matrix((1, 0), dtype=bool), backend)
         if nfa:
             self._build_adjacency_matrices(nfa)
 
     def _build_adjacency_matrices(self, nfa: EpsilonNFA) -> None:
         # Builds the boolean adjacency matrices from finite automata
         # nfa: an EpsilonNFA to use for building the matrix
-        num_states = len(nfa.states)
-        self.num_states = num_states
-        states = {state: ind for ind, state in enumerate(nfa.states)}
+        self.states = list(nfa.states)
+        states = {state: ind for ind, state in enumerate(self.states)}
+        sources, targets, labels = [], [], []
         for start, final_dict in nfa.to_dict().items():
             for label, final_states in final_dict.items():
                 if not isinstance(final_states, set):
                     final_states = {final_states}
                 for final in final_states:
-                    if label not in self.adj_matrices:
-                        self.adj_matrices[label] = dok_matrix(
-                            (num_states, num_states), dtype=bool
-                        )
-                    self.adj_matrices[label][states[start], states[final]] = True
-        self.start_states = dok_matrix((1, num_states), dtype=bool)
-        self.final_states = dok_matrix((1, num_states), dtype=bool)
-        self.start_states[0, [states[i] for i in nfa.start_states]] = True
-        self.final_states[0, [states[i] for i in nfa.final_states]] = True
+                    sources.append(states[start])
+                    targets.append(states[final])
+                    labels.append(label)
+        self._build_from_edges(
+            sources,
+            targets,
+            labels,
+            [states[i] for i in nfa.start_states],
+            [states[i] for i in nfa.final_states],
+        )
+
+    def _build_from_edges(
+        self,
+        sources: Sequence[int],
+        targets: Sequence[int],
+        labels: Sequence[Any],
+        start_states: Sequence[int],
+        final_states: Sequence[int],
+    ) -> None:
+        # Groups the edges given by index arrays by label and builds
+        # one matrix per label, the start vector and the final vector
+        num_states = len(self.states)
+        self.num_states = num_states
+        label_ids = {}
+        edge_label_ids = np.fromiter(
+            (label_ids.setdefault(label, len(label_ids)) for label in labels),
+            dtype=np.int64,
+            count=len(labels),
+        )
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        order = np.argsort(edge_label_ids, kind="stable")
+        bounds = np.flatnonzero(np.diff(edge_label_ids[order])) + 1
+        label_names = list(label_ids)
+        self.adj_matrices = {}
+        for group in np.split(order, bounds) if len(order) else []:
+            self.adj_matrices[
+                label_names[edge_label_ids[group[0]]]
+            ] = _matrix_from_indices(
+                sources[group],
+                targets[group],
+                (num_states, num_states),
+                self.backend,
+            )
+        self.start_states = self._vector_from_indices(start_states)
+        self.final_states = self._vector_from_indices(final_states)
+
+    def _vector_from_indices(self, indices: Sequence[int]) -> Matrix:
+        # Builds a (1, num_states) boolean row vector with the given cells set
+        indices = np.asarray(indices, dtype=np.int64)
+        return _matrix_from_indices(
+            np.zeros(len(indices), dtype=np.int64),
+            indices,
+            (1, self.num_states),
+            self.backend,
+        )
+
+    def with_states(
+        self,
+        start_states: Optional[Sequence[int]] = None,
+        final_states: Optional[Sequence[int]] = None,
+    ) -> "BooleanAdjacencyMatrix":
+        """
+        Returns a copy with other start and/or final states.
+        The label matrices are shared with the current matrix, not copied.
+
+        Args:
+            start_states: indices of the new start states (unchanged if None)
+            final_states: indices of the new final states (unchanged if None)
+        """
+        res = copy.copy(self)
+        # A new dict, so that labels added to the copy do not appear in the original
+        res.adj_matrices = dict(self.adj_matrices)
+        if start_states is not None:
+            res.start_states = self._vector_from_indices(start_states)
+        if final_states is not None:
+            res.final_states = self._vector_from_indices(final_states)
+        return res
+
+    @staticmethod
+    def from_graph(
+        graph: LabeledGraph,
+        start: Optional[Collection] = None,
+        final: Optional[Collection] = None,
+        backend: str = "csr",
+    ) -> "BooleanAdjacencyMatrix":
+        """
+        Create a BooleanAdjacencyMatrix directly from a labeled graph, without
+        building an intermediate NFA.
+
+        Args:
+            graph: a MultiDiGraph whose edges have a "label" attribute or a CompactGraph
+            start: vertices to use as start states (all vertices if None)
+            final: vertices to use as final states (all vertices if None)
+            backend: storage format of the matrices, one of STORAGE_BACKENDS
+
+        Returns:
+            A BooleanAdjacencyMatrix where the i-th state is the vertex states[i].
+            Vertices come in graph.nodes order, followed by start and final
+            vertices that are not in the graph.
+        """
+        res = BooleanAdjacencyMatrix(backend=backend)
+        extra = dict.fromkeys(
+            v for v in chain(start or (), final or ()) if v not in graph
+        )
+        res.states = list(graph.nodes) + list(extra)
+        node_to_idx = {v: i for i, v in enumerate(res.states)}
+        all_states = range(len(graph.nodes))
+        start = all_states if start is None else [node_to_idx[v] for v in start]
+        final = all_states if final is None else [node_to_idx[v] for v in final]
+
+        if isinstance(graph, CompactGraph):
+            # The label matrices are already built, only the extra vertices are added
+            res.num_states = len(res.states)
+            shape = (res.num_states, res.num_states)
+            res.adj_matrices = {
+                Symbol(label): convert_matrix(
+                    matrix if matrix.shape == shape else _resized(matrix, shape),
+                    backend,
+                )
+                for label, matrix in graph.label_matrices.items()
+            }
+            res.start_states = res._vector_from_indices(start)
+            res.final_states = res._vector_from_indices(final)
+            return res
+
+        edges = graph.edges(data="label")
+        num_edges = graph.number_of_edges()
+        sources = np.fromiter(
+            (node_to_idx[u] for u, _, _ in edges), dtype=np.int64, count=num_edges
+        )
+        targets = np.fromiter(
+            (node_to_idx[v] for _, v, _ in edges), dtype=np.int64, count=num_edges
+        )
+        labels = [Symbol(label) for _, _, label in edges]
+
+        res._build_from_edges(sources, targets, labels, start, final)
+        return res
 
     def to_nfa(self) -> EpsilonNFA:
         # Returns finite automata that represents the BooleanAdjacencyMatrix
@@ -51,72 +418,133 @@ class BooleanAdjacencyMatrix:
     ) -> "BooleanAdjacencyMatrix":
         # Returns a new BooleanAdjacencyMatrix that is the intersection of the current matrix and another
         # other: a BooleanAdjacencyMatrix object to intersect with the current matrix
-        intersected_matrix = BooleanAdjacencyMatrix()
+        # The result is stored in the backend of the current matrix
+        backend = self.backend
+        intersected_matrix = BooleanAdjacencyMatrix(backend=backend)
         cross_labels = self.adj_matrices.keys() & other.adj_matrices.keys()
         for label in cross_labels:
-            intersected_matrix.adj_matrices[label] = kron(
-                self.adj_matrices[label], other.adj_matrices[label]
+            intersected_matrix.adj_matrices[label] = _kron(
+                self.adj_matrices[label], other.adj_matrices[label], backend
             )
 
         intersected_matrix.num_states = self.num_states * other.num_states
-        intersected_matrix.start_states = kron(self.start_states, other.start_states)
-        intersected_matrix.final_states = kron(self.final_states, other.final_states)
+        intersected_matrix.start_states = _kron(
+            self.start_states, other.start_states, backend
+        )
+        intersected_matrix.final_states = _kron(
+            self.final_states, other.final_states, backend
+        )
         return intersected_matrix
 
-    def get_transitive_closure(self) -> dok_matrix:
+    def get_lazy_intersection(
+        self, other: "BooleanAdjacencyMatrix"
+    ) -> Dict[Any, KroneckerOperator]:
+        # Returns the intersection as lazy per-label Kronecker products,
+        # states are indexed as in get_intersection
+        # other: a BooleanAdjacencyMatrix object to intersect with the current matrix
+        cross_labels = self.adj_matrices.keys() & other.adj_matrices.keys()
+        return {
+            label: KroneckerOperator(
+                self.adj_matrices[label], other.adj_matrices[label]
+            )
+            for label in cross_labels
+        }
+
+    def get_transitive_closure(self, strategy: str = "auto") -> Matrix:
         # Returns a transitive closure matrix for the current BooleanAdjacencyMatrix
-        tc_matrix = sum(self.adj_matrices.values())
-        prev = 0
-        while tc_matrix.count_nonzero() != prev:
-            prev = tc_matrix.count_nonzero()
-            tc_matrix += tc_matrix @ tc_matrix
-        return tc_matrix
+        # The matrix is stored in the backend of the current BooleanAdjacencyMatrix
+        # strategy: "squaring", "delta" or "auto", see transitive_closure
+        # Iteration counts and per-step nnz are saved to closure_stats
+        if not self.adj_matrices:
+            adjacency = dok_matrix((self.num_states, self.num_states), dtype=bool)
+        else:
+            adjacency = reduce(operator.add, self.adj_matrices.values())
+        tc_matrix, self.closure_stats = transitive_closure(adjacency, strategy)
+        return convert_matrix(tc_matrix, self.backend)
 
     @staticmethod
-    def from_rfa(rfa: RFA):
+    def from_rfa(rfa: RFA, backend: str = "csr") -> "BooleanAdjacencyMatrix":
         """
         Create a BooleanAdjacencyMatrix from a Recursive Finite Automaton (RFA)
 
         Args:
             rfa: A Recursive Finite Automaton to use for creating the adjacency matrix
+            backend: storage format of the matrices, one of STORAGE_BACKENDS
 
         Returns:
-            A BooleanAdjacencyMatrix that represents the given RFA
+            A BooleanAdjacencyMatrix that represents the given RFA.
+            Its states are State((variable, box_state_value)), the states of
+            every box are numbered consecutively.
         """
-        res = BooleanAdjacencyMatrix()
+        res = BooleanAdjacencyMatrix(backend=backend)
 
         state_mapping = {}
-        counter = 0
         for var, nfa in rfa.boxes.items():
             for s in nfa.states:
-                state_mapping[State((var, s.value))] = counter
-                counter += 1
-
-        res.states_count = len(state_mapping)
-        res.dict = state_mapping.copy()
-
-        res.start_vector = dok_matrix((1, res.states_count), dtype=bool)
-        res.final_vector = dok_matrix((1, res.states_count), dtype=bool)
+                state_mapping[State((var, s.value))] = len(state_mapping)
+        res.states = list(state_mapping)
 
+        sources, targets, labels = [], [], []
+        start_states, final_states = [], []
         for var, nfa in rfa.boxes.items():
             for s in nfa.start_states:
-                res.start_vector[0, state_mapping[State((var, s.value))]] = True
+                start_states.append(state_mapping[State((var, s.value))])
 
             for s in nfa.final_states:
-                res.final_vector[0, state_mapping[State((var, s.value))]] = True
+                final_states.append(state_mapping[State((var, s.value))])
 
             for start, final_dict in nfa.to_dict().items():
-                for label, final_states in final_dict.items():
-                    if not isinstance(final_states, set):
-                        final_states = {final_states}
-                    for final in final_states:
-                        if label not in res.adj_matrices:
-                            res.adj_matrices[label] = dok_matrix(
-                                (res.states_count, res.states_count), dtype=bool
-                            )
-                        res.adj_matrices[label][
-                            state_mapping[State((var, start.value))],
-                            state_mapping[State((var, final.value))],
-                        ] = True
+                for label, final_states_set in final_dict.items():
+                    if not isinstance(final_states_set, set):
+                        final_states_set = {final_states_set}
+                    for final in final_states_set:
+                        sources.append(state_mapping[State((var, start.value))])
+                        targets.append(state_mapping[State((var, final.value))])
+                        labels.append(label)
+
+        res._build_from_edges(sources, targets, labels, start_states, final_states)
+        return res
+
+    @staticmethod
+    def disjoint_union(
+        matrices: Sequence["BooleanAdjacencyMatrix"], backend: str = "csr"
+    ) -> "BooleanAdjacencyMatrix":
+        """
+        Create a BooleanAdjacencyMatrix of the disjoint union of automata
+
+        Args:
+            matrices: the automata to unite
+            backend: storage format of the matrices, one of STORAGE_BACKENDS
+
+        Returns:
+            A BooleanAdjacencyMatrix whose states are (k, state) for the states
+            of the k-th automaton, the states of every automaton are numbered
+            consecutively from the sum of the sizes of the previous ones.
+        """
+        res = BooleanAdjacencyMatrix(backend=backend)
+        res.states = [(k, state) for k, m in enumerate(matrices) for state in m.states]
+
+        sources, targets, labels = [], [], []
+        start_states, final_states = [], []
+        offset = 0
+        for m in matrices:
+            start_states.append(m.start_states.nonzero()[1] + offset)
+            final_states.append(m.final_states.nonzero()[1] + offset)
+            for label, adjacency in m.adj_matrices.items():
+                rows, cols = adjacency.nonzero()
+                sources.append(rows + offset)
+                targets.append(cols + offset)
+                labels.extend([label] * len(rows))
+            offset += m.num_states
+
+        def concatenate(arrays):
+            return np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64)
 
+        res._build_from_edges(
+            concatenate(sources),
+            concatenate(targets),
+            labels,
+            concatenate(start_states),
+            concatenate(final_states),
+        )
         return res
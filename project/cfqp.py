@@ -1,26 +1,66 @@
-from typing import Union, Set, Tuple
-from collections import defaultdict
-from itertools import product
-
+import operator
+from functools import reduce
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+    Set,
+    Tuple,
+)
+from collections import defaultdict, deque
+
+import numpy as np
 import networkx.drawing.nx_pydot as nx_pydot
-from pyformlang.cfg import CFG, Terminal, Variable
-from networkx import MultiDiGraph
-from scipy.sparse import dok_matrix
-
+from pyformlang.cfg import CFG, Production, Terminal, Variable
+from pyformlang.finite_automaton import Symbol
+from scipy.sparse import coo_matrix, csr_matrix, identity, kron
+
+from project.compact_graph import LabeledGraph, read_edge_list
+from project.prepared_graph import PreparedGraph, QueryGraph, build_graph_matrix
+from project.boolean_adjacency_matrix import (
+    BooleanAdjacencyMatrix,
+    Matrix,
+    extend_transitive_closure,
+    transitive_closure,
+)
 from project.cfg_utils import to_weak_cfg, cfg_from_text
+from project.ecfg import ExtendedCFG
 
 
-def hellings(cfg: Union[str, CFG], graph: MultiDiGraph) -> Set[Tuple]:
+def hellings(
+    cfg: Union[str, CFG],
+    graph: QueryGraph,
+    start_vertices: Optional[Collection] = None,
+    end_vertices: Optional[Collection] = None,
+    target_nonterminal: Optional[Variable] = None,
+    witnesses: Optional[Dict[Tuple, Tuple]] = None,
+) -> Set[Tuple]:
     """
     Computes the reachability information for all pairs of vertices in the given graph and context-free grammar.
 
     Args:
         cfg(CFG): The context-free grammar (CFG) to use for reachability analysis.
-        graph(MultiDiGraph): The directed graph on which to perform reachability analysis.
+        graph(QueryGraph): The directed graph on which to perform reachability analysis,
+            a MultiDiGraph, a CompactGraph or a PreparedGraph.
+        start_vertices, end_vertices, target_nonterminal: Optional goal, see Goal-directed mode.
+        witnesses: If a dict is given, it is filled with (production, split vertex)
+            for every triple, the first derivation of the triple found, see cfpq_witnesses.
 
     Returns:
         Set[Tuple[int, Variable, int]]: A set of triples (start_vertex, nonterminal, end_vertex)
         representing the reachability information for all pairs of vertices in the graph.
+
+    Goal-directed mode:
+        If start_vertices is given, only the triples whose derivation can be used by
+        a path from start_vertices are computed (for target_nonterminal only, if it is given).
+        If end_vertices and target_nonterminal are given as well, the computation stops
+        as soon as every requested pair is derived. The triples of other nonterminals
+        and vertices may then be incomplete.
     """
     if isinstance(cfg, str):
         cfg = cfg_from_text(cfg)
@@ -28,39 +68,82 @@ def hellings(cfg: Union[str, CFG], graph: MultiDiGraph) -> Set[Tuple]:
         return set()
 
     wcnf = to_weak_cfg(cfg)
-    term_to_nonterm = defaultdict(set)
-    nonterm_pair_to_nonterm = defaultdict(set)
+    term_to_nonterms = defaultdict(set)
+    # Productions A -> B C indexed by B (as (C, A)) and by C (as (B, A))
+    by_first_nonterm = defaultdict(list)
+    by_second_nonterm = defaultdict(list)
     epsilon_nonterms = set()
+    # The production of every (head, body) pair, to record witnesses
+    productions = {}
     for prod in wcnf.productions:
         head, body = prod.head, prod.body
         body_len = len(body)
+        productions[(head, tuple(body))] = prod
         if body_len == 0:
             epsilon_nonterms.add(head)
         elif body_len == 1:
-            term_to_nonterm[head].add(body[0])
+            term_to_nonterms[body[0]].add(head)
         elif body_len == 2:
-            nonterm_pair_to_nonterm[head].add((body[0], body[1]))
-
-    result = {(node, var, node) for node in graph.nodes for var in epsilon_nonterms}
-    result.update(
-        (i, n, j)
-        for i, j, label in graph.edges(data="label")
-        for n, terms in term_to_nonterm.items()
-        if Terminal(label) in terms
-    )
+            by_first_nonterm[body[0]].append((body[1], head))
+            by_second_nonterm[body[1]].append((body[0], head))
+
+    demanded = None
+    if start_vertices is not None:
+        first_nonterms, later_nonterms = defaultdict(set), defaultdict(set)
+        for var, pairs in by_first_nonterm.items():
+            for var2, head in pairs:
+                first_nonterms[head].add(var)
+                later_nonterms[head].add(var2)
+        graph_matrix = build_graph_matrix(graph)
+        masks = _demanded_vertices(
+            graph_matrix,
+            start_vertices,
+            wcnf.variables if target_nonterminal is None else [target_nonterminal],
+            first_nonterms,
+            later_nonterms,
+        )
+        demanded = {
+            var: {graph_matrix.states[i] for i in np.flatnonzero(mask)}
+            for var, mask in masks.items()
+        }
+    goal = _Goal(graph.nodes, start_vertices, end_vertices, target_nonterminal)
 
-    while True:
-        new_result = result.copy()
-        for i, j, k in product(graph.nodes, repeat=3):
-            for var1, pairs in nonterm_pair_to_nonterm.items():
-                for var2, var3 in pairs:
-                    if (i, var2, j) in result and (j, var3, k) in result:
-                        new = (i, var1, k)
-                        if new not in result:
-                            new_result.add(new)
-        if new_result == result:
-            break
-        result = new_result
+    result = set()
+    # (vertex, nonterminal) -> vertices reachable from / reaching the vertex
+    facts_from = defaultdict(set)
+    facts_to = defaultdict(set)
+    worklist = deque()
+
+    def add_fact(i, var, j, body=(), split=None):
+        if demanded is not None and i not in demanded.get(var, ()):
+            return
+        if (i, var, j) not in result:
+            result.add((i, var, j))
+            facts_from[(i, var)].add(j)
+            facts_to[(j, var)].add(i)
+            worklist.append((i, var, j))
+            goal.add(i, var, j)
+            if witnesses is not None:
+                witnesses[(i, var, j)] = (productions[(var, body)], split)
+
+    for node in graph.nodes:
+        for var in epsilon_nonterms:
+            add_fact(node, var, node)
+    for i, j, label in graph.edges(data="label"):
+        terminal = Terminal(label)
+        for var in term_to_nonterms.get(terminal, ()):
+            add_fact(i, var, j, (terminal,))
+
+    # Every fact is combined with the facts known at the time it is taken
+    # from the worklist, facts found later are combined with it in their turn
+    while worklist and not goal.reached():
+        i, var, j = worklist.popleft()
+        for var2, head in by_first_nonterm.get(var, ()):
+            for k in list(facts_from.get((j, var2), ())):
+                add_fact(i, head, k, (var, var2), j)
+        for var1, head in by_second_nonterm.get(var, ()):
+            for h in list(facts_to.get((i, var1), ())):
+                add_fact(h, head, j, (var1, var), i)
 
     return result
 
@@ -78,28 +161,128 @@ def hellings_from_file(cfg: Union[str, CFG], path_to_graph: str) -> Set[Tuple]:
     Returns:
         The set of all valid paths through the graph that match the grammar, as tuples of (start_node, end_node, label).
     """
-    graph = MultiDiGraph()
-    with open(path_to_graph, "r") as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                source_node, target_node, edge_label = line.split()
-                graph.add_edge(int(source_node), int(target_node), label=edge_label)
-    return hellings(cfg, graph)
+    return hellings(cfg, read_edge_list(path_to_graph))
 
 
 def hellings_from_pydot(cfg: Union[str, CFG], dot_file: str) -> Set[Tuple]:
     return hellings(cfg, nx_pydot.from_pydot(dot_file))
 
 
-def matrix(cfg: Union[str, CFG], graph: MultiDiGraph) -> Set[Tuple]:
+class DerivationTree(NamedTuple):
+    # The derivation of the triple (start_vertex, nonterminal, end_vertex) by production,
+    # children are the derivations of the body nonterminals
+    triple: Tuple[Any, Variable, Any]
+    production: Production
+    children: Tuple["DerivationTree", ...]
+
+
+class CFPQWitnesses:
+    """
+    The triples of hellings together with the production and the split vertex
+    of the first derivation found for every triple.
+
+    A triple (i, A, j) derived by A -> B C with the split vertex k comes from (i, B, k)
+    and (k, C, j), which were derived before it, so the derivations never loop.
+    Derivation trees and paths are rebuilt on demand.
+    """
+
+    def __init__(self, triples: Set[Tuple], witnesses: Dict[Tuple, Tuple]):
+        self.triples = triples
+        self.witnesses = witnesses
+
+    def _children(self, triple: Tuple) -> List[Tuple]:
+        i, _, j = triple
+        production, split = self.witnesses[triple]
+        if len(production.body) != 2:
+            return []
+        first, second = production.body
+        return [(i, first, split), (split, second, j)]
+
+    def derivation(self, i: Any, var: Variable, j: Any) -> DerivationTree:
+        """
+        Returns the derivation tree of the triple (i, var, j).
+        A triple used more than once shares its subtree.
+        Raises KeyError if the triple was not derived.
+        """
+        root = (i, var, j)
+        if root not in self.witnesses:
+            raise KeyError(root)
+        trees = {}
+        # Iterative post-order, derivations of long paths are deep
+        stack = [root]
+        while stack:
+            triple = stack[-1]
+            if triple in trees:
+                stack.pop()
+                continue
+            children = self._children(triple)
+            missing = [child for child in children if child not in trees]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            trees[triple] = DerivationTree(
+                triple,
+                self.witnesses[triple][0],
+                tuple(trees[child] for child in children),
+            )
+        return trees[root]
+
+    def path(self, i: Any, var: Variable, j: Any) -> List[Tuple[Any, str, Any]]:
+        """
+        Returns the path of the derivation of the triple (i, var, j)
+        as a list of (source, label, target) edges, empty for an epsilon derivation.
+        Raises KeyError if the triple was not derived.
+        """
+        if (i, var, j) not in self.witnesses:
+            raise KeyError((i, var, j))
+        path = []
+        stack = [(i, var, j)]
+        while stack:
+            triple = stack.pop()
+            production, _ = self.witnesses[triple]
+            if len(production.body) == 1:
+                path.append((triple[0], production.body[0].value, triple[2]))
+            else:
+                stack.extend(reversed(self._children(triple)))
+        return path
+
+
+def cfpq_witnesses(
+    cfg: Union[str, CFG],
+    graph: QueryGraph,
+    start_vertices: Optional[Collection] = None,
+    end_vertices: Optional[Collection] = None,
+    target_nonterminal: Optional[Variable] = None,
+) -> CFPQWitnesses:
+    """
+    Runs hellings recording one derivation per triple, the memory overhead is
+    a production and a vertex per triple. The arguments are those of hellings.
+    """
+    witnesses = {}
+    triples = hellings(
+        cfg, graph, start_vertices, end_vertices, target_nonterminal, witnesses
+    )
+    return CFPQWitnesses(triples, witnesses)
+
+
+def matrix(
+    cfg: Union[str, CFG],
+    graph: QueryGraph,
+    start_vertices: Optional[Collection] = None,
+    end_vertices: Optional[Collection] = None,
+    target_nonterminal: Optional[Variable] = None,
+) -> Set[Tuple]:
     """
     Computes the reachability information for all pairs of vertices in the given graph and context-free grammar
     based on a matrix algorithm.
 
     Args:
         cfg(CFG): The context-free grammar (CFG) to use for reachability analysis.
-        graph(MultiDiGraph): The directed graph on which to perform reachability analysis.
+        graph(QueryGraph): The directed graph on which to perform reachability analysis,
+            a MultiDiGraph, a CompactGraph or a PreparedGraph.
+        start_vertices, end_vertices, target_nonterminal: Optional goal,
+            see Goal-directed mode of hellings.
 
     Returns:
         Set[Tuple[int, Variable, int]]: A set of triples (start_vertex, nonterminal, end_vertex)
@@ -111,71 +294,253 @@ def matrix(cfg: Union[str, CFG], graph: MultiDiGraph) -> Set[Tuple]:
         return set()
 
     cfg = to_weak_cfg(cfg)
-    node_to_idx = {v: i for i, v in enumerate(graph.nodes)}
-    n = graph.number_of_nodes()
-    T = {var: dok_matrix((n, n), dtype=bool) for var in cfg.variables}
+    graph_matrix = build_graph_matrix(graph)
+    n = graph_matrix.num_states
+    T = {var: csr_matrix((n, n), dtype=bool) for var in cfg.variables}
+    # Productions A -> B C indexed by their body pair (B, C)
+    pair_to_heads = defaultdict(set)
 
     for production in cfg.productions:
         var = production.head
         if len(production.body) == 0:
-            for i in range(n):
-                T[var][i][i] = True
+            T[var] = T[var] + identity(n, dtype=bool, format="csr")
         elif len(production.body) == 1:
-            terminal = production.body[0]
-            for u, v, s in graph.edges.data(data="label"):
-                if Variable(s) == terminal:
-                    i, j = node_to_idx[u], node_to_idx[v]
-                    T[var][i, j] = True
-
-    while True:
-        changed = False
-        for production in cfg.productions:
-            var = production.head
-            if len(production.body) != 2:
+            label = Symbol(production.body[0].value)
+            if label in graph_matrix.adj_matrices:
+                T[var] = T[var] + graph_matrix.adj_matrices[label]
+        elif len(production.body) == 2:
+            pair_to_heads[tuple(production.body)].add(var)
+
+    # Rows of the vertices a nonterminal is demanded at in goal-directed mode
+    row_masks = {}
+    if start_vertices is not None:
+        first_nonterms, later_nonterms = defaultdict(set), defaultdict(set)
+        for (var1, var2), heads in pair_to_heads.items():
+            for head in heads:
+                first_nonterms[head].add(var1)
+                later_nonterms[head].add(var2)
+        masks = _demanded_vertices(
+            graph_matrix,
+            start_vertices,
+            cfg.variables if target_nonterminal is None else [target_nonterminal],
+            first_nonterms,
+            later_nonterms,
+        )
+        for var in T:
+            row_masks[var] = _diagonal(masks.get(var, np.zeros(n, dtype=bool)))
+            T[var] = row_masks[var] @ T[var]
+    goal = _Goal(graph_matrix.states, start_vertices, end_vertices, target_nonterminal)
+
+    # Semi-naive iteration: every round joins only the facts found in the previous
+    # one, a body pair is skipped if neither of its nonterminals is dirty
+    delta = dict(T)
+    while any(d.nnz for d in delta.values()):
+        found = defaultdict(list)
+        for (var1, var2), heads in pair_to_heads.items():
+            if not delta[var1].nnz and not delta[var2].nnz:
                 continue
-            for var1 in T:
-                for var2 in T:
-                    if [var1, var2] != production.body:
-                        continue
-
-                    new_matrix = T[var] + T[var1] @ T[var2]
-                    if not (new_matrix - T[var]).nnz == 0:
-                        changed = True
-                    T[var] = new_matrix
-
-        if not changed:
+            new_facts = delta[var1] @ T[var2] + T[var1] @ delta[var2]
+            for head in heads:
+                found[head].append(new_facts)
+        delta = {var: csr_matrix((n, n), dtype=bool) for var in T}
+        for var, facts in found.items():
+            new_facts = reduce(operator.add, facts)
+            if var in row_masks:
+                new_facts = row_masks[var] @ new_facts
+            delta[var] = new_facts > T[var]
+        for var, d in delta.items():
+            if d.nnz:
+                T[var] = T[var] + d
+        if goal.reached_by_matrix(T.get(target_nonterminal)):
             break
 
     result = set()
-    nodes = list(graph.nodes)
+    nodes = graph_matrix.states
     for var in cfg.variables:
         u, v = T[var].nonzero()
-        for i in range(len(u)):
-            result.add((nodes[u[i]], var, nodes[v[i]]))
+        result.update((nodes[i], var, nodes[j]) for i, j in zip(u, v))
     return result
 
 
 def matrix_from_file(cfg: Union[str, CFG], path_to_graph: str) -> Set[Tuple]:
-    graph = MultiDiGraph()
-    with open(path_to_graph, "r") as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                source_node, target_node, edge_label = line.split()
-                graph.add_edge(int(source_node), int(target_node), label=edge_label)
-    return matrix(cfg, graph)
+    return matrix(cfg, read_edge_list(path_to_graph))
 
 
 def matrix_from_pydot(cfg: Union[str, CFG], dot_file: str) -> Set[Tuple]:
     return matrix(cfg, nx_pydot.from_pydot(dot_file))
 
 
-solver_algo_map = {"hellings": hellings, "matrix": matrix}
+def tensor(
+    cfg: Union[str, CFG],
+    graph: QueryGraph,
+    start_vertices: Optional[Collection] = None,
+    end_vertices: Optional[Collection] = None,
+    target_nonterminal: Optional[Variable] = None,
+) -> Set[Tuple]:
+    """
+    Computes the reachability information for all pairs of vertices in the given graph and context-free grammar
+    based on a tensor (Kronecker product) algorithm.
+    The grammar is turned into a recursive automaton, so no normal form is needed.
+
+    Args:
+        cfg(CFG): The context-free grammar (CFG) to use for reachability analysis.
+        graph(QueryGraph): The directed graph on which to perform reachability analysis,
+            a MultiDiGraph, a CompactGraph or a PreparedGraph.
+        start_vertices, end_vertices, target_nonterminal: Optional goal,
+            see Goal-directed mode of hellings.
+
+    Returns:
+        Set[Tuple[int, Variable, int]]: A set of triples (start_vertex, nonterminal, end_vertex)
+        representing the reachability information for all pairs of vertices in the graph
+        and all nonterminals of the original grammar.
+    """
+    if isinstance(cfg, str):
+        cfg = cfg_from_text(cfg)
+    if graph.number_of_nodes() == 0:
+        return set()
+
+    rfa = ExtendedCFG.from_cfg(cfg).to_rfa()
+    rfa_matrix = BooleanAdjacencyMatrix.from_rfa(rfa)
+    graph_matrix = build_graph_matrix(graph)
+    n = graph_matrix.num_states
+    labels = {var: Symbol(var.value) for var in rfa.boxes}
+
+    # Vertices the edges of a nonterminal may start at in goal-directed mode
+    row_masks = {}
+    if start_vertices is not None:
+        box_nonterms = {label: var for var, label in labels.items()}
+        first_nonterms, later_nonterms = defaultdict(set), defaultdict(set)
+        for var, box in rfa.boxes.items():
+            for state, transitions in box.to_dict().items():
+                for label in transitions:
+                    if label in box_nonterms:
+                        later_nonterms[var].add(box_nonterms[label])
+                        if state in box.start_states:
+                            first_nonterms[var].add(box_nonterms[label])
+        masks = _demanded_vertices(
+            graph_matrix,
+            start_vertices,
+            rfa.boxes if target_nonterminal is None else [target_nonterminal],
+            first_nonterms,
+            later_nonterms,
+        )
+        row_masks = {
+            labels[var]: masks.get(var, np.zeros(n, dtype=bool)) for var in labels
+        }
+    goal = _Goal(graph_matrix.states, start_vertices, end_vertices, target_nonterminal)
+
+    # Nonterminals deriving the empty word connect every vertex with itself
+    eps_edges = {
+        labels[var]: _diagonal(row_masks.get(labels[var], np.ones(n, dtype=bool)))
+        for var, box in rfa.boxes.items()
+        if any(state in box.final_states for state in box.start_states)
+    }
+    _add_edges(graph_matrix, eps_edges)
+
+    adjacency = graph_matrix.get_intersection(rfa_matrix).adj_matrices.values()
+    tc = reduce(
+        operator.add,
+        adjacency,
+        csr_matrix((n * rfa_matrix.num_states,) * 2, dtype=bool),
+    )
+    tc, _ = transitive_closure(tc)
+    new_paths = tc
+    while True:
+        new_edges = _nonterminal_edges(
+            new_paths, graph_matrix, rfa_matrix, labels, row_masks
+        )
+        if not new_edges:
+            break
+        _add_edges(graph_matrix, new_edges)
+        if target_nonterminal in labels and goal.reached_by_matrix(
+            graph_matrix.adj_matrices.get(labels[target_nonterminal])
+        ):
+            break
+        delta = reduce(
+            operator.add,
+            (
+                kron(edges, rfa_matrix.adj_matrices[label], format="csr")
+                for label, edges in new_edges.items()
+                if label in rfa_matrix.adj_matrices
+            ),
+            csr_matrix(tc.shape, dtype=bool),
+        )
+        tc, new_paths = extend_transitive_closure(tc, delta)
+
+    nodes = graph_matrix.states
+    result = set()
+    for var, label in labels.items():
+        if label in graph_matrix.adj_matrices:
+            u, v = graph_matrix.adj_matrices[label].nonzero()
+            result.update((nodes[i], var, nodes[j]) for i, j in zip(u, v))
+    return result
+
+
+def tensor_from_file(cfg: Union[str, CFG], path_to_graph: str) -> Set[Tuple]:
+    return tensor(cfg, read_edge_list(path_to_graph))
+
+
+def tensor_from_pydot(cfg: Union[str, CFG], dot_file: str) -> Set[Tuple]:
+    return tensor(cfg, nx_pydot.from_pydot(dot_file))
+
+
+def _nonterminal_edges(
+    paths: Matrix,
+    graph_matrix: BooleanAdjacencyMatrix,
+    rfa_matrix: BooleanAdjacencyMatrix,
+    labels: Dict[Variable, Symbol],
+    row_masks: Dict[Symbol, np.ndarray],
+) -> Dict[Symbol, csr_matrix]:
+    """
+    Finds the paths of the intersection that go from a start state to a final state
+    of the same RFA box and returns the nonterminal edges of the graph they derive
+    which are not in the graph matrix yet.
+    If a label has a row mask, only the edges from the masked vertices are kept.
+    """
+    n = graph_matrix.num_states
+    rfa_boxes = np.array([labels[state.value[0]] for state in rfa_matrix.states])
+    rfa_starts = rfa_matrix.start_states.toarray()[0]
+    rfa_finals = rfa_matrix.final_states.toarray()[0]
+
+    rows, cols = paths.nonzero()
+    u, start = np.divmod(rows, rfa_matrix.num_states)
+    v, final = np.divmod(cols, rfa_matrix.num_states)
+    derived = (
+        rfa_starts[start] & rfa_finals[final] & (rfa_boxes[start] == rfa_boxes[final])
+    )
+    new_edges = {}
+    for label in set(rfa_boxes[start[derived]]):
+        in_box = derived & (rfa_boxes[start] == label)
+        if label in row_masks:
+            in_box &= row_masks[label][u]
+        edges = coo_matrix(
+            (np.ones(np.count_nonzero(in_box), dtype=bool), (u[in_box], v[in_box])),
+            shape=(n, n),
+        ).tocsr()
+        if label in graph_matrix.adj_matrices:
+            edges = edges > graph_matrix.adj_matrices[label]
+        if edges.nnz:
+            new_edges[label] = edges
+    return new_edges
+
+
+def _add_edges(
+    graph_matrix: BooleanAdjacencyMatrix, new_edges: Dict[Symbol, Matrix]
+) -> None:
+    # Adds the nonterminal edges to the per-label matrices of the graph
+    for label, edges in new_edges.items():
+        if label in graph_matrix.adj_matrices:
+            graph_matrix.adj_matrices[label] = graph_matrix.adj_matrices[label] + edges
+        else:
+            graph_matrix.adj_matrices[label] = edges
+
+
+solver_algo_map = {"hellings": hellings, "matrix": matrix, "tensor": tensor}
 
 
 def reachability_with_nonterminal(
     grammar: Union[str, CFG],
-    graph: MultiDiGraph,
+    graph: QueryGraph,
     start_vertices: Set,
     end_vertices: Set,
     target_nonterminal: Variable,
@@ -184,12 +549,15 @@ def reachability_with_nonterminal(
     """
     Computes the reachability information for the specified start and end vertices
     and the given nonterminal in the context-free grammar.
+    Only the part of the grammar and of the graph relevant to the request is passed
+    to the solver, which runs in its goal-directed mode.
 
     Args:
         algo: A method that solves the problem of reachability between all pairs of vertices
               for a given graph and a given context-free grammar
         grammar(CFG): The context-free grammar (CFG) to use for reachability analysis.
-        graph(MultiDiGraph): The directed graph on which to perform reachability analysis.
+        graph(QueryGraph): The directed graph on which to perform reachability analysis,
+            a MultiDiGraph, a CompactGraph or a PreparedGraph.
         start_vertices(Set[int]): A set of start vertices for which to compute reachability.
         end_vertices(Set[int]): A set of end vertices for which to compute reachability.
         target_nonterminal(Variable): The nonterminal to consider for reachability analysis.
@@ -201,7 +569,13 @@ def reachability_with_nonterminal(
     if isinstance(grammar, str):
         grammar = cfg_from_text(grammar)
 
-    reachability = solver_algo_map[algo](grammar, graph)
+    # Only the nonterminals the target depends on and only the vertices
+    # that lie on some path from a start vertex to an end vertex are needed
+    grammar = _restrict_to_nonterminal(grammar, target_nonterminal)
+    graph = _relevant_subgraph(graph, grammar, start_vertices, end_vertices)
+    reachability = solver_algo_map[algo](
+        grammar, graph, start_vertices, end_vertices, target_nonterminal
+    )
 
     filtered_reachability = {
         (src, dest)
@@ -212,3 +586,167 @@ def reachability_with_nonterminal(
     }
 
     return filtered_reachability
+
+
+class _Goal:
+    """
+    The pairs requested in goal-directed mode. Tracks how many of them are derived,
+    so that the solvers can stop as soon as all of them are.
+    """
+
+    def __init__(
+        self,
+        vertices: Collection,
+        start_vertices: Optional[Collection],
+        end_vertices: Optional[Collection],
+        target_nonterminal: Optional[Variable],
+    ):
+        self.active = None not in (start_vertices, end_vertices, target_nonterminal)
+        if not self.active:
+            return
+        index = {v: i for i, v in enumerate(vertices)}
+        self.start_vertices = {v for v in start_vertices if v in index}
+        self.end_vertices = {v for v in end_vertices if v in index}
+        self.start_rows = [index[v] for v in self.start_vertices]
+        self.end_cols = [index[v] for v in self.end_vertices]
+        self.target_nonterminal = target_nonterminal
+        self.requested = len(self.start_vertices) * len(self.end_vertices)
+        self.derived = 0
+
+    def add(self, i, var: Variable, j) -> None:
+        if (
+            self.active
+            and var == self.target_nonterminal
+            and i in self.start_vertices
+            and j in self.end_vertices
+        ):
+            self.derived += 1
+
+    def reached(self) -> bool:
+        return self.active and self.derived == self.requested
+
+    def reached_by_matrix(self, target_matrix: Optional[Matrix]) -> bool:
+        # Checks whether the target relation contains all requested pairs
+        if not self.active or target_matrix is None:
+            return self.active and self.requested == 0
+        requested = target_matrix[self.start_rows][:, self.end_cols]
+        return requested.count_nonzero() == self.requested
+
+
+def _restrict_to_nonterminal(cfg: CFG, target: Variable) -> CFG:
+    # Keeps only the productions of the nonterminals the target depends on
+    productions = defaultdict(list)
+    for production in cfg.productions:
+        productions[production.head].append(production)
+    needed = {target}
+    stack = [target]
+    while stack:
+        for production in productions[stack.pop()]:
+            for symbol in production.body:
+                if isinstance(symbol, Variable) and symbol not in needed:
+                    needed.add(symbol)
+                    stack.append(symbol)
+    return CFG(
+        start_symbol=target,
+        productions={p for p in cfg.productions if p.head in needed},
+    )
+
+
+def _relevant_subgraph(
+    graph: QueryGraph, cfg: CFG, start_vertices: Collection, end_vertices: Collection
+) -> LabeledGraph:
+    """
+    Returns the subgraph induced by the vertices reachable from start_vertices
+    and reaching end_vertices by the edges labeled with terminals of the grammar.
+    Every path between the requested vertices lies in it.
+    For a PreparedGraph it is sliced from the prepared matrices.
+    """
+    graph_matrix = build_graph_matrix(graph)
+    n = graph_matrix.num_states
+    labels = {Symbol(terminal.value) for terminal in cfg.terminals}
+    adjacency = reduce(
+        operator.add,
+        (m for label, m in graph_matrix.adj_matrices.items() if label in labels),
+        csr_matrix((n, n), dtype=bool),
+    )
+    forward = _reachable_vertices(
+        adjacency, _vertex_mask(graph_matrix.states, start_vertices)
+    )
+    backward = _reachable_vertices(
+        adjacency.T.tocsr(), _vertex_mask(graph_matrix.states, end_vertices)
+    )
+    kept = np.flatnonzero(forward & backward)
+    if isinstance(graph, PreparedGraph):
+        return graph.compact_subgraph(kept)
+    nodes = graph_matrix.states
+    return graph.subgraph(nodes[i] for i in kept)
+
+
+def _demanded_vertices(
+    graph_matrix: BooleanAdjacencyMatrix,
+    start_vertices: Collection,
+    roots: Iterable[Variable],
+    first_nonterms: Dict[Variable, Set[Variable]],
+    later_nonterms: Dict[Variable, Set[Variable]],
+) -> Dict[Variable, np.ndarray]:
+    """
+    Over-approximates the vertices the derivations of every nonterminal can start at
+    when only the paths from start_vertices are requested for the roots.
+    A nonterminal that begins a body of a head starts where the head starts,
+    any other nonterminal of the body starts at a vertex reachable from there.
+
+    Returns:
+        A boolean mask over the rows of graph_matrix for every demanded nonterminal.
+    """
+    n = graph_matrix.num_states
+    adjacency = reduce(
+        operator.add,
+        graph_matrix.adj_matrices.values(),
+        csr_matrix((n, n), dtype=bool),
+    )
+    seeds = _vertex_mask(graph_matrix.states, start_vertices)
+    demand = {var: seeds.copy() for var in roots}
+
+    def extend(var: Variable, mask: np.ndarray) -> bool:
+        current = demand.get(var, np.zeros(n, dtype=bool))
+        extended = current | mask
+        demand[var] = extended
+        return bool((extended != current).any())
+
+    changed = True
+    while changed:
+        changed = False
+        for var in list(demand):
+            for first in first_nonterms.get(var, ()):
+                changed |= extend(first, demand[var])
+            if later_nonterms.get(var):
+                reachable = _reachable_vertices(adjacency, demand[var])
+                for later in later_nonterms[var]:
+                    changed |= extend(later, reachable)
+    return demand
+
+
+def _diagonal(mask: np.ndarray) -> csr_matrix:
+    # Boolean diagonal matrix of the mask, multiplying by it keeps the masked rows
+    indices = np.flatnonzero(mask)
+    data = np.ones(len(indices), dtype=bool)
+    return csr_matrix((data, (indices, indices)), shape=(len(mask), len(mask)))
+
+
+def _vertex_mask(vertices: List, selected: Collection) -> np.ndarray:
+    # Boolean mask of the selected vertices over the list of vertices
+    selected = set(selected)
+    return np.fromiter(
+        (v in selected for v in vertices), dtype=bool, count=len(vertices)
+    )
+
+
+def _reachable_vertices(adjacency: csr_matrix, seeds: np.ndarray) -> np.ndarray:
+    # Vertices reachable from the seeds by zero or more edges, as a boolean mask
+    visited = seeds.copy()
+    front = seeds
+    adjacency_t = adjacency.T.tocsr()
+    while front.any():
+        front = (adjacency_t @ front).astype(bool) & ~visited
+        visited |= front
+    return visited
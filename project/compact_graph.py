@@ -0,0 +1,333 @@
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from networkx import MultiDiGraph
+from scipy.sparse import coo_matrix, csr_matrix
+
+
+class CompactGraph:
+    """
+    Labeled directed graph stored as one boolean CSR matrix per label.
+
+    Vertices are numbered 0..n-1, vertices[i] is the original id of the i-th vertex.
+    Labels are interned: every distinct label string owns one matrix.
+    Exposes the read-only part of the MultiDiGraph interface used by the solvers
+    (nodes, edges(data="label"), number_of_nodes, number_of_edges, subgraph),
+    so it can be passed wherever a MultiDiGraph is accepted.
+    Parallel edges with the same label are stored once.
+    """
+
+    def __init__(self, vertices: Iterable[Any], label_matrices: Dict[str, csr_matrix]):
+        self.vertices = np.asarray(vertices)
+        n = len(self.vertices)
+        self.label_matrices = {}
+        for label, matrix in label_matrices.items():
+            if matrix.shape != (n, n):
+                raise ValueError(
+                    f"Matrix of label {label} has shape {matrix.shape}, expected {(n, n)}"
+                )
+            if not isinstance(matrix, csr_matrix) or matrix.dtype != bool:
+                matrix = csr_matrix(matrix, dtype=bool)
+            matrix.sum_duplicates()
+            self.label_matrices[label] = matrix
+        self._nodes = None
+        self._index = None
+
+    @property
+    def nodes(self) -> List[Any]:
+        if self._nodes is None:
+            self._nodes = self.vertices.tolist()
+        return self._nodes
+
+    @property
+    def index(self) -> Dict[Any, int]:
+        # Original vertex id -> position in vertices
+        if self._index is None:
+            self._index = {v: i for i, v in enumerate(self.nodes)}
+        return self._index
+
+    @property
+    def labels(self) -> List[str]:
+        return list(self.label_matrices)
+
+    def __contains__(self, vertex: Any) -> bool:
+        return vertex in self.index
+
+    def __len__(self) -> int:
+        return len(self.vertices)
+
+    def number_of_nodes(self) -> int:
+        return len(self.vertices)
+
+    def number_of_edges(self) -> int:
+        return sum(matrix.nnz for matrix in self.label_matrices.values())
+
+    def edges(self, data: Optional[str] = None) -> Iterator[Tuple]:
+        """
+        Iterates over the edges as (source, target) pairs or, if data is "label",
+        as (source, target, label) triples of original vertex ids.
+        """
+        nodes = self.nodes
+        for label, matrix in self.label_matrices.items():
+            sources, targets = matrix.nonzero()
+            for u, v in zip(sources.tolist(), targets.tolist()):
+                if data == "label":
+                    yield nodes[u], nodes[v], label
+                else:
+                    yield nodes[u], nodes[v]
+
+    def subgraph(self, vertices: Iterable[Any]) -> "CompactGraph":
+        # Returns the subgraph induced by the given vertices
+        index = self.index
+        kept = np.fromiter(
+            sorted({index[v] for v in vertices if v in index}), dtype=np.int64
+        )
+        return CompactGraph(
+            self.vertices[kept],
+            {
+                label: matrix[kept][:, kept]
+                for label, matrix in self.label_matrices.items()
+            },
+        )
+
+    @staticmethod
+    def from_graph(graph: MultiDiGraph) -> "CompactGraph":
+        """
+        Converts a MultiDiGraph whose edges have a "label" attribute.
+
+        Args:
+            graph: the graph to convert
+
+        Returns:
+            A CompactGraph with the vertices in graph.nodes order.
+        """
+        vertices = list(graph.nodes)
+        index = {v: i for i, v in enumerate(vertices)}
+        edges = graph.edges(data="label")
+        num_edges = graph.number_of_edges()
+        sources = np.fromiter(
+            (index[u] for u, _, _ in edges), dtype=np.int64, count=num_edges
+        )
+        targets = np.fromiter(
+            (index[v] for _, v, _ in edges), dtype=np.int64, count=num_edges
+        )
+        label_ids = {}
+        edge_labels = np.fromiter(
+            (label_ids.setdefault(label, len(label_ids)) for _, _, label in edges),
+            dtype=np.int64,
+            count=num_edges,
+        )
+        graph_vertices = np.empty(len(vertices), dtype=object)
+        graph_vertices[:] = vertices
+        return CompactGraph(
+            graph_vertices,
+            _group_by_label(
+                sources, targets, edge_labels, list(label_ids), len(vertices)
+            ),
+        )
+
+    def to_networkx(self) -> MultiDiGraph:
+        graph = MultiDiGraph()
+        graph.add_nodes_from(self.nodes)
+        graph.add_edges_from((u, v, {"label": l}) for u, v, l in self.edges("label"))
+        return graph
+
+
+LabeledGraph = Union[MultiDiGraph, CompactGraph]
+
+COMPACT_FORMAT_VERSION = 1
+
+# Arrays of the binary format, every one is stored as <name>.npy in the graph directory
+_FORMAT_ARRAYS = (
+    "version",
+    "vertices",
+    "labels",
+    "offsets",
+    "indptr",
+    "indices",
+    "data",
+)
+
+
+def save_compact(graph: CompactGraph, path: str) -> None:
+    """
+    Writes a CompactGraph in the binary format: a directory of .npy arrays.
+
+    - vertices: the original vertex ids (integers or strings)
+    - labels: the label dictionary, labels[k] owns the k-th matrix
+    - indptr: a (len(labels), n + 1) array, the CSR row pointers of every label
+    - indices, data: the CSR column indices and values of all labels concatenated,
+      offsets[k]:offsets[k + 1] is the slice of the k-th label
+
+    Args:
+        graph: the graph to write
+        path: the directory to write to, created if missing
+    """
+    vertices = graph.vertices
+    if vertices.dtype == object:
+        kinds = {type(v) for v in graph.nodes}
+        if kinds <= {int}:
+            vertices = vertices.astype(np.int64)
+        elif kinds <= {str}:
+            vertices = vertices.astype(str)
+        else:
+            raise ValueError(f"Vertex ids must be integers or strings, got {kinds}")
+    matrices = list(graph.label_matrices.values())
+    n = graph.number_of_nodes()
+    # scipy keeps int32 index arrays as they are, so the matrices can stay views
+    largest = max([n] + [m.nnz for m in matrices])
+    index_dtype = np.int32 if largest < np.iinfo(np.int32).max else np.int64
+    arrays = {
+        "version": np.array([COMPACT_FORMAT_VERSION]),
+        "vertices": vertices,
+        "labels": np.array(graph.labels, dtype=str),
+        "offsets": np.cumsum([0] + [m.nnz for m in matrices], dtype=np.int64),
+        "indptr": np.array([m.indptr for m in matrices], dtype=index_dtype).reshape(
+            len(matrices), n + 1
+        ),
+        "indices": np.concatenate(
+            [m.indices for m in matrices] + [np.empty(0, dtype=index_dtype)]
+        ).astype(index_dtype),
+        "data": np.ones(graph.number_of_edges(), dtype=bool),
+    }
+    os.makedirs(path, exist_ok=True)
+    for name in _FORMAT_ARRAYS:
+        np.save(os.path.join(path, f"{name}.npy"), arrays[name], allow_pickle=False)
+
+
+def load_compact(path: str, mmap: bool = True) -> CompactGraph:
+    """
+    Opens a graph written by save_compact.
+
+    Args:
+        path: the graph directory
+        mmap: whether to memory-map the arrays read-only instead of reading them,
+            opening then costs O(number of labels) and the pages are shared
+            between all processes that open the same graph
+
+    Returns:
+        A CompactGraph whose matrices are views of the stored arrays.
+    """
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name: np.load(
+            os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False
+        )
+        for name in _FORMAT_ARRAYS
+    }
+    version = int(arrays["version"][0])
+    if version != COMPACT_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported graph format version {version}, expected {COMPACT_FORMAT_VERSION}"
+        )
+    n = len(arrays["vertices"])
+    offsets = np.asarray(arrays["offsets"])
+    label_matrices = {}
+    for k, label in enumerate(arrays["labels"].tolist()):
+        begin, end = offsets[k], offsets[k + 1]
+        matrix = csr_matrix(
+            (
+                arrays["data"][begin:end],
+                arrays["indices"][begin:end],
+                arrays["indptr"][k],
+            ),
+            shape=(n, n),
+            copy=False,
+        )
+        # Stored matrices are canonical, this saves a scan over the indices
+        matrix.has_canonical_format = True
+        label_matrices[label] = matrix
+    return CompactGraph(arrays["vertices"], label_matrices)
+
+
+def read_edge_list(path: str, chunk_size: int = 1 << 20) -> CompactGraph:
+    """
+    Reads a graph with one "source_node target_node edge_label" edge per line
+    without building a MultiDiGraph.
+
+    The file is parsed in chunks of about chunk_size bytes, every chunk is
+    tokenized at once and its labels are interned to integer ids, so only
+    the integer edge arrays of the whole file are kept in memory.
+
+    Args:
+        path: the path to the edge list, vertex ids must be integers
+        chunk_size: the approximate number of bytes parsed at once
+
+    Returns:
+        A CompactGraph with the vertices in increasing id order.
+
+    Raises:
+        ValueError: if a non-blank line does not have exactly three fields.
+    """
+    label_ids = {}
+    sources, targets, edge_labels = [], [], []
+    line_number = 0
+    with open(path, "r") as f:
+        while True:
+            lines = f.readlines(chunk_size)
+            if not lines:
+                break
+            fields = []
+            for line_number, line in enumerate(lines, line_number + 1):
+                line_fields = line.split()
+                if not line_fields:
+                    continue
+                if len(line_fields) != 3:
+                    raise ValueError(
+                        f"Line {line_number} of {path} must have exactly 3 fields, "
+                        f"got {len(line_fields)}: {line.strip()!r}"
+                    )
+                fields.append(line_fields)
+            if not fields:
+                continue
+            tokens = np.array(fields)
+            sources.append(tokens[:, 0].astype(np.int64))
+            targets.append(tokens[:, 1].astype(np.int64))
+            chunk_labels, inverse = np.unique(tokens[:, 2], return_inverse=True)
+            ids = np.fromiter(
+                (label_ids.setdefault(str(l), len(label_ids)) for l in chunk_labels),
+                dtype=np.int64,
+                count=len(chunk_labels),
+            )
+            edge_labels.append(ids[inverse.reshape(-1)])
+
+    if not sources:
+        return CompactGraph(np.empty(0, dtype=np.int64), {})
+    sources = np.concatenate(sources)
+    targets = np.concatenate(targets)
+    vertices, endpoints = np.unique(
+        np.concatenate([sources, targets]), return_inverse=True
+    )
+    endpoints = endpoints.reshape(-1)
+    num_edges = len(sources)
+    return CompactGraph(
+        vertices,
+        _group_by_label(
+            endpoints[:num_edges],
+            endpoints[num_edges:],
+            np.concatenate(edge_labels),
+            list(label_ids),
+            len(vertices),
+        ),
+    )
+
+
+def _group_by_label(
+    sources: np.ndarray,
+    targets: np.ndarray,
+    edge_labels: np.ndarray,
+    label_names: List[str],
+    num_vertices: int,
+) -> Dict[str, csr_matrix]:
+    # Builds one boolean csr matrix per label from index arrays
+    order = np.argsort(edge_labels, kind="stable")
+    bounds = np.flatnonzero(np.diff(edge_labels[order])) + 1
+    matrices = {}
+    for group in np.split(order, bounds) if len(order) else []:
+        data = np.ones(len(group), dtype=bool)
+        matrices[label_names[edge_labels[group[0]]]] = coo_matrix(
+            (data, (sources[group], targets[group])),
+            shape=(num_vertices, num_vertices),
+        ).tocsr()
+    return matrices
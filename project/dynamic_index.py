@@ -0,0 +1,434 @@
+import operator
+from collections import Counter, defaultdict
+from functools import reduce
+from typing import Any, Collection, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import numpy as np
+from pyformlang.cfg import CFG, Variable
+from scipy.sparse import coo_matrix, csr_matrix
+
+from project.boolean_adjacency_matrix import (
+    extend_transitive_closure,
+    shrink_transitive_closure,
+)
+from project.cfg_utils import cfg_from_text, to_weak_cfg
+from project.compact_graph import LabeledGraph
+from project.fa_building import compile_regex
+
+# An edge as given by graph.edges(data="label")
+Edge = Tuple[Any, Any, str]
+
+
+class _DynamicGraphIndex:
+    """
+    Bookkeeping shared by the dynamic indexes: the vertex <-> index mapping and
+    the multiplicity of every edge, so that a parallel edge keeps its facts alive
+    until its last copy is deleted.
+    The matrices of the subclasses have a capacity that doubles when the vertices
+    do not fit, so adding vertices one by one costs amortized O(1) resizes.
+    """
+
+    def __init__(self):
+        self.vertices = []
+        self.index = {}
+        self.capacity = 0
+        self._edge_counts = Counter()
+        # (source index, target index) -> labels of the edges between them
+        self._pair_labels = defaultdict(set)
+
+    def add_vertices(self, vertices: Iterable[Any]) -> None:
+        new_vertices = []
+        for v in vertices:
+            if v not in self.index:
+                self.index[v] = len(self.vertices)
+                self.vertices.append(v)
+                new_vertices.append(self.index[v])
+        if len(self.vertices) > self.capacity:
+            self.capacity = max(len(self.vertices), 2 * self.capacity)
+            self._resize(self.capacity)
+        if new_vertices:
+            self._on_new_vertices(np.array(new_vertices, dtype=np.int64))
+
+    def insert_edges(self, edges: Iterable[Edge]) -> None:
+        """
+        Adds a batch of (source, target, label) edges, only the facts derived
+        through the edges that were not in the graph yet are computed.
+        """
+        edges = list(edges)
+        self.add_vertices(v for u, w, _ in edges for v in (u, w))
+        added = []
+        for edge in edges:
+            self._edge_counts[edge] += 1
+            if self._edge_counts[edge] == 1:
+                added.append(edge)
+                self._pair_labels[(self.index[edge[0]], self.index[edge[1]])].add(
+                    edge[2]
+                )
+        if added:
+            self._on_insert(self._group_by_label(added))
+
+    def delete_edges(self, edges: Iterable[Edge]) -> None:
+        """
+        Removes a batch of (source, target, label) edges, one copy of a parallel edge each.
+        The facts that may depend on them are deleted and those still derivable are rederived.
+
+        Raises:
+            ValueError: if an edge is not in the graph
+        """
+        edges = list(edges)
+        for edge, count in Counter(edges).items():
+            if self._edge_counts.get(edge, 0) < count:
+                raise ValueError(f"Edge {edge} is not in the graph")
+        removed = []
+        for edge in edges:
+            self._edge_counts[edge] -= 1
+            if self._edge_counts[edge] == 0:
+                del self._edge_counts[edge]
+                removed.append(edge)
+                pair = (self.index[edge[0]], self.index[edge[1]])
+                self._pair_labels[pair].discard(edge[2])
+                if not self._pair_labels[pair]:
+                    del self._pair_labels[pair]
+        if removed:
+            self._on_delete(self._group_by_label(removed))
+
+    def has_edge(self, edge: Edge) -> bool:
+        return edge in self._edge_counts
+
+    def _group_by_label(self, edges: List[Edge]) -> Dict[str, csr_matrix]:
+        # One capacity x capacity matrix of the given edges per label
+        by_label = defaultdict(list)
+        for u, v, label in edges:
+            by_label[label].append((self.index[u], self.index[v]))
+        return {
+            label: self._matrix(np.array(pairs, dtype=np.int64).reshape(-1, 2).T)
+            for label, pairs in by_label.items()
+        }
+
+    def _matrix(self, indices: np.ndarray) -> csr_matrix:
+        # A capacity x capacity matrix with the cells given by a (2, k) index array
+        rows, cols = indices
+        return coo_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)),
+            shape=(self.capacity, self.capacity),
+        ).tocsr()
+
+    def _resize(self, capacity: int) -> None:
+        raise NotImplementedError
+
+    def _on_new_vertices(self, new_vertices: np.ndarray) -> None:
+        pass
+
+    def _on_insert(self, added: Dict[str, csr_matrix]) -> None:
+        raise NotImplementedError
+
+    def _on_delete(self, removed: Dict[str, csr_matrix]) -> None:
+        raise NotImplementedError
+
+
+class DynamicRPQIndex(_DynamicGraphIndex):
+    """
+    Answers of a regular path query that are kept up to date while the graph changes.
+
+    The transitive closure of the intersection of the graph and the minimal DFA of
+    the regex is maintained: insertions extend it by the paths through the new edges
+    only, deletions delete the paths that may go through the removed edges and
+    rederive the ones still valid (DRed). The answers are updated from the changed
+    paths, so results() costs O(number of answers).
+    The answers are the same as regular_query(regex, graph, start_vertices, final_vertices).
+    """
+
+    def __init__(
+        self,
+        regex: str,
+        graph: Optional[LabeledGraph] = None,
+        start_vertices: Optional[Collection] = None,
+        final_vertices: Optional[Collection] = None,
+    ):
+        super().__init__()
+        dfa_matrix = compile_regex(regex).matrix("csr")
+        self._num_dfa_states = dfa_matrix.num_states
+        self._dfa = {label.value: m for label, m in dfa_matrix.adj_matrices.items()}
+        self._dfa_starts = dfa_matrix.start_states.nonzero()[1]
+        self._dfa_finals = dfa_matrix.final_states.nonzero()[1]
+        self._start_vertices = None if start_vertices is None else set(start_vertices)
+        self._final_vertices = None if final_vertices is None else set(final_vertices)
+        self._is_start = np.zeros(0, dtype=bool)
+        self._is_final = np.zeros(0, dtype=bool)
+        self._adjacency = csr_matrix((0, 0), dtype=bool)
+        self._tc = csr_matrix((0, 0), dtype=bool)
+        self._answers = set()
+        if graph is not None:
+            self.add_vertices(graph.nodes)
+            self.insert_edges(graph.edges(data="label"))
+
+    def results(self) -> Set[Tuple[Any, Any]]:
+        # The (start vertex, final vertex) pairs connected by a path matching the regex
+        return set(self._answers)
+
+    def _resize(self, capacity: int) -> None:
+        size = capacity * self._num_dfa_states
+        for name in ("_adjacency", "_tc"):
+            matrix = getattr(self, name).copy()
+            matrix.resize((size, size))
+            setattr(self, name, matrix)
+        self._is_start = _padded(self._is_start, capacity)
+        self._is_final = _padded(self._is_final, capacity)
+
+    def _on_new_vertices(self, new_vertices: np.ndarray) -> None:
+        for mask, selected in (
+            (self._is_start, self._start_vertices),
+            (self._is_final, self._final_vertices),
+        ):
+            mask[new_vertices] = [
+                selected is None or self.vertices[i] in selected for i in new_vertices
+            ]
+
+    def _product(self, edges: Dict[str, csr_matrix]) -> csr_matrix:
+        # Edges of the intersection, vertex u in DFA state p is the index u * Q + p
+        size = self.capacity * self._num_dfa_states
+        products = [
+            _kron(matrix, self._dfa[label], size)
+            for label, matrix in edges.items()
+            if label in self._dfa
+        ]
+        return reduce(operator.add, products, csr_matrix((size, size), dtype=bool))
+
+    def _on_insert(self, added: Dict[str, csr_matrix]) -> None:
+        delta = self._product(added) > self._adjacency
+        if not delta.nnz:
+            return
+        self._adjacency = self._adjacency + delta
+        self._tc, new_paths = extend_transitive_closure(self._tc, delta)
+        self._answers.update(self._accepted_pairs(new_paths))
+
+    def _on_delete(self, removed: Dict[str, csr_matrix]) -> None:
+        # An edge of the intersection stays if another label between the same
+        # vertices moves the DFA between the same states
+        candidates = self._product(removed)
+        sources, targets = candidates.nonzero()
+        pairs = set(
+            zip(
+                (sources // self._num_dfa_states).tolist(),
+                (targets // self._num_dfa_states).tolist(),
+            )
+        )
+        remaining = defaultdict(list)
+        for pair in pairs:
+            for label in self._pair_labels.get(pair, ()):
+                remaining[label].append(pair)
+        still = self._product(
+            {
+                label: self._matrix(np.array(p, dtype=np.int64).reshape(-1, 2).T)
+                for label, p in remaining.items()
+            }
+        )
+        gone = candidates > still
+        if not gone.nnz:
+            return
+        self._adjacency = self._adjacency > gone
+        self._tc, lost_paths = shrink_transitive_closure(
+            self._tc, self._adjacency, gone
+        )
+        lost = self._accepted_pairs(lost_paths)
+        self._answers -= {pair for pair in lost if not self._is_answer(*pair)}
+
+    def _accepted_pairs(self, paths: csr_matrix) -> Set[Tuple[Any, Any]]:
+        # Pairs of vertices of the paths from a start to a final state of the intersection
+        rows, cols = paths.nonzero()
+        u, p = np.divmod(rows, self._num_dfa_states)
+        v, q = np.divmod(cols, self._num_dfa_states)
+        accepted = (
+            np.isin(p, self._dfa_starts)
+            & np.isin(q, self._dfa_finals)
+            & self._is_start[u]
+            & self._is_final[v]
+        )
+        return {
+            (self.vertices[i], self.vertices[j])
+            for i, j in zip(u[accepted].tolist(), v[accepted].tolist())
+        }
+
+    def _is_answer(self, source: Any, target: Any) -> bool:
+        q = self._num_dfa_states
+        rows = self.index[source] * q + self._dfa_starts
+        cols = self.index[target] * q + self._dfa_finals
+        return bool(self._tc[rows][:, cols].nnz)
+
+
+class DynamicCFPQIndex(_DynamicGraphIndex):
+    """
+    The relations of all nonterminals of a grammar that are kept up to date
+    while the graph changes.
+
+    The relations are the ones of the matrix algorithm on the weak normal form.
+    Insertions propagate only the facts derived through the new edges (semi-naive),
+    deletions delete every fact that may depend on a removed edge and rederive
+    the ones that are still derivable (DRed).
+    results() is the same as matrix(cfg, graph) and reading a relation costs
+    O(number of its facts).
+    """
+
+    def __init__(self, cfg: Union[str, CFG], graph: Optional[LabeledGraph] = None):
+        super().__init__()
+        if isinstance(cfg, str):
+            cfg = cfg_from_text(cfg)
+        self.cfg = to_weak_cfg(cfg)
+        self._term_heads = defaultdict(set)
+        self._epsilon_heads = set()
+        # Productions A -> B C indexed by their body pair (B, C)
+        self._pair_heads = defaultdict(set)
+        for production in self.cfg.productions:
+            body = production.body
+            if len(body) == 0:
+                self._epsilon_heads.add(production.head)
+            elif len(body) == 1:
+                self._term_heads[body[0].value].add(production.head)
+            elif len(body) == 2:
+                self._pair_heads[tuple(body)].add(production.head)
+        self._relations = {
+            var: csr_matrix((0, 0), dtype=bool) for var in self.cfg.variables
+        }
+        self._labels = {}
+        if graph is not None:
+            self.add_vertices(graph.nodes)
+            self.insert_edges(graph.edges(data="label"))
+
+    def relation(self, var: Variable) -> Set[Tuple[Any, Any]]:
+        # The pairs of vertices connected by a path derived from the nonterminal
+        if var not in self._relations:
+            return set()
+        sources, targets = self._relations[var].nonzero()
+        return {
+            (self.vertices[i], self.vertices[j])
+            for i, j in zip(sources.tolist(), targets.tolist())
+        }
+
+    def results(self) -> Set[Tuple[Any, Variable, Any]]:
+        return {(u, var, v) for var in self._relations for u, v in self.relation(var)}
+
+    def _resize(self, capacity: int) -> None:
+        for store in (self._relations, self._labels):
+            for key, matrix in store.items():
+                matrix = matrix.copy()
+                matrix.resize((capacity, capacity))
+                store[key] = matrix
+
+    def _empty(self) -> csr_matrix:
+        return csr_matrix((self.capacity, self.capacity), dtype=bool)
+
+    def _base_facts(self, edges: Dict[str, csr_matrix]) -> Dict[Variable, csr_matrix]:
+        # Facts of the productions A -> a given by the edges of every label
+        facts = defaultdict(list)
+        for label, matrix in edges.items():
+            for var in self._term_heads.get(label, ()):
+                facts[var].append(matrix)
+        return {var: reduce(operator.add, m) for var, m in facts.items()}
+
+    def _on_new_vertices(self, new_vertices: np.ndarray) -> None:
+        if self._epsilon_heads:
+            loops = self._matrix(np.vstack([new_vertices, new_vertices]))
+            self._propagate({var: loops for var in self._epsilon_heads})
+
+    def _on_insert(self, added: Dict[str, csr_matrix]) -> None:
+        for label, matrix in added.items():
+            self._labels[label] = self._labels.get(label, self._empty()) + matrix
+        self._propagate(self._base_facts(added))
+
+    def _propagate(self, facts: Dict[Variable, csr_matrix]) -> None:
+        # Semi-naive iteration: every round joins only the facts found in the previous one
+        T = self._relations
+        delta = {var: self._empty() for var in T}
+        for var, new_facts in facts.items():
+            delta[var] = new_facts > T[var]
+            T[var] = T[var] + delta[var]
+        while any(d.nnz for d in delta.values()):
+            found = defaultdict(list)
+            for (var1, var2), heads in self._pair_heads.items():
+                if not delta[var1].nnz and not delta[var2].nnz:
+                    continue
+                new_facts = delta[var1] @ T[var2] + T[var1] @ delta[var2]
+                for head in heads:
+                    found[head].append(new_facts)
+            delta = {var: self._empty() for var in T}
+            for var, new_facts in found.items():
+                delta[var] = reduce(operator.add, new_facts) > T[var]
+                T[var] = T[var] + delta[var]
+
+    def _on_delete(self, removed: Dict[str, csr_matrix]) -> None:
+        T = self._relations
+        for label, matrix in removed.items():
+            self._labels[label] = self._labels[label] > matrix
+
+        # Over-delete: every fact with a derivation through a deleted fact
+        deleted = {var: self._empty() for var in T}
+        delta = {var: self._empty() for var in T}
+        for var, facts in self._base_facts(removed).items():
+            delta[var] = facts.multiply(T[var]).tocsr()
+            deleted[var] = delta[var]
+        while any(d.nnz for d in delta.values()):
+            found = defaultdict(list)
+            for (var1, var2), heads in self._pair_heads.items():
+                if not delta[var1].nnz and not delta[var2].nnz:
+                    continue
+                suspected = delta[var1] @ T[var2] + T[var1] @ delta[var2]
+                for head in heads:
+                    found[head].append(suspected)
+            delta = {var: self._empty() for var in T}
+            for var, suspected in found.items():
+                suspected = reduce(operator.add, suspected).multiply(T[var]).tocsr()
+                delta[var] = suspected > deleted[var]
+                deleted[var] = deleted[var] + delta[var]
+        for var in T:
+            T[var] = T[var] > deleted[var]
+
+        # Rederive: the deleted facts with a derivation from the remaining ones
+        base = self._base_facts(self._labels)
+        rederived = {}
+        for var, facts in deleted.items():
+            if not facts.nnz:
+                continue
+            derivable = [base[var]] if var in base else []
+            if var in self._epsilon_heads:
+                diagonal = np.arange(len(self.vertices))
+                derivable.append(self._matrix(np.vstack([diagonal, diagonal])))
+            rederived[var] = derivable
+        # Only the rows with deleted facts are joined
+        selectors = {var: _row_selector(deleted[var]) for var in rederived}
+        for (var1, var2), heads in self._pair_heads.items():
+            for head in heads:
+                if head in rederived:
+                    rederived[head].append(selectors[head] @ T[var1] @ T[var2])
+        self._propagate(
+            {
+                var: reduce(operator.add, derivable).multiply(deleted[var]).tocsr()
+                for var, derivable in rederived.items()
+                if derivable
+            }
+        )
+
+
+def _kron(lhs: csr_matrix, rhs: csr_matrix, size: int) -> csr_matrix:
+    # Boolean kron(lhs, rhs) built from the nonzero cells only
+    lhs_rows, lhs_cols = lhs.nonzero()
+    rhs_rows, rhs_cols = rhs.nonzero()
+    q_rows, q_cols = rhs.shape
+    rows = (lhs_rows[:, None] * q_rows + rhs_rows[None, :]).ravel()
+    cols = (lhs_cols[:, None] * q_cols + rhs_cols[None, :]).ravel()
+    return coo_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, cols)), shape=(size, size)
+    ).tocsr()
+
+
+def _row_selector(matrix: csr_matrix) -> csr_matrix:
+    # Diagonal matrix that keeps the nonempty rows of the matrix when multiplied by
+    rows = np.unique(matrix.nonzero()[0])
+    return coo_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, rows)), shape=(matrix.shape[0],) * 2
+    ).tocsr()
+
+
+def _padded(mask: np.ndarray, size: int) -> np.ndarray:
+    padded = np.zeros(size, dtype=bool)
+    padded[: len(mask)] = mask
+    return padded
@@ -47,7 +47,7 @@ class ExtendedCFG:
         production = defaultdict(list)
 
         for prod in cfg.productions:
-            body_str = "".join(str(e.value) for e in prod.body) if prod.body else "$"
+            body_str = " ".join(str(e.value) for e in prod.body) if prod.body else "$"
             production[prod.head].append(body_str)
 
         productions = {
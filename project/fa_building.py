@@ -1,11 +1,19 @@
+import json
+import os
+import tempfile
 import networkx as nx
-from typing import Collection, Optional
+from typing import Collection, Dict, Optional
 from pyformlang.finite_automaton import (
     DeterministicFiniteAutomaton,
     NondeterministicFiniteAutomaton,
+    State,
+    Symbol,
 )
 from pyformlang.regular_expression import Regex
 
+from project.boolean_adjacency_matrix import BooleanAdjacencyMatrix
+from project.lru_cache import CacheInfo, LRUCache
+
 
 def build_minimal_dfa_by_regex(regex: str) -> DeterministicFiniteAutomaton:
     """
@@ -25,6 +33,121 @@ def build_minimal_dfa_by_regex(regex: str) -> DeterministicFiniteAutomaton:
     return minimal_dfa
 
 
+class CompiledRegex:
+    """
+    A regular expression compiled to its minimal DFA, with the BooleanAdjacencyMatrix
+    of the DFA built once per storage backend.
+    Both are shared between all users of the cache and must not be modified.
+    """
+
+    def __init__(self, dfa: DeterministicFiniteAutomaton):
+        self.dfa = dfa
+        self._matrices = {}
+
+    def matrix(self, backend: str = "csr") -> BooleanAdjacencyMatrix:
+        if backend not in self._matrices:
+            self._matrices[backend] = BooleanAdjacencyMatrix(self.dfa, backend=backend)
+        return self._matrices[backend]
+
+
+REGEX_CACHE_SIZE = 512
+
+_regex_cache = LRUCache(REGEX_CACHE_SIZE)
+
+
+def normalize_regex(regex: str) -> str:
+    # Symbols are separated by whitespace, so only its amount can be normalized
+    return " ".join(regex.split())
+
+
+def compile_regex(regex: str) -> CompiledRegex:
+    """
+    Returns the compiled minimal DFA of the regular expression,
+    compiling it only if it is not in the LRU cache yet.
+
+    Args:
+        regex: a string representing the regular expression
+
+    Returns:
+        A CompiledRegex shared with the other callers of the same (normalized) regex.
+    """
+    key = normalize_regex(regex)
+    compiled = _regex_cache.get(key)
+    if compiled is None:
+        compiled = CompiledRegex(build_minimal_dfa_by_regex(key))
+        _regex_cache.put(key, compiled)
+    return compiled
+
+
+def regex_cache_info() -> CacheInfo:
+    return _regex_cache.info()
+
+
+def set_regex_cache_size(maxsize: int):
+    # Changes the number of kept regexes, evicting the least recently used ones if needed
+    _regex_cache.resize(maxsize)
+
+
+def clear_regex_cache():
+    _regex_cache.clear()
+
+
+def save_regex_cache(path: str):
+    """
+    Writes the DFAs of the cached regexes to a JSON file, so that other processes
+    can start with a warm cache by calling load_regex_cache.
+
+    Args:
+        path: the file to write
+    """
+    entries = {
+        key: _dfa_to_dict(compiled.dfa) for key, compiled in _regex_cache.items()
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "w") as f:
+        json.dump(entries, f)
+    os.replace(tmp_path, path)
+
+
+def load_regex_cache(path: str):
+    """
+    Adds the regexes saved by save_regex_cache to the cache.
+
+    Args:
+        path: the file written by save_regex_cache
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    for key, dfa in entries.items():
+        _regex_cache.put(key, CompiledRegex(_dfa_from_dict(dfa)))
+
+
+def _dfa_to_dict(dfa: DeterministicFiniteAutomaton) -> Dict:
+    # States are renumbered, the symbols of a regex DFA are strings
+    numbers = {state: i for i, state in enumerate(dfa.states)}
+    return {
+        "start": [numbers[state] for state in dfa.start_states],
+        "final": [numbers[state] for state in dfa.final_states],
+        "transitions": [
+            [numbers[state], str(symbol.value), numbers[target]]
+            for state, transitions in dfa.to_dict().items()
+            for symbol, target in transitions.items()
+        ],
+    }
+
+
+def _dfa_from_dict(data: Dict) -> DeterministicFiniteAutomaton:
+    dfa = DeterministicFiniteAutomaton()
+    for state in data["start"]:
+        dfa.add_start_state(State(state))
+    for state in data["final"]:
+        dfa.add_final_state(State(state))
+    for state, symbol, target in data["transitions"]:
+        dfa.add_transition(State(state), Symbol(symbol), State(target))
+    return dfa
+
+
 def build_nfa_from_graph(
     graph: nx.MultiDiGraph,
     start: Optional[Collection] = None,
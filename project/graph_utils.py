@@ -1,4 +1,9 @@
-from typing import Tuple, NamedTuple, Set, Union, Iterable, Any
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Tuple, NamedTuple, Set, Union, Iterable, Any, Optional
 
 import networkx.drawing.nx_pydot as nx_pydot
 from networkx import MultiDiGraph
@@ -6,6 +11,8 @@ from pyformlang.cfg import CFG
 import cfpq_data
 
 from project.cfg_utils import to_weak_cfg, cfg_from_text, cfg_from_file
+from project.compact_graph import CompactGraph, LabeledGraph, save_compact, load_compact
+from project.lru_cache import LRUCache
 
 
 class GraphInfo(NamedTuple):
@@ -32,9 +39,74 @@ def get_graph_info(graph: MultiDiGraph) -> GraphInfo:
     return GraphInfo(graph.number_of_nodes(), graph.number_of_edges(), edge_labels)
 
 
+class CachedGraph(NamedTuple):
+    graph: CompactGraph
+    info: GraphInfo
+    checksum: str
+
+
+# Parsed graphs are kept in GRAPH_CACHE_DIR/<graph name>/<checksum of the downloaded data>,
+# GRAPH_CACHE_DIR/<graph name>/CURRENT names the checksum of the latest download
+GRAPH_CACHE_DIR = os.environ.get(
+    "PROJECT_GRAPH_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "project", "graphs"),
+)
+GRAPH_CACHE_SIZE = 8
+
+_graph_cache = LRUCache(GRAPH_CACHE_SIZE)
+
+
+def load_cached_graph(
+    graph_name: str, cache_dir: Optional[str] = None, refresh: bool = False
+) -> CachedGraph:
+    """
+    Returns the graph with the given name from the cfpq_data library, parsed into a CompactGraph.
+
+    A graph is downloaded and parsed once, then it is taken from the in-process
+    LRU cache or memory-mapped from the cache directory, so no network is needed
+    once the cache is warm.
+
+    Args:
+        graph_name: The name of the graph to load.
+        cache_dir: The cache directory, GRAPH_CACHE_DIR if None.
+        refresh: Whether to download the graph again even if it is cached.
+            The parsed graph is still reused if the downloaded data did not change.
+
+    Returns:
+        A CachedGraph with the graph, its statistics and the checksum of the downloaded data.
+    """
+    graph_dir = os.path.join(cache_dir or GRAPH_CACHE_DIR, graph_name)
+    if not refresh:
+        checksum = _read_current_checksum(graph_dir)
+        if checksum is not None:
+            cached = _load_cache_entry(graph_dir, checksum)
+            if cached is not None:
+                return cached
+
+    path_to_graph = cfpq_data.download(graph_name)
+    checksum = _checksum(path_to_graph)
+    cached = _load_cache_entry(graph_dir, checksum)
+    if cached is None:
+        multi_graph = cfpq_data.graph_from_csv(path_to_graph)
+        _write_cache_entry(graph_dir, checksum, multi_graph)
+        cached = _load_cache_entry(graph_dir, checksum)
+    _write_current_checksum(graph_dir, checksum)
+    return cached
+
+
+def clear_graph_cache():
+    # Empties the in-process cache, the cache directory is kept
+    _graph_cache.clear()
+
+
 def download_graph(graph_name: str) -> MultiDiGraph:
     """
     Downloads a graph with the given name from the cfpq_data library.
+    The graph is returned as cfpq_data reads it, with parallel edges and all edge
+    attributes. It is not cached: every call downloads and parses the graph again
+    and needs the network. load_cached_graph returns the cached compact form
+    instead, which keeps only the labels and one edge per (source, label, target)
+    and loads near-instantly and offline once cached.
 
     Args:
         graph_name: The name of the graph to download.
@@ -49,6 +121,7 @@ def download_graph(graph_name: str) -> MultiDiGraph:
 def get_graph_info_by_name(graph_name: str) -> GraphInfo:
     """
     Downloads a graph with the given name and returns statistics about it.
+    The statistics are cached together with the graph, see load_cached_graph.
 
     Args:
         graph_name: The name of the graph to download.
@@ -57,8 +130,88 @@ def get_graph_info_by_name(graph_name: str) -> GraphInfo:
         A GraphStats object containing the name, number of nodes, number of edges,
         and set of edge labels for the downloaded graph.
     """
-    multi_graph = download_graph(graph_name)
-    return get_graph_info(multi_graph)
+    return load_cached_graph(graph_name).info
+
+
+def _checksum(path: str) -> str:
+    # SHA-256 of a file or of all files of a directory in sorted path order
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+    else:
+        files = [path]
+    for file in files:
+        digest.update(os.path.relpath(file, path).encode())
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_current_checksum(graph_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(graph_dir, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_current_checksum(graph_dir: str, checksum: str):
+    # Written to a temporary file first, so concurrent readers never see a partial name
+    fd, tmp_path = tempfile.mkstemp(dir=graph_dir)
+    with os.fdopen(fd, "w") as f:
+        f.write(checksum)
+    os.replace(tmp_path, os.path.join(graph_dir, "CURRENT"))
+
+
+def _load_cache_entry(graph_dir: str, checksum: str) -> Optional[CachedGraph]:
+    key = (graph_dir, checksum)
+    cached = _graph_cache.get(key)
+    if cached is not None:
+        return cached
+    entry_dir = os.path.join(graph_dir, checksum)
+    if not os.path.isdir(entry_dir):
+        return None
+    with open(os.path.join(entry_dir, "info.json")) as f:
+        info = json.load(f)
+    cached = CachedGraph(
+        load_compact(entry_dir),
+        GraphInfo(
+            info["number_of_nodes"], info["number_of_edges"], set(info["edge_labels"])
+        ),
+        checksum,
+    )
+    _graph_cache.put(key, cached)
+    return cached
+
+
+def _write_cache_entry(graph_dir: str, checksum: str, graph: MultiDiGraph):
+    # The entry is built in a temporary directory and renamed into place
+    os.makedirs(graph_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=graph_dir)
+    try:
+        save_compact(CompactGraph.from_graph(graph), tmp_dir)
+        info = get_graph_info(graph)
+        with open(os.path.join(tmp_dir, "info.json"), "w") as f:
+            json.dump(
+                {
+                    "number_of_nodes": info.number_of_nodes,
+                    "number_of_edges": info.number_of_edges,
+                    "edge_labels": sorted(info.edge_labels),
+                },
+                f,
+            )
+        os.replace(tmp_dir, os.path.join(graph_dir, checksum))
+    except OSError:
+        # Another process has written the same entry in the meantime
+        if not os.path.isdir(os.path.join(graph_dir, checksum)):
+            raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
 
 def save_graph(graph: MultiDiGraph, path: str):
@@ -72,6 +225,31 @@ def save_graph(graph: MultiDiGraph, path: str):
     nx_pydot.write_dot(graph, path)
 
 
+def save_compact_graph(graph: LabeledGraph, path: str):
+    """
+    Saves the specified graph in the project binary format at the specified path.
+
+    Args:
+    - graph: the MultiGraph or CompactGraph to save, vertex ids must be integers or strings
+    - path: the directory where the arrays of the graph will be saved
+    """
+    if not isinstance(graph, CompactGraph):
+        graph = CompactGraph.from_graph(graph)
+    save_compact(graph, path)
+
+
+def load_compact_graph(path: str, mmap: bool = True) -> CompactGraph:
+    """
+    Loads a graph saved by save_compact_graph.
+
+    Args:
+    - path: the directory the graph was saved to
+    - mmap: whether to memory-map the arrays read-only, so that opening is
+      independent of the graph size and worker processes share the pages
+    """
+    return load_compact(path, mmap=mmap)
+
+
 def create_labeled_two_cycles_graph(
     n: Union[int, Iterable[Any]], m: Union[int, Iterable[Any]], labels: Tuple[str, str]
 ) -> MultiDiGraph:
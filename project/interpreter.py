@@ -0,0 +1,366 @@
+from typing import Any, Callable, Dict, List, Optional, Set, Union
+
+from antlr4 import FileStream, InputStream
+from antlr4.error.Errors import ParseCancellationException
+from antlr4.tree.Tree import TerminalNode
+
+from project.antlr.LanguageParser import LanguageParser
+from project.antlr.LanguageVisitor import LanguageVisitor
+from project.parser import parse_program
+from project.query_plan import (
+    PLAN_NODES,
+    InterpretationError,
+    LoadNode,
+    PlanEvaluator,
+    concat_values,
+    intersect_values,
+    star_value,
+    states_value,
+    union_values,
+)
+
+
+class InterpretingVisitor(LanguageVisitor):
+    """
+    Runs a program of the query language.
+
+    Automaton expressions are not computed when they are bound: they become
+    plans of project.query_plan, so an intersection chain like
+    load("g") & r1 & r2 is evaluated as a single BFS and only when
+    get_reachable, get_edges or another query needs it.
+    Every printed value is passed to output as a line.
+    """
+
+    def __init__(
+        self,
+        output: Callable[[str], None] = print,
+        evaluator: Optional[PlanEvaluator] = None,
+    ):
+        self.output = output
+        self.evaluator = evaluator or PlanEvaluator()
+        self.env: Dict[str, Any] = {}
+
+    def visitProgram(self, ctx: LanguageParser.ProgramContext):
+        for child in ctx.getChildren():
+            if isinstance(child, LanguageParser.StmtContext):
+                self.visit(child)
+
+    def visitStmt(self, ctx: LanguageParser.StmtContext):
+        return self.visit(ctx.getChild(0))
+
+    def visitBind(self, ctx: LanguageParser.BindContext):
+        self.env[ctx.getChild(0).getText()] = self.visit(ctx.getChild(2))
+
+    def visitPrint(self, ctx: LanguageParser.PrintContext):
+        self.output(format_value(self.visit(ctx.getChild(2)), self.evaluator))
+
+    def visitVar(self, ctx: LanguageParser.VarContext):
+        name = ctx.getText()
+        if name not in self.env:
+            raise InterpretationError(f"Variable {name} is not defined")
+        return self.env[name]
+
+    def visitVal(self, ctx: LanguageParser.ValContext):
+        if isinstance(ctx.getChild(0), TerminalNode):
+            return None  # 'null'
+        return self.visit(ctx.getChild(0))
+
+    def visitLiteral(self, ctx: LanguageParser.LiteralContext):
+        child = ctx.getChild(0)
+        if not isinstance(child, TerminalNode):
+            return self.visit(child)
+        token_type = child.getSymbol().type
+        text = child.getText()
+        if token_type == LanguageParser.INT:
+            return int(text)
+        if token_type == LanguageParser.BOOL:
+            return text == "true"
+        return text[1:-1]
+
+    def visitSet(self, ctx: LanguageParser.SetContext):
+        result = set()
+        for child in ctx.getChildren():
+            if isinstance(child, LanguageParser.Set_elemContext):
+                result |= self.visit(child)
+        return result
+
+    def visitSet_elem(self, ctx: LanguageParser.Set_elemContext):
+        # A literal or an INT '..' INT range, both ends included
+        if ctx.getChildCount() == 3:
+            return set(
+                range(
+                    int(ctx.getChild(0).getText()), int(ctx.getChild(2).getText()) + 1
+                )
+            )
+        return {_hashable(self.visit(ctx.getChild(0)))}
+
+    def visitList(self, ctx: LanguageParser.ListContext):
+        return [
+            self.visit(child)
+            for child in ctx.getChildren()
+            if isinstance(child, LanguageParser.LiteralContext)
+        ]
+
+    def visitLambda(self, ctx: LanguageParser.LambdaContext):
+        if isinstance(ctx.getChild(0), TerminalNode):
+            return self.visit(ctx.getChild(1))  # '(' lambda ')'
+        pattern = _pattern(ctx.getChild(0))
+        body = ctx.getChild(2)
+
+        def apply(value: Any) -> Any:
+            env = self.env
+            self.env = dict(env)
+            try:
+                _bind(pattern, value, self.env)
+                return self.visit(body)
+            finally:
+                self.env = env
+
+        return apply
+
+    def visitExpr(self, ctx: LanguageParser.ExprContext):
+        children = list(ctx.getChildren())
+        first = children[0]
+        if len(children) == 1:
+            return self.visit(first)  # var or val
+        if not isinstance(first, TerminalNode):
+            return self._postfix_or_binary(children)
+
+        keyword = first.getText()
+        if keyword == "(":
+            return self.visit(children[1])
+        if keyword == "!":
+            value = self.visit(children[1])
+            if not isinstance(value, bool):
+                raise InterpretationError(f"Expected a bool, got {format_value(value)}")
+            return not value
+        if keyword == "load":
+            return LoadNode(children[2].getText()[1:-1])
+        if keyword in ("start", "final", "add_start", "add_final"):
+            return states_value(
+                self.visit(children[2]), keyword, self.visit(children[4])
+            )
+        if keyword in ("map", "filter"):
+            if keyword == "filter":
+                pushed_down = self._pushed_down_filter(children[2], children[4])
+                if pushed_down is not None:
+                    return pushed_down
+            function = self.visit(children[2])
+            collection = self.visit(children[4])
+            if isinstance(collection, PLAN_NODES) or not hasattr(
+                collection, "__iter__"
+            ):
+                raise InterpretationError(
+                    f"Cannot {keyword} {format_value(collection)}"
+                )
+            if keyword == "map":
+                items = [function(item) for item in collection]
+            else:
+                items = [item for item in collection if function(item)]
+            if isinstance(collection, set):
+                return {_hashable(item) for item in items}
+            return items
+
+        value = self.visit(children[2])
+        evaluator = self.evaluator
+        queries = {
+            "get_start": evaluator.start_states,
+            "get_final": evaluator.final_states,
+            "get_reachable": evaluator.reachable,
+            "get_vertices": evaluator.vertices,
+            "get_edges": evaluator.edges,
+            "get_labels": evaluator.labels,
+        }
+        if keyword not in queries:
+            raise InterpretationError(f"Unknown expression {ctx.getText()}")
+        return queries[keyword](value)
+
+    def _pushed_down_filter(
+        self, lambda_ctx: LanguageParser.LambdaContext, collection: Any
+    ) -> Optional[Set[Any]]:
+        # filter(p => p[0] in E, get_reachable(X)), the same for p[1] or a (u, v)
+        # pattern, becomes a BFS seeded with E only. None if it does not apply
+        reachable = _unwrap(collection)
+        keyword = reachable.getChild(0)
+        if (
+            not isinstance(keyword, TerminalNode)
+            or keyword.getText() != "get_reachable"
+        ):
+            return None
+        while isinstance(lambda_ctx.getChild(0), TerminalNode):
+            lambda_ctx = lambda_ctx.getChild(1)  # '(' lambda ')'
+        pattern = _pattern(lambda_ctx.getChild(0))
+        body = _unwrap(lambda_ctx.getChild(2))
+        if body.getChildCount() != 3 or body.getChild(1).getText() != "in":
+            return None
+        kind = _pair_component(pattern, _unwrap(body.getChild(0)))
+        vertices = body.getChild(2)
+        if kind is None or _pattern_names(pattern) & _referenced_names(vertices):
+            return None
+        try:
+            vertices = self.visit(vertices)
+        except InterpretationError:
+            return None  # Reported by the filter itself if it gets to the check
+        if not isinstance(vertices, (set, frozenset)):
+            return None
+        plan = self.visit(reachable.getChild(2))
+        return self.evaluator.reachable(plan, **{kind: vertices})
+
+    def _postfix_or_binary(self, children: List[Any]) -> Any:
+        operator = children[1].getText()
+        lhs = self.visit(children[0])
+        if operator == "*":
+            return star_value(lhs)
+        if operator == "[":
+            index = int(children[2].getText())
+            if not isinstance(lhs, (list, tuple)):
+                raise InterpretationError(f"Cannot index {format_value(lhs)}")
+            return lhs[index]
+        rhs = self.visit(children[2])
+        if operator == "&":
+            return intersect_values(lhs, rhs)
+        if operator == "|":
+            return union_values(lhs, rhs)
+        if operator == ".":
+            return concat_values(lhs, rhs)
+        if operator == "in":
+            if isinstance(rhs, PLAN_NODES) or not hasattr(rhs, "__contains__"):
+                raise InterpretationError(
+                    f"Cannot check membership in {format_value(rhs)}"
+                )
+            if isinstance(rhs, (set, frozenset)):
+                lhs = _hashable(lhs)
+            return lhs in rhs
+        raise InterpretationError(f"Unknown operator {operator}")
+
+
+def format_value(value: Any, evaluator: Optional[PlanEvaluator] = None) -> str:
+    # Automata are printed as their edges, which needs an evaluator
+    if isinstance(value, PLAN_NODES):
+        if evaluator is None:
+            return "automaton"
+        return f"automaton with edges {_format_collection(evaluator.edges(value))}"
+    if isinstance(value, (set, frozenset)):
+        return _format_collection(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    return str(value)
+
+
+def _format_collection(values: Any) -> str:
+    # Sets are printed in sorted order when their elements are comparable
+    try:
+        values = sorted(values)
+    except TypeError:
+        values = list(values)
+    return "{" + ", ".join(map(str, values)) + "}"
+
+
+def _pattern(ctx: LanguageParser.PatternContext) -> Union[str, tuple]:
+    # A variable name or a tuple of patterns, (x) is the same as x
+    if ctx.getChildCount() == 1:
+        return ctx.getText()
+    patterns = tuple(
+        _pattern(child)
+        for child in ctx.getChildren()
+        if isinstance(child, LanguageParser.PatternContext)
+    )
+    return patterns[0] if len(patterns) == 1 else patterns
+
+
+def _bind(pattern: Union[str, tuple], value: Any, env: Dict[str, Any]) -> None:
+    if isinstance(pattern, str):
+        env[pattern] = value
+        return
+    if not isinstance(value, (list, tuple)) or len(value) != len(pattern):
+        raise InterpretationError(
+            f"Cannot match {format_value(value)} with a pattern of {len(pattern)} elements"
+        )
+    for sub_pattern, item in zip(pattern, value):
+        _bind(sub_pattern, item, env)
+
+
+def _unwrap(ctx: Any) -> Any:
+    # Drops the parentheses around an expression
+    while (
+        isinstance(ctx, LanguageParser.ExprContext)
+        and ctx.getChildCount() == 3
+        and ctx.getChild(0).getText() == "("
+    ):
+        ctx = ctx.getChild(1)
+    return ctx
+
+
+def _pair_component(
+    pattern: Union[str, tuple], ctx: LanguageParser.ExprContext
+) -> Optional[str]:
+    # "start" if ctx is p[0] for the pattern p or u for the pattern (u, v), "final" for
+    # p[1] or v and None for other expressions
+    if isinstance(pattern, str):
+        if (
+            ctx.getChildCount() == 4
+            and ctx.getChild(1).getText() == "["
+            and _unwrap(ctx.getChild(0)).getText() == pattern
+            and ctx.getChild(2).getText() in ("0", "1")
+        ):
+            return "start" if ctx.getChild(2).getText() == "0" else "final"
+        return None
+    if len(pattern) != 2 or not isinstance(ctx.getChild(0), LanguageParser.VarContext):
+        return None
+    name = ctx.getText()
+    if name == pattern[0] and name != pattern[1]:
+        return "start"
+    if name == pattern[1] and name != pattern[0]:
+        return "final"
+    return None
+
+
+def _pattern_names(pattern: Union[str, tuple]) -> Set[str]:
+    if isinstance(pattern, str):
+        return {pattern}
+    return set().union(*(_pattern_names(sub_pattern) for sub_pattern in pattern))
+
+
+def _referenced_names(ctx: Any) -> Set[str]:
+    # The variables used in an expression, including lambda parameters
+    if isinstance(ctx, LanguageParser.VarContext):
+        return {ctx.getText()}
+    if isinstance(ctx, TerminalNode):
+        return set()
+    return set().union(*(_referenced_names(child) for child in ctx.getChildren()))
+
+
+def _hashable(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def interpret(
+    input_stream: Union[str, InputStream],
+    from_file: bool = False,
+    evaluator: Optional[PlanEvaluator] = None,
+) -> List[str]:
+    """
+    Runs a program given as a string, a file path (with from_file) or an InputStream.
+
+    Returns:
+        The printed lines.
+    Raises:
+        ParseCancellationException with the messages of all syntax errors,
+        InterpretationError on errors while running the program.
+    """
+    if isinstance(input_stream, str):
+        input_stream = (
+            FileStream(input_stream) if from_file else InputStream(input_stream)
+        )
+    result = parse_program(input_stream)
+    if not result.is_valid:
+        raise ParseCancellationException("Syntax error: " + "; ".join(result.errors))
+    lines = []
+    InterpretingVisitor(lines.append, evaluator).visit(result.tree)
+    return lines
@@ -0,0 +1,106 @@
+from typing import Tuple, Union
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix, spmatrix
+
+
+class KroneckerOperator:
+    """
+    Lazy Kronecker product kron(lhs, rhs) of two boolean matrices.
+
+    The product is never materialized. Multiplication by a batch of vectors
+    uses the identity (A ⊗ B) · vec(X) = vec(B · X · Aᵀ), so memory stays
+    proportional to the operands and the vectors rather than to the
+    (|lhs| · |rhs|)² cells of the product.
+    Indexing matches scipy.sparse.kron: row i * rhs.shape[0] + j
+    of the product corresponds to row i of lhs and row j of rhs.
+    """
+
+    def __init__(
+        self, lhs: Union[spmatrix, np.ndarray], rhs: Union[spmatrix, np.ndarray]
+    ):
+        self.lhs = csr_matrix(lhs, dtype=bool)
+        self.rhs = csr_matrix(rhs, dtype=bool)
+        self.shape = (
+            self.lhs.shape[0] * self.rhs.shape[0],
+            self.lhs.shape[1] * self.rhs.shape[1],
+        )
+        self.dtype = np.dtype(bool)
+
+    @property
+    def T(self) -> "KroneckerOperator":
+        return KroneckerOperator(self.lhs.T, self.rhs.T)
+
+    def matvec(self, x: Union[spmatrix, np.ndarray]) -> Union[spmatrix, np.ndarray]:
+        # Returns kron(lhs, rhs) @ x for a vector x
+        if isinstance(x, np.ndarray):
+            column = csr_matrix(x.reshape(-1, 1), dtype=bool)
+            return self.matmat(column).toarray().reshape(-1)
+        return self.matmat(x.reshape((-1, 1)))
+
+    def rmatvec(self, x: Union[spmatrix, np.ndarray]) -> Union[spmatrix, np.ndarray]:
+        # Returns kron(lhs, rhs).T @ x for a vector x
+        return self.T.matvec(x)
+
+    def matmat(self, x: spmatrix) -> csr_matrix:
+        """
+        Multiplies the product by a batch of column vectors.
+
+        Args:
+            x: a (shape[1], k) boolean matrix, every column is one vector
+
+        Returns:
+            kron(lhs, rhs) @ x as a (shape[0], k) csr_matrix
+        """
+        if x.shape[0] != self.shape[1]:
+            raise ValueError(
+                f"Dimension mismatch: operator {self.shape}, operand {x.shape}"
+            )
+        num_vectors = x.shape[1]
+        lhs_cols, rhs_cols = self.lhs.shape[1], self.rhs.shape[1]
+        rhs_rows = self.rhs.shape[0]
+        x = coo_matrix(x)
+
+        # Every column c of x is a lhs_cols × rhs_cols matrix X_c,
+        # the result column is lhs · X_c · rhsᵀ
+        lhs_idx, rhs_idx = np.divmod(x.row, rhs_cols)
+        stacked = _csr_from_indices(
+            (lhs_idx * num_vectors + x.col, rhs_idx), (lhs_cols * num_vectors, rhs_cols)
+        )
+        right = coo_matrix(stacked @ self.rhs.T)
+
+        lhs_idx, vector_idx = np.divmod(right.row, num_vectors)
+        regrouped = _csr_from_indices(
+            (lhs_idx, right.col * num_vectors + vector_idx),
+            (lhs_cols, rhs_rows * num_vectors),
+        )
+        left = coo_matrix(self.lhs @ regrouped)
+
+        rhs_idx, vector_idx = np.divmod(left.col, num_vectors)
+        return _csr_from_indices(
+            (left.row * rhs_rows + rhs_idx, vector_idx), (self.shape[0], num_vectors)
+        )
+
+    def rmatmat(self, x: spmatrix) -> csr_matrix:
+        # Returns kron(lhs, rhs).T @ x for a batch of column vectors
+        return self.T.matmat(x)
+
+    def __matmul__(self, x: spmatrix) -> csr_matrix:
+        return self.matmat(x)
+
+    def __rmatmul__(self, x: spmatrix) -> csr_matrix:
+        # Row vectors times the product: x @ kron(lhs, rhs)
+        return self.rmatmat(x.T).T.tocsr()
+
+    def toarray(self) -> np.ndarray:
+        # Materializes the product, only meant for small operands and debugging
+        return np.kron(self.lhs.toarray(), self.rhs.toarray())
+
+
+def _csr_from_indices(
+    indices: Tuple[np.ndarray, np.ndarray], shape: Tuple[int, int]
+) -> csr_matrix:
+    # Builds a canonical boolean csr_matrix from coordinate arrays
+    rows, cols = indices
+    data = np.ones(len(rows), dtype=bool)
+    return coo_matrix((data, (rows, cols)), shape=shape).tocsr()
@@ -1,11 +1,23 @@
-from typing import Union
-
-from antlr4 import FileStream, InputStream, CommonTokenStream
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+import threading
+from itertools import accumulate
+from typing import Iterable, List, NamedTuple, Optional, TextIO, Tuple, Union
+
+from antlr4 import FileStream, InputStream, CommonTokenStream, ParserRuleContext
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.ErrorListener import ErrorListener
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
 from antlr4.error.Errors import ParseCancellationException
+from antlr4.tree.Tree import TerminalNode
 
 from project.antlr.LanguageLexer import LanguageLexer
 from project.antlr.LanguageParser import LanguageParser
 from project.antlr.LanguageVisitor import LanguageVisitor
+from project.lru_cache import CacheInfo, LRUCache
 
 
 def parse_file(file_path):
@@ -31,6 +43,247 @@ def parse_input_stream(input_stream):
     return parser
 
 
+class ParseResult(NamedTuple):
+    # The parse tree of a program, the messages of its syntax errors and its tokens.
+    # The tokens must be read from token_stream: ctx.parser of the tree is the
+    # parser of the thread, which reads the tokens of the next parsed program
+    tree: Optional[LanguageParser.ProgramContext]
+    errors: List[str]
+    token_stream: Optional[CommonTokenStream] = None
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+
+class _CollectingErrorListener(ErrorListener):
+    def __init__(self):
+        self.errors = []
+
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        self.errors.append(f"line {line}:{column} {msg}")
+
+
+class ReusableParser:
+    """
+    One lexer and one parser reused for every parsed program.
+
+    The ATN and the prediction DFA cache are shared by all instances of the
+    generated classes, reusing the instances also keeps them from being set up
+    for every call. A program is tokenized once and parsed with the SLL
+    prediction mode, which bails out at the first error. Only then it is parsed
+    again with the full LL mode to get the same result and the syntax errors
+    as a single LL parse. The instances are not thread-safe, see parse_program.
+    """
+
+    def __init__(self):
+        self.lexer = LanguageLexer(None)
+        self.lexer.removeErrorListeners()
+        self.parser = LanguageParser(None)
+        self.parser.removeErrorListeners()
+
+    def parse(self, input_stream: InputStream) -> ParseResult:
+        self.lexer.inputStream = input_stream
+        token_stream = CommonTokenStream(self.lexer)
+        parser = self.parser
+        parser.setTokenStream(token_stream)
+        parser._errHandler = BailErrorStrategy()
+        parser._interp.predictionMode = PredictionMode.SLL
+        try:
+            tree = parser.program()
+            token_stream.fill()
+            return ParseResult(tree, [], token_stream)
+        except ParseCancellationException:
+            pass
+
+        listener = _CollectingErrorListener()
+        parser.addErrorListener(listener)
+        # The already read tokens are parsed again from the first one,
+        # setTokenStream resets the parser but does not seek the stream
+        token_stream.seek(0)
+        parser.setTokenStream(token_stream)
+        parser._errHandler = DefaultErrorStrategy()
+        parser._interp.predictionMode = PredictionMode.LL
+        try:
+            tree = parser.program()
+        finally:
+            parser.removeErrorListener(listener)
+        # All tokens are read while the lexer still reads this program
+        token_stream.fill()
+        return ParseResult(tree, listener.errors, token_stream)
+
+
+_local = threading.local()
+
+
+def parse_program(input_stream: InputStream) -> ParseResult:
+    """
+    Parses a program with the ReusableParser of the current thread.
+
+    Returns:
+        The parse tree together with the syntax errors of a single parse,
+        the tree is only meaningful if there are no errors.
+    """
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = ReusableParser()
+    return parser.parse(input_stream)
+
+
+class SyntaxNode(NamedTuple):
+    # A rule node of the parse tree: the rule name, the indexes of its first and
+    # last token and the rule nodes below it, the tokens themselves are dropped
+    rule: str
+    start: int
+    stop: int
+    children: Tuple["SyntaxNode", ...]
+
+
+class CompiledProgram(NamedTuple):
+    """
+    The result of parsing a program that is kept in the program cache.
+
+    It holds the syntax errors and, for a valid program, the parse tree pruned
+    to its rule nodes together with the token texts, so that it is picklable and
+    the DOT text can be built from it without ANTLR. The DOT text is only built
+    when it is first requested.
+    """
+
+    errors: Tuple[str, ...]
+    tokens: Tuple[str, ...]
+    ast: Optional[SyntaxNode]
+    dot: Optional[str] = None
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+    def text(self, node: SyntaxNode) -> str:
+        # The same as getText() of the parse tree node
+        return "".join(self.tokens[node.start : node.stop + 1])
+
+
+PROGRAM_CACHE_SIZE = 256
+
+_program_cache = LRUCache(PROGRAM_CACHE_SIZE)
+_program_cache_lock = threading.Lock()
+
+
+def compile_program(source: str) -> CompiledProgram:
+    """
+    Returns the CompiledProgram of the source text, parsing it only if
+    a program with the same text is not in the LRU cache yet.
+
+    Args:
+        source: the text of the program
+
+    Returns:
+        A CompiledProgram shared with the other callers of the same text.
+    """
+    key = _source_key(source)
+    with _program_cache_lock:
+        compiled = _program_cache.get(key)
+    if compiled is None:
+        compiled = _compile(parse_program(InputStream(source)))
+        with _program_cache_lock:
+            _program_cache.put(key, compiled)
+    return compiled
+
+
+def program_cache_info() -> CacheInfo:
+    return _program_cache.info()
+
+
+def set_program_cache_size(maxsize: int):
+    # Changes the number of kept programs, evicting the least recently used ones if needed
+    with _program_cache_lock:
+        _program_cache.resize(maxsize)
+
+
+def clear_program_cache():
+    with _program_cache_lock:
+        _program_cache.clear()
+
+
+def save_program_cache(path: str):
+    """
+    Writes the cached programs to a pickle file, so that other processes
+    can start with a warm cache by calling load_program_cache.
+
+    Args:
+        path: the file to write
+    """
+    with _program_cache_lock:
+        entries = [(key, tuple(compiled)) for key, compiled in _program_cache.items()]
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(entries, f)
+    os.replace(tmp_path, path)
+
+
+def load_program_cache(path: str):
+    """
+    Adds the programs saved by save_program_cache to the cache.
+
+    The file is read with pickle.load, which can run arbitrary code,
+    so it must only be given files from a trusted source.
+
+    Args:
+        path: the file written by save_program_cache
+    """
+    with open(path, "rb") as f:
+        entries = pickle.load(f)
+    with _program_cache_lock:
+        for key, compiled in entries:
+            _program_cache.put(key, CompiledProgram(*compiled))
+
+
+def _source_key(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def _compile(result: ParseResult) -> CompiledProgram:
+    if not result.is_valid:
+        return CompiledProgram(tuple(result.errors), (), None)
+    # Tokens of other channels are not part of getText()
+    tokens = tuple(
+        token.text if token.channel == 0 else "" for token in result.token_stream.tokens
+    )
+    return CompiledProgram((), tokens, _prune(result.tree))
+
+
+def _prune(tree: LanguageParser.ProgramContext) -> SyntaxNode:
+    # Built bottom-up without recursion, as long expressions make deep trees
+    children = {}
+    stack = [(tree, False)]
+    while stack:
+        ctx, visited = stack.pop()
+        rules = [
+            child for child in ctx.getChildren() if isinstance(child, ParserRuleContext)
+        ]
+        if not visited:
+            stack.append((ctx, True))
+            stack.extend((child, False) for child in reversed(rules))
+            continue
+        stop = ctx.stop.tokenIndex if ctx.stop is not None else ctx.start.tokenIndex - 1
+        children[ctx] = SyntaxNode(
+            LanguageParser.ruleNames[ctx.getRuleIndex()],
+            ctx.start.tokenIndex,
+            stop,
+            tuple(children.pop(child) for child in rules),
+        )
+    return children[tree]
+
+
+def _source_text(input_stream: Union[str, InputStream], from_file: bool) -> str:
+    if isinstance(input_stream, InputStream):
+        return input_stream.strdata
+    if from_file:
+        return FileStream(input_stream).strdata
+    return input_stream
+
+
 def check_correction_file(file_path):
     input_stream = FileStream(file_path)
     return check_correction(input_stream)
@@ -47,89 +300,233 @@ def check_correction_console():
 
 
 def check_correction(input_stream) -> bool:
-    parser = parse_input_stream(input_stream)
-    parser.removeErrorListeners()
-    _ = parser.program()
-    return not parser.getNumberOfSyntaxErrors()
+    return compile_program(_source_text(input_stream, False)).is_valid
+
+
+class _TokenText:
+    # The texts of the tokens of a program joined once, so that the text of a token
+    # span is a single slice instead of the concatenation of a subtree by getText()
+
+    def __init__(self, tokens: Iterable[str]):
+        tokens = list(tokens)
+        self.text = "".join(tokens)
+        self.offsets = [0, *accumulate(map(len, tokens))]
+
+    @classmethod
+    def from_tree(cls, tree: ParserRuleContext) -> "_TokenText":
+        # The tokens of the terminal nodes of a tree, at their token indexes,
+        # tokens that are not in the tree (other channels or other subtrees) are empty
+        texts = {}
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, TerminalNode):
+                texts[node.getSymbol().tokenIndex] = node.getText()
+            elif node.children:
+                stack.extend(node.children)
+        size = max(texts, default=-1) + 1
+        return cls(texts.get(i, "") for i in range(size))
+
+    def span(self, start: int, stop: int) -> str:
+        if stop < start:
+            return ""
+        return self.text[self.offsets[start] : self.offsets[stop + 1]]
+
+
+# The DOT label of a rule node is a prefix, followed by the text of the node unless
+# the flag is None, with quotes replaced to keep the label valid if the flag is set
+_DOT_LABELS = {
+    "program": ("program", None),
+    "stmt": ("Stmt", None),
+    "bind": ("=", None),
+    "print": ("print", None),
+    "literal": ("Literal: ", True),
+    "set": ("Set ", False),
+    "set_elem": ("", False),
+    "list": ("List ", False),
+    "val": ("Val ", True),
+    "var": ("Var: ", True),
+    "expr": ("Expr: ", True),
+    "lambda": ("Lambda", None),
+    "pattern": ("lambda_pattern", None),
+}
+
+
+def _dot_label(rule: str, tokens: _TokenText, start: int, stop: int) -> str:
+    prefix, quoted = _DOT_LABELS[rule]
+    if quoted is None:
+        return prefix
+    text = tokens.span(start, stop)
+    return prefix + (text.replace('"', "'") if quoted else text)
+
+
+class _DotWriter:
+    # Writes the nodes and edges of a DOT graph to the sink as they are added
+
+    def __init__(self, sink: TextIO):
+        self.sink = sink
+        self.node_count = 0
+        self.closed = False
+        sink.write("digraph {")
+
+    def node(self, label: str, parent_id: Optional[int]) -> int:
+        node_id = self.node_count
+        self.node_count += 1
+        self.sink.write(f'\n{node_id} [label="{label}"]')
+        if parent_id is not None:
+            self.sink.write(f"\n{parent_id} -> {node_id}")
+        return node_id
+
+    def close(self):
+        if not self.closed:
+            self.sink.write("\n}")
+            self.closed = True
 
 
 class DotGeneratingVisitor(LanguageVisitor):
-    def __init__(self):
-        self.graph = []
-        self.node_counter = 0
-        self.node_ids = {}
-
-    def generic_visit(self, node_name, ctx):
-        node_id = self.node_counter
-        self.node_ids[ctx] = node_id
-        self.node_counter += 1
-
-        label = f"{node_name}: {ctx.getText()}" if ctx.children is None else node_name
-        self.graph.append(f'{node_id} [label="{label}"]')
-
-        if not isinstance(ctx.parentCtx, type(None)):
-            parent_id = self.node_ids.get(ctx.parentCtx, None)
-            if parent_id is not None:
-                self.graph.append(f"{parent_id} -> {node_id}")
-
-        return self.visitChildren(ctx)
+    """
+    Writes the DOT graph of a parse tree to sink while visiting it.
+
+    The rule nodes are numbered in pre-order and connected to the node being
+    visited above them, labels are slices of the text of the terminal nodes given
+    by the token span of a node. Visiting a program writes the whole graph,
+    the nodes of visited subtrees are added to one graph that is finished by
+    close. Without a sink the graph is kept in memory, see get_dot_graph.
+    """
+
+    def __init__(self, sink: Optional[TextIO] = None):
+        self.sink = io.StringIO() if sink is None else sink
+        self._writer = None
+        self._tokens = None
+        self._parent_ids = []
+
+    def generic_visit(self, rule: str, ctx: ParserRuleContext):
+        if self._writer is None:
+            self._writer = _DotWriter(self.sink)
+        elif self._writer.closed:
+            raise ValueError("The DOT graph is already closed")
+        if not self._parent_ids:
+            # The tokens are taken from the visited tree itself, ctx.parser
+            # may already read the tokens of another program
+            self._tokens = _TokenText.from_tree(ctx)
+
+        start = ctx.start.tokenIndex
+        stop = ctx.stop.tokenIndex if ctx.stop is not None else start - 1
+        label = _dot_label(rule, self._tokens, start, stop)
+        if ctx.children is None:
+            label += ": "  # A node without children has no text
+        parent_id = self._parent_ids[-1] if self._parent_ids else None
+        self._parent_ids.append(self._writer.node(label, parent_id))
+        try:
+            return self.visitChildren(ctx)
+        finally:
+            self._parent_ids.pop()
+
+    def close(self):
+        # Finishes the graph, nothing can be visited afterwards
+        if self._writer is None:
+            self._writer = _DotWriter(self.sink)
+        self._writer.close()
 
     def visitProgram(self, ctx: LanguageParser.ProgramContext):
-        return self.generic_visit("program", ctx)
+        top_level = not self._parent_ids
+        result = self.generic_visit("program", ctx)
+        if top_level:
+            self.close()
+        return result
 
     def visitBind(self, ctx: LanguageParser.BindContext):
-        return self.generic_visit("=", ctx)
+        return self.generic_visit("bind", ctx)
 
     def visitStmt(self, ctx: LanguageParser.StmtContext):
-        return self.generic_visit("Stmt", ctx)
+        return self.generic_visit("stmt", ctx)
 
     def visitPrint(self, ctx: LanguageParser.PrintContext):
         return self.generic_visit("print", ctx)
 
     def visitLiteral(self, ctx: LanguageParser.LiteralContext):
-        return self.generic_visit("Literal: " + ctx.getText().replace('"', "'"), ctx)
+        return self.generic_visit("literal", ctx)
 
     def visitSet(self, ctx: LanguageParser.SetContext):
-        return self.generic_visit("Set " + ctx.getText(), ctx)
+        return self.generic_visit("set", ctx)
 
     def visitSet_elem(self, ctx: LanguageParser.Set_elemContext):
-        return self.generic_visit(ctx.getText(), ctx)
+        return self.generic_visit("set_elem", ctx)
 
     def visitList(self, ctx: LanguageParser.ListContext):
-        return self.generic_visit("List " + ctx.getText(), ctx)
+        return self.generic_visit("list", ctx)
 
     def visitVal(self, ctx: LanguageParser.ValContext):
-        return self.generic_visit("Val " + ctx.getText().replace('"', "'"), ctx)
+        return self.generic_visit("val", ctx)
 
     def visitVar(self, ctx: LanguageParser.VarContext):
-        return self.generic_visit("Var: " + ctx.getText().replace('"', "'"), ctx)
+        return self.generic_visit("var", ctx)
 
     def visitExpr(self, ctx: LanguageParser.ExprContext):
-        return self.generic_visit("Expr: " + ctx.getText().replace('"', "'"), ctx)
+        return self.generic_visit("expr", ctx)
 
     def visitLambda(self, ctx: LanguageParser.LambdaContext):
-        return self.generic_visit("Lambda", ctx)
+        return self.generic_visit("lambda", ctx)
 
     def visitPattern(self, ctx: LanguageParser.PatternContext):
-        return self.generic_visit("lambda_pattern", ctx)
+        return self.generic_visit("pattern", ctx)
 
     def get_dot_graph(self):
-        return "digraph {\n" + "\n".join(self.graph) + "\n}"
+        # The finished graph, only for a visitor created without a sink
+        self.close()
+        return self.sink.getvalue()
 
 
 def generate_dot_text(input_stream: Union[str, InputStream], from_file: bool = False):
-    if isinstance(input_stream, str):
-        if from_file:
-            input_stream = FileStream(input_stream)
-        else:
-            input_stream = InputStream(input_stream)
-    if not check_correction(input_stream):
+    # The DOT text is kept in the program cache, so a known program is not parsed again
+    source = _source_text(input_stream, from_file)
+    compiled = _compile_valid(source)
+    if compiled.dot is None:
+        sink = io.StringIO()
+        _render_dot(compiled, sink)
+        compiled = compiled._replace(dot=sink.getvalue())
+        with _program_cache_lock:
+            _program_cache.put(_source_key(source), compiled)
+    return compiled.dot
+
+
+def write_dot(
+    input_stream: Union[str, InputStream], sink: TextIO, from_file: bool = False
+):
+    """
+    Writes the DOT graph of a program to a file-like sink line by line.
+
+    The text of a cached graph is written as it is, otherwise the graph is written
+    while it is built from the cached parse tree and is not kept in memory.
+
+    Raises:
+        ParseCancellationException on syntax errors, before anything is written.
+    """
+    compiled = _compile_valid(_source_text(input_stream, from_file))
+    if compiled.dot is not None:
+        sink.write(compiled.dot)
+    else:
+        _render_dot(compiled, sink)
+
+
+def _compile_valid(source: str) -> CompiledProgram:
+    compiled = compile_program(source)
+    if not compiled.is_valid:
         raise ParseCancellationException("Syntax error")
-    input_stream.seek(0)
-    parse_tree = parse_input_stream(input_stream).program()
-    visitor = DotGeneratingVisitor()
-    visitor.visit(parse_tree)
-    return visitor.get_dot_graph()
+    return compiled
+
+
+def _render_dot(compiled: CompiledProgram, sink: TextIO):
+    # The same graph as DotGeneratingVisitor writes, built from the pruned tree
+    tokens = _TokenText(compiled.tokens)
+    writer = _DotWriter(sink)
+    stack = [(compiled.ast, None)]
+    while stack:
+        node, parent_id = stack.pop()
+        label = _dot_label(node.rule, tokens, node.start, node.stop)
+        node_id = writer.node(label, parent_id)
+        stack.extend((child, node_id) for child in reversed(node.children))
+    writer.close()
 
 
 def generate_dot(
@@ -138,4 +535,4 @@ def generate_dot(
     output: str = "output.dot",
 ):
     with open(output, "w") as file:
-        file.write(generate_dot_text(input_stream, from_file))
+        write_dot(input_stream, file, from_file)
@@ -0,0 +1,142 @@
+from typing import (
+    Any,
+    Collection,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from project.boolean_adjacency_matrix import BooleanAdjacencyMatrix, count_nonzero
+from project.compact_graph import CompactGraph, LabeledGraph
+from project.graph_utils import GraphInfo, get_graph_info
+
+
+class PreparedGraph:
+    """
+    A labeled graph converted once for many queries.
+
+    The per-label matrices, the vertex <-> index mapping and the label statistics
+    are built on creation (the matrices once per storage backend), and every
+    query only sets its own start and final vertices on a shallow copy.
+    regular_query, find_accessible_vertices and the CFPQ solvers accept it
+    in place of the graph. The graph must not be modified afterwards.
+    """
+
+    def __init__(self, graph: LabeledGraph, backend: str = "csr"):
+        self.graph = graph
+        self.backend = backend
+        matrix = BooleanAdjacencyMatrix.from_graph(graph, backend=backend)
+        self._matrices = {backend: matrix}
+        self.states = matrix.states
+        self.index = {v: i for i, v in enumerate(self.states)}
+        self.info = get_graph_info(graph)
+        # Number of distinct (source, target) pairs of every label
+        self.label_counts = {
+            label.value: count_nonzero(m) for label, m in matrix.adj_matrices.items()
+        }
+
+    def matrix(
+        self,
+        start: Optional[Collection] = None,
+        final: Optional[Collection] = None,
+        backend: Optional[str] = None,
+    ) -> BooleanAdjacencyMatrix:
+        """
+        Returns the BooleanAdjacencyMatrix of the graph with the given start and final vertices.
+
+        Args:
+            start: vertices to use as start states (all vertices if None)
+            final: vertices to use as final states (all vertices if None)
+            backend: storage format of the matrices, the backend of the
+                prepared graph if None
+
+        Returns:
+            A copy that shares the label matrices with the prepared graph, the
+            same as BooleanAdjacencyMatrix.from_graph(graph, start, final, backend).
+            Vertices outside the graph need extra states, so for them
+            the matrix is built from the graph again.
+        """
+        backend = backend or self.backend
+        index = self.index
+        start = None if start is None else list(start)
+        final = None if final is None else list(final)
+        if any(v not in index for v in start or ()) or any(
+            v not in index for v in final or ()
+        ):
+            return BooleanAdjacencyMatrix.from_graph(self.graph, start, final, backend)
+        if backend not in self._matrices:
+            self._matrices[backend] = BooleanAdjacencyMatrix.from_graph(
+                self.graph, backend=backend
+            )
+        return self._matrices[backend].with_states(
+            None if start is None else [index[v] for v in start],
+            None if final is None else [index[v] for v in final],
+        )
+
+    def compact_subgraph(self, indices: Sequence[int]) -> CompactGraph:
+        """
+        Returns the subgraph induced by the vertices with the given indices
+        (positions in states), sliced from the prepared label matrices
+        instead of being converted from the graph again.
+        Parallel edges with the same label are kept once, as in any CompactGraph.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        vertices = np.empty(len(indices), dtype=object)
+        vertices[:] = [self.states[i] for i in indices]
+        matrix = self._matrices.get("csr") or self._matrices[self.backend]
+        return CompactGraph(
+            vertices,
+            {
+                label.value: csr_matrix(m, dtype=bool)[indices][:, indices]
+                for label, m in matrix.adj_matrices.items()
+            },
+        )
+
+    # The read-only graph interface, so that a prepared graph can be used as a graph
+
+    @property
+    def nodes(self) -> List[Any]:
+        return self.states
+
+    def number_of_nodes(self) -> int:
+        return len(self.states)
+
+    def number_of_edges(self) -> int:
+        return self.info.number_of_edges
+
+    def edges(self, data: Optional[str] = None) -> Iterator[Tuple]:
+        return iter(self.graph.edges(data=data))
+
+    def subgraph(self, vertices: Iterable[Any]) -> LabeledGraph:
+        return self.graph.subgraph(vertices)
+
+    def __contains__(self, vertex: Any) -> bool:
+        return vertex in self.index
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+
+QueryGraph = Union[LabeledGraph, PreparedGraph]
+
+
+def build_graph_matrix(
+    graph: QueryGraph,
+    start: Optional[Collection] = None,
+    final: Optional[Collection] = None,
+    backend: str = "csr",
+) -> BooleanAdjacencyMatrix:
+    """
+    Returns BooleanAdjacencyMatrix.from_graph(graph, start, final, backend),
+    reusing the matrices of a PreparedGraph instead of building them.
+    """
+    if isinstance(graph, PreparedGraph):
+        return graph.matrix(start, final, backend)
+    return BooleanAdjacencyMatrix.from_graph(graph, start, final, backend=backend)
@@ -0,0 +1,619 @@
+import operator
+import os
+from dataclasses import dataclass
+from functools import reduce
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, NamedTuple
+from typing import Optional, Set, Tuple, Union
+
+import numpy as np
+import networkx.drawing.nx_pydot as nx_pydot
+from pyformlang.finite_automaton import (
+    DeterministicFiniteAutomaton,
+    EpsilonNFA,
+    Symbol,
+)
+
+from project.boolean_adjacency_matrix import BooleanAdjacencyMatrix
+from project.compact_graph import CompactGraph, LabeledGraph, read_edge_list
+from project.fa_building import build_nfa_from_graph
+from project.graph_utils import load_cached_graph
+from project.prepared_graph import PreparedGraph, build_graph_matrix
+from project.reg_querying import find_accessible_by_matrices
+
+
+class InterpretationError(Exception):
+    pass
+
+
+# Lazy plans of automaton expressions of the query language.
+# Nothing is computed when a plan is built, the plans are hashable,
+# so equal subexpressions are equal plans. They are frozen dataclasses
+# rather than NamedTuples, which would be equal to nodes of other kinds
+# with the same fields.
+
+
+@dataclass(frozen=True)
+class LoadNode:
+    source: str
+
+
+@dataclass(frozen=True)
+class LabelNode:
+    # A string used as an automaton: a single transition by the label
+    label: str
+
+
+@dataclass(frozen=True)
+class IntersectNode:
+    # A chain a & b & c is kept as one node, see intersect_values
+    operands: Tuple[Any, ...]
+
+
+@dataclass(frozen=True)
+class ConcatNode:
+    left: Any
+    right: Any
+
+
+@dataclass(frozen=True)
+class UnionNode:
+    left: Any
+    right: Any
+
+
+@dataclass(frozen=True)
+class StarNode:
+    operand: Any
+
+
+@dataclass(frozen=True)
+class StatesNode:
+    # kind is "start", "final", "add_start" or "add_final"
+    operand: Any
+    kind: str
+    vertices: FrozenSet[Any]
+
+
+PlanNode = Union[
+    LoadNode, LabelNode, IntersectNode, ConcatNode, UnionNode, StarNode, StatesNode
+]
+PLAN_NODES = (
+    LoadNode,
+    LabelNode,
+    IntersectNode,
+    ConcatNode,
+    UnionNode,
+    StarNode,
+    StatesNode,
+)
+STATES_KINDS = ("start", "final", "add_start", "add_final")
+
+
+class GraphSource(NamedTuple):
+    # A graph with its start and final vertices (all vertices if None)
+    graph: PreparedGraph
+    start: Optional[FrozenSet[Any]]
+    final: Optional[FrozenSet[Any]]
+
+
+def is_automaton(value: Any) -> bool:
+    # Strings are automata when they meet automaton operators
+    return isinstance(value, (str,) + PLAN_NODES)
+
+
+def as_plan(value: Any) -> PlanNode:
+    if isinstance(value, str):
+        return LabelNode(value)
+    if isinstance(value, PLAN_NODES):
+        return value
+    raise InterpretationError(f"Expected an automaton, got {_type_name(value)}")
+
+
+def intersect_values(lhs: Any, rhs: Any) -> Any:
+    """
+    The & operator: intersection of sets or of automata.
+    Intersection chains are flattened into one IntersectNode,
+    so that they are evaluated by a single traversal.
+    """
+    if isinstance(lhs, set) and isinstance(rhs, set):
+        return lhs & rhs
+    operands = []
+    for value in (lhs, rhs):
+        plan = as_plan(value)
+        operands.extend(plan.operands if isinstance(plan, IntersectNode) else [plan])
+    return IntersectNode(tuple(operands))
+
+
+def union_values(lhs: Any, rhs: Any) -> Any:
+    if isinstance(lhs, set) and isinstance(rhs, set):
+        return lhs | rhs
+    return UnionNode(as_plan(lhs), as_plan(rhs))
+
+
+def concat_values(lhs: Any, rhs: Any) -> Any:
+    if isinstance(lhs, list) and isinstance(rhs, list):
+        return lhs + rhs
+    return ConcatNode(as_plan(lhs), as_plan(rhs))
+
+
+def star_value(value: Any) -> StarNode:
+    return StarNode(as_plan(value))
+
+
+def states_value(value: Any, kind: str, vertices: Iterable[Any]) -> StatesNode:
+    # start(g, vertices), final(g, vertices), add_start(...) and add_final(...)
+    if isinstance(vertices, (str,) + PLAN_NODES):
+        raise InterpretationError(
+            f"Expected a set of vertices, got {_type_name(vertices)}"
+        )
+    return StatesNode(as_plan(value), kind, frozenset(vertices))
+
+
+def load_graph_source(source: str) -> LabeledGraph:
+    """
+    Loads the graph of load(source): a DOT file, an edge list file
+    with "source_node target_node edge_label" lines or a cfpq_data graph name.
+    """
+    if source.endswith(".dot"):
+        graph = nx_pydot.read_dot(source)
+        for _, _, data in graph.edges(data=True):
+            if "label" in data:
+                data["label"] = data["label"].strip('"')
+        return graph
+    if os.path.exists(source):
+        return read_edge_list(source)
+    return load_cached_graph(source).graph
+
+
+class CostEstimate(NamedTuple):
+    # The size of an automaton: its states and the transitions of every label
+    states: int
+    label_counts: Dict[Any, int]
+
+    @property
+    def transitions(self) -> int:
+        return sum(self.label_counts.values())
+
+
+class QueryPlan(NamedTuple):
+    """
+    A get_reachable query as it is run: one BFS over the product of the graph side
+    (the product of graphs, in program order) and the intersection of the languages,
+    which are intersected in the given order. start and final are the seeds that
+    could not be pushed into a graph and filter the result instead.
+    """
+
+    graphs: Tuple[Tuple[PlanNode, GraphSource], ...]
+    languages: Tuple[PlanNode, ...]
+    start: Optional[FrozenSet[Any]]
+    final: Optional[FrozenSet[Any]]
+
+
+class PlanEvaluator:
+    """
+    Evaluates the plans of one program run.
+
+    Every loaded graph is read once and kept as a PreparedGraph. Plans are compared
+    by value, so a subexpression bound to several variables or written several
+    times is evaluated once: the minimal DFAs, the materialized automata and the
+    reachable pairs are kept per plan for the whole run.
+    An intersection of graphs and languages is evaluated as one BFS over the
+    product of the graph and a single DFA: the language operands are intersected
+    as small minimal DFAs first, smallest first, and the product with the graph
+    is never built unless its states or edges are requested. See explain.
+    """
+
+    def __init__(self, loader: Callable[[str], LabeledGraph] = load_graph_source):
+        self.loader = loader
+        self._graphs: Dict[str, PreparedGraph] = {}
+        self._dfas: Dict[PlanNode, DeterministicFiniteAutomaton] = {}
+        self._automata: Dict[PlanNode, BooleanAdjacencyMatrix] = {}
+        self._matrices: Dict[GraphSource, BooleanAdjacencyMatrix] = {}
+        self._reachable: Dict[Tuple, Set[Tuple[Any, Any]]] = {}
+
+    # Queries
+
+    def reachable(
+        self,
+        plan: Any,
+        start: Optional[Iterable[Any]] = None,
+        final: Optional[Iterable[Any]] = None,
+    ) -> Set[Tuple[Any, Any]]:
+        """
+        Returns the pairs (start, final) of states of the automaton
+        connected by a non-empty path, for an intersection of a graph with
+        languages the states are the graph vertices.
+        If start or final is given, only the pairs whose start (final) state is in it
+        are returned: for a single graph they become the seeds of the BFS.
+        """
+        start = None if start is None else frozenset(start)
+        final = None if final is None else frozenset(final)
+        key = (as_plan(plan), start, final)
+        if key not in self._reachable:
+            self._reachable[key] = self._run_query(self.plan_query(*key))
+        return set(self._reachable[key])
+
+    def vertices(self, plan: Any) -> Set[Any]:
+        source = self.resolve(as_plan(plan))
+        if isinstance(source, GraphSource):
+            return set(source.graph.nodes)
+        return set(self.automaton(source).states)
+
+    def edges(self, plan: Any) -> Set[Tuple[Any, Any, Any]]:
+        source = self.resolve(as_plan(plan))
+        if isinstance(source, GraphSource):
+            return set(source.graph.edges(data="label"))
+        matrix = self.automaton(source)
+        return {
+            (matrix.states[u], label.value, matrix.states[v])
+            for label, adjacency in matrix.adj_matrices.items()
+            for u, v in zip(*adjacency.nonzero())
+        }
+
+    def labels(self, plan: Any) -> Set[Any]:
+        source = self.resolve(as_plan(plan))
+        if isinstance(source, GraphSource):
+            return set(source.graph.label_counts)
+        return {label.value for label in self.automaton(source).adj_matrices}
+
+    def start_states(self, plan: Any) -> Set[Any]:
+        return self._states(plan, "start")
+
+    def final_states(self, plan: Any) -> Set[Any]:
+        return self._states(plan, "final")
+
+    def _states(self, plan: Any, kind: str) -> Set[Any]:
+        source = self.resolve(as_plan(plan))
+        if isinstance(source, GraphSource):
+            states = source.start if kind == "start" else source.final
+            return set(source.graph.nodes) if states is None else set(states)
+        matrix = self.automaton(source)
+        vector = matrix.start_states if kind == "start" else matrix.final_states
+        return {matrix.states[i] for i in vector.nonzero()[1]}
+
+    # Planning
+
+    def plan_query(
+        self,
+        plan: PlanNode,
+        start: Optional[FrozenSet[Any]] = None,
+        final: Optional[FrozenSet[Any]] = None,
+    ) -> QueryPlan:
+        # Splits a reachability query into the graph side and the ordered languages
+        source = self.resolve(plan)
+        if isinstance(source, GraphSource):
+            graphs, languages = [(plan, source)], []
+        elif isinstance(source, IntersectNode):
+            graphs, languages = self._split(source)
+        else:
+            graphs, languages = [], [source]
+        if len(graphs) == 1:
+            # The seeds of a single graph restrict its start and final vertices
+            operand, graph = graphs[0]
+            graphs = [(operand, _restricted(graph, start, final))]
+            start = final = None
+        languages.sort(key=lambda language: self.estimate(language).states)
+        return QueryPlan(tuple(graphs), tuple(languages), start, final)
+
+    def estimate(self, plan: Any) -> CostEstimate:
+        """
+        Estimates the size of the automaton of a plan from the label statistics
+        of the graphs and the minimal DFAs of the languages. Products with graphs
+        are estimated by the product of the states and of the transitions of every
+        common label, which is exact for the Kronecker product, intersections of
+        languages are measured on their minimal DFA.
+        """
+        if isinstance(plan, GraphSource):
+            source = plan
+        else:
+            source = self.resolve(as_plan(plan))
+        if isinstance(source, GraphSource):
+            return CostEstimate(
+                source.graph.number_of_nodes(),
+                {label: int(n) for label, n in source.graph.label_counts.items()},
+            )
+        if isinstance(source, IntersectNode):
+            query = self.plan_query(source)
+            if query.graphs:
+                estimates = [self.estimate(graph) for _, graph in query.graphs]
+                if query.languages:
+                    estimates.append(self.estimate(_fused_plan(query.languages)))
+                return _product_estimate(estimates)
+            source = _fused_plan(query.languages)
+        label_counts = {}
+        for transitions in self.dfa(source).to_dict().values():
+            for label in transitions:
+                label_counts[label.value] = label_counts.get(label.value, 0) + 1
+        return CostEstimate(len(self.dfa(source).states), label_counts)
+
+    def explain(
+        self,
+        plan: Any,
+        start: Optional[Iterable[Any]] = None,
+        final: Optional[Iterable[Any]] = None,
+    ) -> str:
+        """
+        Describes how reachable(plan, start, final) is evaluated:
+        the graph side, the languages in intersection order and the estimated
+        sizes of every operand and of the product traversed by the BFS.
+        """
+        query = self.plan_query(
+            as_plan(plan),
+            None if start is None else frozenset(start),
+            None if final is None else frozenset(final),
+        )
+        estimates = []
+        lines = []
+        for operand, graph in query.graphs:
+            estimate = self.estimate(graph)
+            estimates.append(estimate)
+            lines.append(
+                f"  graph {format_plan(operand)}, "
+                f"start: {_format_seed(graph.start)}, final: {_format_seed(graph.final)}: "
+                f"{_format_estimate(estimate)}"
+            )
+        if query.languages:
+            lines.append("  languages, in intersection order:")
+            for language in query.languages:
+                lines.append(
+                    f"    {format_plan(language)}: "
+                    f"{_format_estimate(self.estimate(language))}"
+                )
+            fused = self.estimate(_fused_plan(query.languages))
+            lines.append(f"  intersected languages: {_format_estimate(fused)}")
+            estimates.append(fused)
+        if query.start is not None or query.final is not None:
+            lines.append(
+                f"  result filter, start: {_format_seed(query.start)}, "
+                f"final: {_format_seed(query.final)}"
+            )
+        side = "graph" if query.graphs else "automaton"
+        header = (
+            f"reachable: one BFS over the {side} and the query automaton, "
+            f"at most {_format_estimate(_product_estimate(estimates))}"
+        )
+        return "\n".join([header] + lines)
+
+    # Evaluation
+
+    def resolve(self, plan: PlanNode) -> Union[GraphSource, PlanNode]:
+        # Graph-valued plans become a GraphSource, the other plans are left as they are
+        if isinstance(plan, LoadNode):
+            if plan.source not in self._graphs:
+                self._graphs[plan.source] = PreparedGraph(self.loader(plan.source))
+            return GraphSource(self._graphs[plan.source], None, None)
+        if isinstance(plan, StatesNode):
+            source = self.resolve(plan.operand)
+            if not isinstance(source, GraphSource):
+                source = _matrix_to_source(self.automaton(source))
+            return _with_states(source, plan.kind, plan.vertices)
+        return plan
+
+    def automaton(self, plan: Any) -> BooleanAdjacencyMatrix:
+        """
+        Materializes the automaton of a plan, the states are graph vertices,
+        numbers of minimal DFA states or (lhs state, rhs state) pairs for products.
+        """
+        source = self.resolve(as_plan(plan))
+        if isinstance(source, GraphSource):
+            return self._source_matrix(source)
+        if source not in self._automata:
+            if isinstance(source, IntersectNode):
+                query = self.plan_query(source)
+                matrices = [self._source_matrix(graph) for _, graph in query.graphs]
+                if query.languages or not matrices:
+                    matrices.append(_dfa_matrix(self.dfa(_fused_plan(query.languages))))
+                self._automata[source] = reduce(_product, matrices)
+            else:
+                self._automata[source] = _dfa_matrix(self.dfa(source))
+        return self._automata[source]
+
+    def dfa(self, plan: PlanNode) -> DeterministicFiniteAutomaton:
+        # The minimal DFA of a plan, built once per plan
+        if plan not in self._dfas:
+            self._dfas[plan] = self._nfa(plan).minimize()
+        return self._dfas[plan]
+
+    def _nfa(self, plan: PlanNode) -> EpsilonNFA:
+        source = self.resolve(plan)
+        if isinstance(source, GraphSource):
+            return build_nfa_from_graph(source.graph.graph, source.start, source.final)
+        if isinstance(source, LabelNode):
+            nfa = EpsilonNFA()
+            nfa.add_transition(0, Symbol(source.label), 1)
+            nfa.add_start_state(0)
+            nfa.add_final_state(1)
+            return nfa
+        if isinstance(source, ConcatNode):
+            return self.dfa(source.left).concatenate(self.dfa(source.right))
+        if isinstance(source, UnionNode):
+            return self.dfa(source.left).union(self.dfa(source.right))
+        if isinstance(source, StarNode):
+            return self.dfa(source.operand).kleene_star()
+        if isinstance(source, IntersectNode):
+            result = self.dfa(source.operands[0])
+            for operand in source.operands[1:]:
+                if not result.final_states:
+                    break  # The intersection is already empty
+                result = result.get_intersection(self.dfa(operand)).minimize()
+            return result
+        raise InterpretationError(f"Unknown plan {source}")
+
+    def _split(self, plan: IntersectNode) -> Tuple[list, list]:
+        # Splits the operands of an intersection into (operand, graph) pairs and languages
+        graphs, languages = [], []
+        for operand in plan.operands:
+            source = self.resolve(operand)
+            if isinstance(source, GraphSource):
+                graphs.append((operand, source))
+            else:
+                languages.append(source)
+        return graphs, languages
+
+    def _source_matrix(self, source: GraphSource) -> BooleanAdjacencyMatrix:
+        if source not in self._matrices:
+            self._matrices[source] = build_graph_matrix(
+                source.graph, source.start, source.final
+            )
+        return self._matrices[source]
+
+    def _run_query(self, query: QueryPlan) -> Set[Tuple[Any, Any]]:
+        if query.languages:
+            dfa = self.dfa(_fused_plan(query.languages))
+            if not dfa.final_states:
+                return set()  # The languages have no common word
+        if query.graphs:
+            graph_matrix = reduce(
+                _product, [self._source_matrix(graph) for _, graph in query.graphs]
+            )
+            if query.languages:
+                query_matrix = _dfa_matrix(dfa)
+            else:
+                query_matrix = _universal_matrix(graph_matrix.adj_matrices)
+        else:
+            graph_matrix = _dfa_matrix(dfa)
+            query_matrix = _universal_matrix(graph_matrix.adj_matrices)
+        if not graph_matrix.adj_matrices.keys() & query_matrix.adj_matrices.keys():
+            return set()  # No common label, so no non-empty path
+
+        states = dict(enumerate(graph_matrix.states))
+        result = find_accessible_by_matrices(graph_matrix, query_matrix, states, True)
+        return {
+            (start, final)
+            for start, finals in result.items()
+            if query.start is None or start in query.start
+            for final in finals
+            if query.final is None or final in query.final
+        }
+
+
+def format_plan(plan: Any) -> str:
+    # The plan in the syntax of the query language
+    if isinstance(plan, LoadNode):
+        return f'load("{plan.source}")'
+    if isinstance(plan, LabelNode):
+        return f'"{plan.label}"'
+    if isinstance(plan, IntersectNode):
+        return "(" + " & ".join(format_plan(op) for op in plan.operands) + ")"
+    if isinstance(plan, ConcatNode):
+        return f"({format_plan(plan.left)} . {format_plan(plan.right)})"
+    if isinstance(plan, UnionNode):
+        return f"({format_plan(plan.left)} | {format_plan(plan.right)})"
+    if isinstance(plan, StarNode):
+        return f"{format_plan(plan.operand)}*"
+    if isinstance(plan, StatesNode):
+        return (
+            f"{plan.kind}({format_plan(plan.operand)}, {_format_seed(plan.vertices)})"
+        )
+    return repr(plan)
+
+
+def _fused_plan(languages: Tuple[PlanNode, ...]) -> PlanNode:
+    return languages[0] if len(languages) == 1 else IntersectNode(tuple(languages))
+
+
+def _product_estimate(estimates: List[CostEstimate]) -> CostEstimate:
+    if not estimates:
+        return CostEstimate(0, {})
+    labels = set.intersection(*(set(e.label_counts) for e in estimates))
+    return CostEstimate(
+        reduce(operator.mul, (e.states for e in estimates)),
+        {
+            label: reduce(operator.mul, (e.label_counts[label] for e in estimates))
+            for label in labels
+        },
+    )
+
+
+def _format_estimate(estimate: CostEstimate) -> str:
+    return f"{estimate.states} states, {estimate.transitions} transitions"
+
+
+def _format_seed(vertices: Optional[FrozenSet[Any]]) -> str:
+    return "all" if vertices is None else f"{len(vertices)} vertices"
+
+
+def _restricted(
+    source: GraphSource,
+    start: Optional[FrozenSet[Any]],
+    final: Optional[FrozenSet[Any]],
+) -> GraphSource:
+    # Keeps only the given start and final vertices of a graph,
+    # the vertices outside the graph are dropped as they reach nothing
+    if start is not None:
+        start = frozenset(v for v in start if v in source.graph)
+        source = source._replace(
+            start=start if source.start is None else source.start & start
+        )
+    if final is not None:
+        final = frozenset(v for v in final if v in source.graph)
+        source = source._replace(
+            final=final if source.final is None else source.final & final
+        )
+    return source
+
+
+def _with_states(source: GraphSource, kind: str, vertices: FrozenSet) -> GraphSource:
+    if kind not in STATES_KINDS:
+        raise InterpretationError(f"Unknown states operation {kind}")
+    if kind == "start":
+        return source._replace(start=vertices)
+    if kind == "final":
+        return source._replace(final=vertices)
+    # Adding to all vertices leaves all vertices
+    if kind == "add_start":
+        start = None if source.start is None else source.start | vertices
+        return source._replace(start=start)
+    final = None if source.final is None else source.final | vertices
+    return source._replace(final=final)
+
+
+def _matrix_to_source(matrix: BooleanAdjacencyMatrix) -> GraphSource:
+    # A materialized automaton as a graph with its start and final states
+    vertices = np.empty(matrix.num_states, dtype=object)
+    for i, state in enumerate(matrix.states):
+        vertices[i] = state
+    graph = CompactGraph(
+        vertices,
+        {
+            label.value: adjacency.tocsr()
+            for label, adjacency in matrix.adj_matrices.items()
+        },
+    )
+    return GraphSource(
+        PreparedGraph(graph),
+        frozenset(matrix.states[i] for i in matrix.start_states.nonzero()[1]),
+        frozenset(matrix.states[i] for i in matrix.final_states.nonzero()[1]),
+    )
+
+
+def _dfa_matrix(dfa: DeterministicFiniteAutomaton) -> BooleanAdjacencyMatrix:
+    # The states of a minimal DFA have no meaning of their own, they are numbered
+    matrix = BooleanAdjacencyMatrix(dfa)
+    matrix.states = list(range(matrix.num_states))
+    return matrix
+
+
+def _universal_matrix(adj_matrices: Dict[Symbol, Any]) -> BooleanAdjacencyMatrix:
+    # One start and final state with a loop by every label: accepts every word
+    nfa = EpsilonNFA()
+    for label in adj_matrices:
+        nfa.add_transition(0, label, 0)
+    nfa.add_start_state(0)
+    nfa.add_final_state(0)
+    return BooleanAdjacencyMatrix(nfa)
+
+
+def _product(
+    lhs: BooleanAdjacencyMatrix, rhs: BooleanAdjacencyMatrix
+) -> BooleanAdjacencyMatrix:
+    # The intersection with (lhs state, rhs state) states, see get_intersection
+    product = lhs.get_intersection(rhs)
+    product.states = [(u, q) for u in lhs.states for q in rhs.states]
+    return product
+
+
+def _type_name(value: Any) -> str:
+    if isinstance(value, PLAN_NODES):
+        return "automaton"
+    return type(value).__name__
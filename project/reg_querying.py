@@ -1,10 +1,33 @@
-from typing import Tuple, Iterable, Set, Tuple, Dict
+import operator
+from functools import reduce
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Any,
+    Tuple,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Dict,
+    Union,
+)
+
+import numpy as np
 from pyformlang.finite_automaton import EpsilonNFA
 from networkx import MultiDiGraph
-from scipy.sparse import dok_matrix, block_diag
+from scipy.sparse import coo_matrix, csr_matrix, identity, kron
 
-from project.fa_building import build_minimal_dfa_by_regex, build_nfa_from_graph
-from project.boolean_adjacency_matrix import BooleanAdjacencyMatrix
+from project.fa_building import build_minimal_dfa_by_regex, compile_regex
+from project.prepared_graph import QueryGraph, build_graph_matrix
+from project.boolean_adjacency_matrix import (
+    BooleanAdjacencyMatrix,
+    ClosureStats,
+    to_array,
+)
 
 
 def intersect(fa1: EpsilonNFA, fa2: EpsilonNFA) -> EpsilonNFA:
@@ -25,68 +48,568 @@ def intersect(fa1: EpsilonNFA, fa2: EpsilonNFA) -> EpsilonNFA:
 
 def regular_query(
     regex: str,
-    graph: MultiDiGraph,
+    graph: QueryGraph,
     start_states: Iterable[any] = None,
     final_stated: Iterable[any] = None,
+    backend: str = "csr",
+    closure_strategy: str = "auto",
+    lazy: bool = False,
+    limit: Optional[int] = None,
+    stats: Optional[List[ClosureStats]] = None,
 ) -> Iterable[Tuple[any, any]]:
     """
     Query finite automaton built out of a graph with a regular expression.
+    The regex is compiled through the cache of compile_regex.
 
     Args:
         regex (str): The regular expression to be queried.
-        graph (MultiDiGraph): The graph to convert to NFA.
+        graph (QueryGraph): The graph to query, a MultiDiGraph, a CompactGraph
+            or a PreparedGraph whose matrices are reused.
         start_states (Iterable[any], optional): The starting states of the graph.
             If not specified, all nodes are assumed to be starting nodes. Defaults to None.
         final_stated (Iterable[any], optional): The final states of the graph.
             If not specified, all nodes are assumed to be final nodes. Defaults to None.
+        backend (str, optional): Storage backend of the BooleanAdjacencyMatrix
+            (see STORAGE_BACKENDS). Defaults to "csr".
+        closure_strategy (str, optional): "squaring", "delta" or "auto",
+            see transitive_closure. Defaults to "auto".
+        lazy (bool, optional): If True, run a BFS over the product of the graph
+            and the regex automaton instead of taking the closure of the
+            materialized intersection, so memory stays proportional to
+            the graph plus the automaton. Defaults to False.
+        limit (int, optional): If set, at most limit pairs are returned and the search
+            stops as soon as they are found, see iter_regular_query. The search is
+            always the lazy BFS then, so a closure_strategy other than "auto"
+            raises ValueError. Defaults to None.
+        stats (List[ClosureStats], optional): If given, the ClosureStats of the
+            transitive closure are appended to it. The lazy and limit searches
+            take no closure and append nothing. Defaults to None.
 
     Returns:
         Iterable[Tuple[any, any]]: Set of pairs (tuples) of graph nodes so that the second node
         is achievable from the first by a path that is accepted by
         the regular expression.
     """
-    regex_graph_matrix = BooleanAdjacencyMatrix(build_minimal_dfa_by_regex(regex))
-    graph_matrix = BooleanAdjacencyMatrix(
-        build_nfa_from_graph(graph, start_states, final_stated)
-    )
+    if limit is not None:
+        if closure_strategy != "auto":
+            raise ValueError("closure_strategy cannot be combined with limit")
+        pairs = iter_regular_query(regex, graph, start_states, final_stated, backend)
+        return set(islice(pairs, limit))
+    regex_graph_matrix = compile_regex(regex).matrix(backend)
+    graph_matrix = build_graph_matrix(graph, start_states, final_stated, backend)
+    if lazy:
+        return set(_iter_lazy_query(graph_matrix, regex_graph_matrix))
 
     intersected_matrix = graph_matrix.get_intersection(regex_graph_matrix)
-    tc = intersected_matrix.get_transitive_closure()
+    tc = intersected_matrix.get_transitive_closure(closure_strategy)
+    if stats is not None:
+        stats.append(intersected_matrix.closure_stats)
 
-    start_states_arr = intersected_matrix.start_states.toarray()
-    final_states_arr = intersected_matrix.final_states.toarray()
+    start_states_arr = to_array(intersected_matrix.start_states)
+    final_states_arr = to_array(intersected_matrix.final_states)
 
     result = set()
     for start, final in zip(*tc.nonzero()):
         if start_states_arr[0, start] and final_states_arr[0, final]:
-            start_v = start // regex_graph_matrix.num_states
-            final_v = final // regex_graph_matrix.num_states
+            start_v = graph_matrix.states[start // regex_graph_matrix.num_states]
+            final_v = graph_matrix.states[final // regex_graph_matrix.num_states]
             result.add((start_v, final_v))
     return result
 
 
+def iter_regular_query(
+    regex: str,
+    graph: QueryGraph,
+    start_states: Iterable[any] = None,
+    final_states: Iterable[any] = None,
+    backend: str = "csr",
+) -> Iterator[Tuple[any, any]]:
+    """
+    Yields the pairs of regular_query as the BFS over the product of the graph and
+    the regex automaton finds them, pairs found after fewer steps first.
+    The search advances only when the next pair is requested, so consumers
+    that stop early do not pay for the full result.
+    """
+    regex_matrix = compile_regex(regex).matrix(backend)
+    graph_matrix = build_graph_matrix(graph, start_states, final_states, backend)
+    yield from _iter_lazy_query(graph_matrix, regex_matrix)
+
+
+def regular_query_exists(
+    regex: str,
+    graph: QueryGraph,
+    start_states: Iterable[any] = None,
+    final_states: Iterable[any] = None,
+    backend: str = "csr",
+) -> bool:
+    """
+    Checks whether some start vertex is connected to some final vertex by a path
+    accepted by the regex, stopping the search at the first such pair.
+    """
+    pairs = iter_regular_query(regex, graph, start_states, final_states, backend)
+    return next(pairs, None) is not None
+
+
+def _iter_lazy_query(
+    graph_matrix: BooleanAdjacencyMatrix, regex_matrix: BooleanAdjacencyMatrix
+) -> Iterator[Tuple]:
+    """
+    Multi-source BFS over the lazy intersection of the graph and the regex automaton.
+    Every column of the front is one (start vertex, start regex state) source,
+    so only the reached product states are ever stored.
+    The accepted pairs of every BFS step are yielded before the next step.
+    """
+    operators = list(graph_matrix.get_lazy_intersection(regex_matrix).values())
+    q_num_states = regex_matrix.num_states
+    num_states = graph_matrix.num_states * q_num_states
+    graph_starts = graph_matrix.start_states.nonzero()[1]
+    regex_starts = regex_matrix.start_states.nonzero()[1]
+    source_vertices = np.repeat(graph_starts, len(regex_starts))
+    source_states = source_vertices * q_num_states + np.tile(
+        regex_starts, len(graph_starts)
+    )
+    num_sources = len(source_states)
+    graph_finals = to_array(graph_matrix.final_states)[0]
+    regex_finals = to_array(regex_matrix.final_states)[0]
+
+    front = coo_matrix(
+        (np.ones(num_sources, dtype=bool), (source_states, np.arange(num_sources))),
+        shape=(num_states, num_sources),
+    ).tocsr()
+    visited = csr_matrix((num_states, num_sources), dtype=bool)
+    found = set()
+    while operators and front.nnz:
+        step = reduce(operator.add, (op.rmatmat(front) for op in operators))
+        front = step > visited
+        visited = visited + front
+
+        states, sources = front.nonzero()
+        vertices, regex_states = np.divmod(states, q_num_states)
+        accepted = graph_finals[vertices] & regex_finals[regex_states]
+        for start, final in zip(source_vertices[sources[accepted]], vertices[accepted]):
+            pair = (graph_matrix.states[start], graph_matrix.states[final])
+            if pair not in found:
+                found.add(pair)
+                yield pair
+
+
 def find_accessible_vertices(
     regex: str,
-    graph: MultiDiGraph,
+    graph: QueryGraph,
     start_states: Set = None,
     final_states: Set = None,
     for_each: bool = False,
+    backend: str = "csr",
+    chunk_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    limit: Optional[int] = None,
 ) -> Set:
     """
     Transforms the given graph and regular query into a deterministic state machine
-    and finds accessible vertices in the graph based on the query
+    and finds accessible vertices in the graph based on the query.
+    The matrices are stored in the given backend (see STORAGE_BACKENDS).
+    If chunk_size is set, the start vertices are processed in batches of that size,
+    which bounds the size of the BFS fronts. With workers > 1 the batches are
+    processed by a pool of that many processes.
+    If limit is set, at most limit vertices (with for_each, (start, vertex) pairs)
+    are returned and the BFS stops as soon as they are found. All start vertices
+    are searched at once then, so chunk_size and workers raise ValueError with limit.
+    The regex is compiled through the cache of compile_regex, and the matrices
+    of a PreparedGraph are reused.
+    """
+    if limit is not None:
+        if chunk_size is not None or workers is not None:
+            raise ValueError("chunk_size and workers cannot be combined with limit")
+        found = islice(
+            iter_accessible_vertices(
+                regex, graph, start_states, final_states, for_each, backend
+            ),
+            limit,
+        )
+        if not for_each:
+            return set(found)
+        result = {}
+        for start, vertex in found:
+            result.setdefault(start, set()).add(vertex)
+        return result
+    graph_matrix = build_graph_matrix(graph, start_states, final_states, backend)
+    states = dict(enumerate(graph_matrix.states))
+    query_matrix = compile_regex(regex).matrix(backend)
+    if chunk_size is not None or workers is not None:
+        return find_accessible_in_chunks(
+            graph_matrix, query_matrix, states, for_each, chunk_size, workers
+        )
+    return find_accessible_by_matrices(graph_matrix, query_matrix, states, for_each)
+
+
+def iter_accessible_vertices(
+    regex: str,
+    graph: QueryGraph,
+    start_states: Set = None,
+    final_states: Set = None,
+    for_each: bool = False,
+    backend: str = "csr",
+) -> Iterator[Any]:
+    """
+    Yields the result of find_accessible_vertices as the BFS finds it: the accessible
+    vertices or, with for_each, (start vertex, accessible vertex) pairs.
+    The BFS makes the next step only when the next item is requested.
     """
-    regex_nfa = build_minimal_dfa_by_regex(regex)
-    graph_nfa = build_nfa_from_graph(graph, start_states, final_states)
-    states = {ind: state for ind, state in enumerate(graph_nfa.states)}
+    graph_matrix = build_graph_matrix(graph, start_states, final_states, backend)
+    states = dict(enumerate(graph_matrix.states))
+    query_matrix = compile_regex(regex).matrix(backend)
+
+    front = _initialize_state_matrices(graph_matrix, query_matrix, for_each)
+    num_sources = front.shape[0] // max(query_matrix.num_states, 1)
+    transitions = _create_transitions(query_matrix, graph_matrix, num_sources)
+    bd_final_states = to_array(graph_matrix.final_states)[0]
+    q_final_states = to_array(query_matrix.final_states)[0]
+    start_vertices = graph_matrix.start_states.nonzero()[1]
+    found = set()
+    for front, _ in _iter_fronts(transitions, front):
+        rows, vertices = front.nonzero()
+        sources, q_states = np.divmod(rows, query_matrix.num_states)
+        accepted = q_final_states[q_states] & bd_final_states[vertices]
+        for source, vertex in zip(sources[accepted], vertices[accepted]):
+            if for_each:
+                item = (states[start_vertices[source]], states[vertex])
+            else:
+                item = states[vertex]
+            if item not in found:
+                found.add(item)
+                yield item
+
+
+def single_pair_query(
+    regex: str,
+    graph: QueryGraph,
+    start: Any,
+    final: Any,
+    backend: str = "csr",
+) -> bool:
+    """
+    Checks whether final is accessible from start by a path accepted by the regex,
+    the same as final in find_accessible_vertices(regex, graph, {start}, {final}).
+
+    Bidirectional BFS over the product of the graph and the regex automaton:
+    forward from start in the start state of the automaton and backward from final
+    in its final states over the transposed label matrices. The smaller front
+    is expanded first and the search stops as soon as the two sides meet,
+    so only the states near some path between the two vertices are visited.
+    """
+    graph_matrix = build_graph_matrix(graph, [start], [final], backend)
+    query_matrix = compile_regex(regex).matrix(backend)
+    forward_front = _initialize_state_matrices(graph_matrix, query_matrix, False)
+    q_final_states = query_matrix.final_states.nonzero()[1]
+    bd_final_states = graph_matrix.final_states.nonzero()[1]
+    backward_front = coo_matrix(
+        (
+            np.ones(len(q_final_states) * len(bd_final_states), dtype=bool),
+            (
+                np.repeat(q_final_states, len(bd_final_states)),
+                np.tile(bd_final_states, len(q_final_states)),
+            ),
+        ),
+        shape=forward_front.shape,
+    ).tocsr()
+    transitions = _create_transitions(query_matrix, graph_matrix, 1)
+    forward = _iter_fronts(transitions, forward_front)
+    backward = _iter_fronts(
+        {
+            label: (moves.T.tocsr(), adj.T.tocsr())
+            for label, (moves, adj) in transitions.items()
+        },
+        backward_front,
+    )
+
+    # The forward side makes the first step, so that only non-empty paths are found
+    # as in find_accessible_vertices, the backward side starts with its initial front
+    forward_front, forward_visited = next(forward, (None, None))
+    if forward_front is None:
+        return False
+    backward_initial = backward_visited = backward_front
+    if forward_visited.multiply(backward_visited).nnz:
+        return True
+    while True:
+        if forward_front.nnz <= backward_front.nnz:
+            forward_front, forward_visited = next(forward, (None, None))
+            if forward_front is None:
+                return False
+            if forward_front.multiply(backward_visited).nnz:
+                return True
+        else:
+            backward_front, backward_visited = next(backward, (None, None))
+            if backward_front is None:
+                return False
+            backward_visited = backward_visited + backward_initial
+            if backward_front.multiply(forward_visited).nnz:
+                return True
+
+
+def find_path_witnesses(
+    regex: str,
+    graph: QueryGraph,
+    start_states: Set = None,
+    final_states: Set = None,
+    backend: str = "csr",
+) -> "PathWitnesses":
+    """
+    Runs the BFS of find_accessible_vertices with for_each and keeps the step
+    at which every product state was reached, so that a path can be shown for
+    every found pair. The witnesses take one integer per reached state of the
+    BFS, paths are rebuilt on demand by PathWitnesses.path.
+    """
+    graph_matrix = build_graph_matrix(graph, start_states, final_states, backend)
+    query_matrix = compile_regex(regex).matrix(backend)
+    front = _initialize_state_matrices(graph_matrix, query_matrix, True)
+    num_sources = front.shape[0] // max(query_matrix.num_states, 1)
+    transitions = _create_transitions(query_matrix, graph_matrix, num_sources)
+    levels = csr_matrix(front.shape, dtype=np.int32)
+    for step, (new_front, _) in enumerate(_iter_fronts(transitions, front), 1):
+        levels = levels + new_front.astype(np.int32) * step
+    return PathWitnesses(graph_matrix, query_matrix, front, levels)
+
+
+class PathWitnesses:
+    """
+    The result of find_path_witnesses.
+
+    Row 'source * q_num_states + q' of levels holds, for every vertex, the BFS step
+    at which the source start vertex reached the vertex in the query state q
+    (zero if it never did), front is the initial front of the BFS.
+    A state reached at step k has a predecessor reached at step k - 1,
+    so the shortest path to a pair is found backwards from its last vertex.
+    """
+
+    def __init__(
+        self,
+        bd_matrix: BooleanAdjacencyMatrix,
+        query_matrix: BooleanAdjacencyMatrix,
+        front: csr_matrix,
+        levels: csr_matrix,
+    ):
+        self.states = bd_matrix.states
+        self.q_num_states = query_matrix.num_states
+        self.front = front
+        self.levels = levels
+        self._index = {v: i for i, v in enumerate(self.states)}
+        self._sources = {
+            self.states[v]: source
+            for source, v in enumerate(bd_matrix.start_states.nonzero()[1])
+        }
+        self._bd_final_states = to_array(bd_matrix.final_states)[0]
+        self._q_final_states = np.flatnonzero(to_array(query_matrix.final_states)[0])
+        # For every common label: query state -> previous query states,
+        # vertex -> previous vertices
+        self._reverse = {
+            label: (
+                csr_matrix(query_matrix.adj_matrices[label], dtype=bool).T.tocsr(),
+                csr_matrix(bd_matrix.adj_matrices[label], dtype=bool).T.tocsr(),
+            )
+            for label in bd_matrix.adj_matrices.keys()
+            & query_matrix.adj_matrices.keys()
+        }
+
+    def pairs(self) -> Set[Tuple[Any, Any]]:
+        # The (start vertex, vertex) pairs of find_accessible_vertices with for_each
+        rows, vertices = self.levels.nonzero()
+        sources, q_states = np.divmod(rows, self.q_num_states)
+        accepted = (
+            np.isin(q_states, self._q_final_states) & self._bd_final_states[vertices]
+        )
+        start_states = list(self._sources)
+        return {
+            (start_states[source], self.states[v])
+            for source, v in zip(sources[accepted], vertices[accepted])
+        }
+
+    def path(self, start: Any, final: Any) -> Optional[List[Tuple[Any, Any, Any]]]:
+        """
+        Returns a shortest path from start to final accepted by the query
+        as a list of (source, label, target) edges, or None if there is no such path.
+        """
+        source = self._sources.get(start)
+        vertex = self._index.get(final)
+        if source is None or vertex is None or not self._bd_final_states[vertex]:
+            return None
+        rows = source * self.q_num_states + self._q_final_states
+        reached = [(self._level(row, vertex), row) for row in rows]
+        reached = [(level, row) for level, row in reached if level > 0]
+        if not reached:
+            return None
+        level, row = min(reached)
+
+        path = []
+        while level > 0:
+            row, prev_vertex, label = self._predecessor(source, row, vertex, level)
+            path.append((self.states[prev_vertex], label, self.states[vertex]))
+            vertex = prev_vertex
+            level -= 1
+        path.reverse()
+        return path
+
+    def _level(self, row: int, vertex: int) -> int:
+        begin, end = self.levels.indptr[row], self.levels.indptr[row + 1]
+        position = np.searchsorted(self.levels.indices[begin:end], vertex)
+        if position < end - begin and self.levels.indices[begin + position] == vertex:
+            return int(self.levels.data[begin + position])
+        return 0
+
+    def _predecessor(
+        self, source: int, row: int, vertex: int, level: int
+    ) -> Tuple[int, int, Any]:
+        # Finds a state of the previous BFS step with an edge to (row, vertex)
+        previous = self.front if level == 1 else self.levels
+        for label, (q_reverse, bd_reverse) in self._reverse.items():
+            q_state = row % self.q_num_states
+            prev_vertices = bd_reverse.indices[
+                bd_reverse.indptr[vertex] : bd_reverse.indptr[vertex + 1]
+            ]
+            for prev_q_state in q_reverse.indices[
+                q_reverse.indptr[q_state] : q_reverse.indptr[q_state + 1]
+            ]:
+                prev_row = source * self.q_num_states + prev_q_state
+                begin, end = previous.indptr[prev_row], previous.indptr[prev_row + 1]
+                cells = previous.indices[begin:end]
+                if level > 1:
+                    cells = cells[previous.data[begin:end] == level - 1]
+                matched = prev_vertices[np.isin(prev_vertices, cells)]
+                if len(matched):
+                    return prev_row, matched[0], getattr(label, "value", label)
+        raise AssertionError("A reached state has no predecessor")
+
+
+def find_accessible_vertices_batch(
+    regexes: Sequence[str],
+    graph: QueryGraph,
+    start_states: Set = None,
+    final_states: Set = None,
+    for_each: bool = False,
+    backend: str = "csr",
+) -> List[Union[Set, Dict[Any, Set]]]:
+    """
+    Evaluates several regular queries by a single BFS over the graph.
+    The query automaton is the disjoint union of the DFAs of the regexes, so every
+    product of the front with a label matrix of the graph is shared by all queries.
+
+    Returns:
+        The results of find_accessible_vertices(regex, graph, start_states,
+        final_states, for_each, backend) for every regex, in the same order.
+    """
+    graph_matrix = build_graph_matrix(graph, start_states, final_states, backend)
+    states = dict(enumerate(graph_matrix.states))
+    queries = [compile_regex(regex).matrix(backend) for regex in regexes]
+    union = BooleanAdjacencyMatrix.disjoint_union(queries, backend=backend)
+
+    front = _initialize_state_matrices(graph_matrix, union, for_each)
+    num_sources = front.shape[0] // max(union.num_states, 1)
+    transitions = _create_transitions(union, graph_matrix, num_sources)
+    sum_fronts = _compute_sum_fronts(transitions, front)
+
+    # The final states of a query tag the results that belong to it
+    bd_final_states = to_array(graph_matrix.final_states)[0]
+    union_final_states = to_array(union.final_states)[0]
+    rows, vertices = sum_fronts.nonzero()
+    sources, q_states = np.divmod(rows, max(union.num_states, 1))
+    accepted = union_final_states[q_states] & bd_final_states[vertices]
+    bounds = np.cumsum([0] + [query.num_states for query in queries])
+    owners = np.searchsorted(bounds, q_states[accepted], side="right") - 1
+    sources, vertices = sources[accepted], vertices[accepted]
+    return [
+        _collect_result(
+            graph_matrix,
+            sources[owners == k],
+            vertices[owners == k],
+            states,
+            for_each,
+        )
+        for k in range(len(queries))
+    ]
+
+
+def find_accessible_in_chunks(
+    bd_matrix: BooleanAdjacencyMatrix,
+    query_matrix: BooleanAdjacencyMatrix,
+    states_dict: Dict,
+    for_each: bool,
+    chunk_size: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> Union[Set, Dict[Any, Set]]:
+    """
+    Runs find_accessible_by_matrices for batches of start states and merges the results.
+    The accessible set of the whole start set is the union of the batch results,
+    and with for_each every batch yields the answers for its own start states.
+
+    Args:
+        chunk_size: number of start states in a batch. By default the start states
+            are split evenly between the workers.
+        workers: number of worker processes. None or 1 runs the batches one by one
+            in the current process.
+    """
+    start_states = bd_matrix.start_states.nonzero()[1]
+    if chunk_size is None:
+        chunk_size = -(-len(start_states) // (workers or 1))
+    chunk_size = max(chunk_size, 1)
+    chunks = [
+        start_states[i : i + chunk_size]
+        for i in range(0, len(start_states), chunk_size)
+    ]
+
+    if workers is None or workers <= 1:
+        chunk_results = (
+            find_accessible_by_matrices(
+                bd_matrix.with_states(start_states=chunk),
+                query_matrix,
+                states_dict,
+                for_each,
+            )
+            for chunk in chunks
+        )
+        return _merge_chunk_results(chunk_results, for_each)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_chunk_worker,
+        initargs=(bd_matrix, query_matrix, states_dict, for_each),
+    ) as executor:
+        return _merge_chunk_results(
+            executor.map(_find_accessible_chunk, chunks), for_each
+        )
+
+
+# Query arguments shared by all chunks, set once per worker process
+_chunk_query = None
+
+
+def _init_chunk_worker(
+    bd_matrix: BooleanAdjacencyMatrix,
+    query_matrix: BooleanAdjacencyMatrix,
+    states_dict: Dict,
+    for_each: bool,
+) -> None:
+    global _chunk_query
+    _chunk_query = (bd_matrix, query_matrix, states_dict, for_each)
+
+
+def _find_accessible_chunk(chunk: np.ndarray) -> Union[Set, Dict[Any, Set]]:
+    bd_matrix, query_matrix, states_dict, for_each = _chunk_query
     return find_accessible_by_matrices(
-        BooleanAdjacencyMatrix(graph_nfa),
-        BooleanAdjacencyMatrix(regex_nfa),
-        states,
+        bd_matrix.with_states(start_states=chunk),
+        query_matrix,
+        states_dict,
         for_each,
     )
 
 
+def _merge_chunk_results(
+    chunk_results: Iterable[Union[Set, Dict[Any, Set]]], for_each: bool
+) -> Union[Set, Dict[Any, Set]]:
+    result = {} if for_each else set()
+    for chunk_result in chunk_results:
+        result.update(chunk_result)
+    return result
+
+
 def find_accessible_by_matrices(
     bd_matrix: BooleanAdjacencyMatrix,
     query_matrix: BooleanAdjacencyMatrix,
@@ -98,67 +621,52 @@ def find_accessible_by_matrices(
     If for_each is false, then for the specified set of start states find a set of accessible ones.
     Otherwise, for each state from the specified set find a set of accessible vertices.
     """
-    start_states = bd_matrix.start_states.nonzero()[1]
-    final_states = set(bd_matrix.final_states.nonzero()[1])
-    init_state_matrix, front = _initialize_state_matrices(
-        bd_matrix, query_matrix, for_each
-    )
-    transitions = _create_transitions(query_matrix, bd_matrix)
-    sum_fronts = _compute_sum_fronts(
-        transitions, front, init_state_matrix, query_matrix.num_states
-    )
-    return _compute_result(
-        bd_matrix,
-        query_matrix,
-        start_states,
-        final_states,
-        sum_fronts,
-        states_dict,
-        for_each,
-    )
+    front = _initialize_state_matrices(bd_matrix, query_matrix, for_each)
+    num_sources = front.shape[0] // max(query_matrix.num_states, 1)
+    transitions = _create_transitions(query_matrix, bd_matrix, num_sources)
+    sum_fronts = _compute_sum_fronts(transitions, front)
+    return _compute_result(bd_matrix, query_matrix, sum_fronts, states_dict, for_each)
 
 
 def _initialize_state_matrices(
     bd_matrix: BooleanAdjacencyMatrix,
     query_matrix: BooleanAdjacencyMatrix,
     for_each: bool,
-) -> Tuple[dok_matrix, dok_matrix]:
+) -> csr_matrix:
     """
-    The initial state matrix 'front' and an empty state matrix with the required size
-    are initialized depending on how we find the accessible: for each separately or for all together.
+    The initial front: row 'source * q_num_states + q' holds the graph vertices
+    the source has reached in the query state q.
+    If for_each is true every start vertex is a separate source,
+    otherwise all start vertices form a single one.
     """
-    bd_dok_start_states = bd_matrix.start_states
-    bd_num_start_states = bd_dok_start_states.nnz
-
+    bd_start_states = bd_matrix.start_states.nonzero()[1]
+    q_start_states = query_matrix.start_states.nonzero()[1]
     q_num_states = query_matrix.num_states
-    matrix_shape = (
-        q_num_states * (bd_num_start_states if for_each else 1),
-        bd_matrix.num_states + q_num_states,
-    )
-    init_state_matrix = dok_matrix(matrix_shape, dtype=bool)
-    front = init_state_matrix.copy()
     if for_each:
-        bd_start_states = bd_dok_start_states.nonzero()[1]
-        for i in range(bd_num_start_states):
-            for j in query_matrix.start_states.nonzero()[1]:
-                index = j + query_matrix.num_states * i
-                front[index, j] = True
-                front[index, q_num_states + bd_start_states[i]] = True
+        num_sources = len(bd_start_states)
+        sources = np.arange(num_sources)
     else:
-        for i in query_matrix.start_states.nonzero()[1]:
-            front[i, i] = True
-            front[i, q_num_states:] = bd_dok_start_states
+        num_sources = 1
+        sources = np.zeros(len(bd_start_states), dtype=np.int64)
 
-    return init_state_matrix, front
+    rows = (sources[:, None] * q_num_states + q_start_states[None, :]).ravel()
+    cols = np.repeat(bd_start_states, len(q_start_states))
+    return coo_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, cols)),
+        shape=(num_sources * q_num_states, bd_matrix.num_states),
+    ).tocsr()
 
 
 def _create_transitions(
-    query_matrix: BooleanAdjacencyMatrix, bd_matrix: BooleanAdjacencyMatrix
-) -> Dict[str, dok_matrix]:
+    query_matrix: BooleanAdjacencyMatrix,
+    bd_matrix: BooleanAdjacencyMatrix,
+    num_sources: int,
+) -> Dict[str, Tuple[csr_matrix, csr_matrix]]:
     """
-    Create a transition diagonal matrix, where each block corresponds
-    to a label that is present in both boolean adjacency matrices 'bd_matrix'
-    and 'query_matrix'.
+    For every label present in both boolean adjacency matrices 'bd_matrix'
+    and 'query_matrix' create a pair of matrices: the one that moves each row
+    of the front to the rows of the next query states of the same source,
+    and the graph adjacency matrix that moves the vertices.
     """
     m_bd = bd_matrix.adj_matrices
     m_q = query_matrix.adj_matrices
@@ -166,45 +674,46 @@ def _create_transitions(
 
     transition = {}
     for i in common_labels:
-        transition[i] = block_diag((m_q[i], m_bd[i]))
+        moves = kron(identity(num_sources, dtype=bool), csr_matrix(m_q[i]).T)
+        transition[i] = (csr_matrix(moves, dtype=bool), csr_matrix(m_bd[i], dtype=bool))
 
     return transition
 
 
 def _compute_sum_fronts(
-    transitions: Dict[str, dok_matrix],
-    front: dok_matrix,
-    init_state_matrix: dok_matrix,
-    q_num_states: int,
-) -> dok_matrix:
-    """
-    Actually bfs algorithm. We pass along each front and find accessible states
-    """
-    prev_nnz = None
-    sum_fronts = init_state_matrix.copy()
-    while prev_nnz != sum_fronts.nnz:
-        prev_nnz = sum_fronts.nnz
-        new_front = init_state_matrix.copy()
-        for v in transitions.values():
-            all_state = front * v
-            q_state = all_state[0:, 0:q_num_states]
-            bd_state = all_state[0:, q_num_states:]
-            for k, t in zip(*q_state.nonzero()):
-                n = q_num_states * (k // q_num_states) + t
-                new_front[n, t % q_num_states] = True
-                new_front[n, q_num_states:] += bd_state[k]
-        front = new_front
-        sum_fronts += front
-
+    transitions: Dict[str, Tuple[csr_matrix, csr_matrix]],
+    front: csr_matrix,
+) -> csr_matrix:
+    """
+    Actually bfs algorithm. We pass along each front and find accessible states.
+    Only the cells that were not visited before get into the next front.
+    """
+    sum_fronts = csr_matrix(front.shape, dtype=bool)
+    for _, sum_fronts in _iter_fronts(transitions, front):
+        pass
     return sum_fronts
 
 
+def _iter_fronts(
+    transitions: Dict[str, Tuple[csr_matrix, csr_matrix]],
+    front: csr_matrix,
+) -> Iterator[Tuple[csr_matrix, csr_matrix]]:
+    # Yields the newly visited cells of every BFS step and all the visited cells
+    sum_fronts = csr_matrix(front.shape, dtype=bool)
+    while transitions and front.nnz:
+        new_front = reduce(
+            operator.add,
+            (moves @ (front @ adj) for moves, adj in transitions.values()),
+        )
+        front = new_front > sum_fronts
+        sum_fronts = sum_fronts + front
+        yield front, sum_fronts
+
+
 def _compute_result(
     bd_matrix: BooleanAdjacencyMatrix,
     query_matrix: BooleanAdjacencyMatrix,
-    start_states: dok_matrix,
-    final_states: Set,
-    sum_fronts: dok_matrix,
+    sum_fronts: csr_matrix,
     states_dict: Dict,
     for_each: bool,
 ) -> Set:
@@ -213,27 +722,32 @@ def _compute_result(
     and generates the response as a set with reachable vertices.
     If for_each is true, then a response of reachable vertices for each vertex from the start_states is formed.
     """
-    bd_num_start_states = bd_matrix.start_states.nnz
-    q_num_states = query_matrix.num_states
+    bd_final_states = to_array(bd_matrix.final_states)[0]
+    q_final_states = to_array(query_matrix.final_states)[0]
+    rows, vertices = sum_fronts.nonzero()
+    sources, q_states = np.divmod(rows, query_matrix.num_states)
+    accepted = q_final_states[q_states] & bd_final_states[vertices]
+    return _collect_result(
+        bd_matrix, sources[accepted], vertices[accepted], states_dict, for_each
+    )
+
+
+def _collect_result(
+    bd_matrix: BooleanAdjacencyMatrix,
+    sources: np.ndarray,
+    vertices: np.ndarray,
+    states_dict: Dict,
+    for_each: bool,
+) -> Union[Set, Dict[Any, Set]]:
+    # Maps the accepted (source, vertex) cells of the BFS to graph vertices
     if for_each:
-        res_matrix = dok_matrix((bd_num_start_states, bd_matrix.num_states), dtype=bool)
-        for i in range(bd_num_start_states):
-            for j in query_matrix.final_states.nonzero()[1]:
-                index = j + q_num_states * i
-                if sum_fronts[index, j]:
-                    res_matrix[i] += sum_fronts[index, q_num_states:]
+        start_states = bd_matrix.start_states.nonzero()[1]
         result = {}
-        for start, final in zip(*res_matrix.nonzero()):
-            if final in final_states:
-                key = states_dict[start_states[start]]
-                value = states_dict[final]
-                if key not in result:
-                    result[key] = set()
-                result[key].add(value)
+        for source, final in zip(sources, vertices):
+            key = states_dict[start_states[source]]
+            if key not in result:
+                result[key] = set()
+            result[key].add(states_dict[final])
     else:
-        res_matrix = dok_matrix((1, bd_matrix.num_states), dtype=bool)
-        for i in query_matrix.final_states.nonzero()[1]:
-            if sum_fronts[i, i]:
-                res_matrix += sum_fronts[i, q_num_states:]
-        result = {states_dict[i] for i in res_matrix.nonzero()[1] if i in final_states}
+        result = {states_dict[i] for i in vertices}
     return result
@@ -0,0 +1,42 @@
+import sys
+import timeit
+
+import shared
+
+sys.path.append(str(shared.ROOT))
+
+from project.boolean_adjacency_matrix import STORAGE_BACKENDS
+from project.graph_utils import load_cached_graph
+from project.reg_querying import regular_query, find_accessible_vertices
+
+GRAPHS = ["skos", "generations", "travel", "univ", "atom", "pizza"]
+REGEXES = ["type*", "subClassOf* type", "(type | subClassOf) first* rest"]
+REPEAT = 3
+
+
+def main():
+    print("graph,regex,backend,regular_query_sec,find_accessible_sec")
+    for graph_name in GRAPHS:
+        # The regular queries do not depend on parallel edges or edge attributes
+        graph = load_cached_graph(graph_name).graph
+        for regex in REGEXES:
+            for backend in STORAGE_BACKENDS:
+                rq_time = min(
+                    timeit.repeat(
+                        lambda: regular_query(regex, graph, backend=backend),
+                        number=1,
+                        repeat=REPEAT,
+                    )
+                )
+                fa_time = min(
+                    timeit.repeat(
+                        lambda: find_accessible_vertices(regex, graph, backend=backend),
+                        number=1,
+                        repeat=REPEAT,
+                    )
+                )
+                print(f'{graph_name},"{regex}",{backend},{rq_time:.4f},{fa_time:.4f}')
+
+
+if __name__ == "__main__":
+    main()
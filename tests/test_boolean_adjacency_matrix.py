@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+from networkx import MultiDiGraph
+from pyformlang.finite_automaton import EpsilonNFA
+
+from project.boolean_adjacency_matrix import (
+    BooleanAdjacencyMatrix,
+    STORAGE_BACKENDS,
+    count_nonzero,
+    to_array,
+)
+from project.ecfg import ExtendedCFG
+from project.fa_building import build_minimal_dfa_by_regex, build_nfa_from_graph
+from project.graph_utils import create_labeled_two_cycles_graph
+
+
+@pytest.fixture
+def nfa() -> EpsilonNFA:
+    fa = EpsilonNFA()
+    fa.add_transition(0, "a", 1)
+    fa.add_transition(1, "b", 2)
+    fa.add_transition(2, "a", 0)
+    fa.add_start_state(0)
+    fa.add_final_state(2)
+    return fa
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+def test_to_nfa(nfa: EpsilonNFA, backend: str):
+    matrix = BooleanAdjacencyMatrix(nfa, backend=backend)
+    assert matrix.to_nfa().is_equivalent_to(nfa)
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+def test_intersection(nfa: EpsilonNFA, backend: str):
+    dfa = build_minimal_dfa_by_regex("a b (a b)*")
+    intersected = BooleanAdjacencyMatrix(nfa, backend=backend).get_intersection(
+        BooleanAdjacencyMatrix(dfa, backend=backend)
+    )
+    assert intersected.backend == backend
+    assert intersected.to_nfa().is_equivalent_to(nfa.get_intersection(dfa))
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+def test_transitive_closure(nfa: EpsilonNFA, backend: str):
+    tc = BooleanAdjacencyMatrix(nfa, backend=backend).get_transitive_closure()
+    assert count_nonzero(tc) == 9
+    assert to_array(tc).all()
+
+
+def test_transitive_closure_is_same_for_all_backends(nfa: EpsilonNFA):
+    closures = [
+        to_array(BooleanAdjacencyMatrix(nfa, backend=b).get_transitive_closure())
+        for b in STORAGE_BACKENDS
+    ]
+    for tc in closures:
+        assert np.array_equal(tc, closures[0])
+
+
+def test_unknown_backend(nfa: EpsilonNFA):
+    with pytest.raises(ValueError):
+        BooleanAdjacencyMatrix(nfa, backend="lil")
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+def test_from_graph(backend: str):
+    graph = create_labeled_two_cycles_graph(3, 2, ("a", "b"))
+    graph.add_edge(0, 1, label="a")  # parallel edge
+    matrix = BooleanAdjacencyMatrix.from_graph(graph, {0}, {2, "X"}, backend)
+
+    assert matrix.states == list(graph.nodes) + ["X"]
+    assert matrix.num_states == graph.number_of_nodes() + 1
+    assert matrix.to_nfa().is_equivalent_to(
+        BooleanAdjacencyMatrix(build_nfa_from_graph(graph, {0}, {2, "X"})).to_nfa()
+    )
+    assert count_nonzero(matrix.adj_matrices["a"]) == 4
+    assert count_nonzero(matrix.final_states) == 2
+
+
+def test_from_graph_empty():
+    matrix = BooleanAdjacencyMatrix.from_graph(MultiDiGraph())
+    assert matrix.num_states == 0
+    assert matrix.adj_matrices == {}
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+@pytest.mark.parametrize("strategy", ["squaring", "delta"])
+def test_closure_strategies(backend: str, strategy: str):
+    graph = create_labeled_two_cycles_graph(4, 3, ("a", "b"))
+    matrix = BooleanAdjacencyMatrix.from_graph(graph, backend=backend)
+    tc = matrix.get_transitive_closure(strategy)
+
+    assert to_array(tc).all()
+    stats = matrix.closure_stats
+    assert stats.strategy == strategy
+    assert stats.iterations == len(stats.nnz_per_step) - 1
+    assert stats.nnz_per_step[0] == graph.number_of_edges()
+    assert stats.nnz_per_step[-1] == count_nonzero(tc)
+    assert stats.nnz_per_step == sorted(stats.nnz_per_step)
+
+
+def test_closure_auto_strategy():
+    line = MultiDiGraph()
+    line.add_edges_from((i, i + 1, {"label": "a"}) for i in range(200))
+    sparse_matrix = BooleanAdjacencyMatrix.from_graph(line)
+    sparse_matrix.get_transitive_closure()
+    assert sparse_matrix.closure_stats.strategy == "delta"
+    assert sparse_matrix.closure_stats.nnz_per_step[-1] == 200 * 201 // 2
+
+    dense_matrix = BooleanAdjacencyMatrix.from_graph(line, backend="dense")
+    dense_matrix.get_transitive_closure()
+    assert dense_matrix.closure_stats.strategy == "squaring"
+
+
+def test_from_rfa():
+    rfa = ExtendedCFG.from_text("S -> a S b | $\nA -> a*").to_rfa()
+    matrix = BooleanAdjacencyMatrix.from_rfa(rfa)
+    num_states = sum(len(box.states) for box in rfa.boxes.values())
+
+    assert matrix.num_states == len(matrix.states) == num_states
+    assert count_nonzero(matrix.start_states) == 2
+    assert matrix.adj_matrices["S"].shape == (num_states, num_states)
+    for i in matrix.final_states.nonzero()[1]:
+        var, state = matrix.states[i].value
+        assert state in rfa.boxes[var].final_states
+
+
+def test_disjoint_union(nfa: EpsilonNFA):
+    first = BooleanAdjacencyMatrix(nfa)
+    second = BooleanAdjacencyMatrix(build_minimal_dfa_by_regex("a b"))
+    union = BooleanAdjacencyMatrix.disjoint_union([first, second])
+
+    assert union.num_states == first.num_states + second.num_states
+    assert union.states[: first.num_states] == [(0, s) for s in first.states]
+    assert union.to_nfa().is_equivalent_to(first.to_nfa().union(second.to_nfa()))
@@ -2,7 +2,13 @@ import pytest
 from pyformlang.cfg import CFG, Variable
 from networkx import MultiDiGraph
 
-from project.cfqp import hellings, matrix, reachability_with_nonterminal
+from project.cfqp import (
+    hellings,
+    matrix,
+    tensor,
+    reachability_with_nonterminal,
+    cfpq_witnesses,
+)
 from project.graph_utils import create_labeled_two_cycles_graph
 
 
@@ -20,7 +26,7 @@ def test_algorithms(algo):
     assert result == expected_result
 
 
-@pytest.mark.parametrize("algo", ["hellings", "matrix"])
+@pytest.mark.parametrize("algo", ["hellings", "matrix", "tensor"])
 def test_reachability_with_nonterminal(algo: str):
     cfg_text = """
         S -> A B | B A
@@ -53,7 +59,7 @@ def test_reachability_with_nonterminal(algo: str):
     assert expected_result == result
 
 
-@pytest.mark.parametrize("algo", ["hellings", "matrix"])
+@pytest.mark.parametrize("algo", ["hellings", "matrix", "tensor"])
 def test_reachability_with_nonterminal2(algo: str):
     cfg_text = """
         S -> A B
@@ -77,3 +83,94 @@ def test_reachability_with_nonterminal2(algo: str):
     assert len(expected_result) == len(result)
     for expected in expected_result:
         assert expected in result
+
+
+def test_tensor_without_normal_form():
+    cfg = CFG.from_text("S -> a S b | a b c")
+    graph = MultiDiGraph()
+    graph.add_edges_from(
+        [
+            (0, 1, {"label": "a"}),
+            (1, 2, {"label": "a"}),
+            (2, 3, {"label": "b"}),
+            (3, 4, {"label": "c"}),
+            (4, 5, {"label": "b"}),
+        ]
+    )
+
+    assert tensor(cfg, graph) == {(1, Variable("S"), 4), (0, Variable("S"), 5)}
+
+
+@pytest.mark.parametrize("algo", ["hellings", "matrix", "tensor"])
+def test_reachability_with_epsilon(algo: str):
+    cfg = CFG.from_text("S -> a S b | $")
+    graph = MultiDiGraph()
+    graph.add_edges_from([(0, 1, {"label": "a"}), (1, 2, {"label": "b"})])
+
+    result = reachability_with_nonterminal(
+        cfg, graph, graph.nodes, graph.nodes, Variable("S"), algo=algo
+    )
+
+    assert result == {(0, 0), (1, 1), (2, 2), (0, 2)}
+
+
+@pytest.mark.parametrize("algo", ["hellings", "matrix", "tensor"])
+def test_reachability_goal_directed(algo: str):
+    cfg = CFG.from_text(
+        """
+        S -> A B | A S B
+        A -> a
+        B -> b
+        C -> S c
+        """
+    )
+    graph = create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    graph.add_edge(0, 6, label="c")
+    start_vertices = {1, 2}
+    end_vertices = {0, 4, 5}
+
+    full = tensor(cfg, graph)
+    for target in [Variable("S"), Variable("B"), Variable("C")]:
+        expected = {
+            (i, j)
+            for i, var, j in full
+            if var == target and i in start_vertices and j in end_vertices
+        }
+        result = reachability_with_nonterminal(
+            cfg, graph, start_vertices, end_vertices, target, algo=algo
+        )
+        assert result == expected
+
+
+@pytest.mark.parametrize("algo", [hellings, matrix, tensor])
+def test_solver_with_start_vertices(algo):
+    cfg = CFG.from_text("S -> a S b | a b")
+    graph = create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    start_vertices = {0, 3}
+
+    result = {t for t in algo(cfg, graph, start_vertices) if t[0] in start_vertices}
+    expected = {t for t in algo(cfg, graph) if t[0] in start_vertices}
+
+    assert result == expected
+
+
+def test_cfpq_witnesses():
+    cfg = CFG.from_text("S -> a S b | a b")
+    graph = create_labeled_two_cycles_graph(2, 1, labels=("a", "b"))
+    s = Variable("S")
+
+    witnesses = cfpq_witnesses(cfg, graph)
+
+    assert witnesses.triples == hellings(cfg, graph)
+    for i, var, j in witnesses.triples:
+        path = witnesses.path(i, var, j)
+        assert path[0][0] == i and path[-1][2] == j
+        assert [u for u, _, _ in path[1:]] == [v for _, _, v in path[:-1]]
+        for u, label, v in path:
+            assert label in {d["label"] for d in graph[u][v].values()}
+        if var == s:
+            word = [label for _, label, _ in path]
+            assert cfg.contains(word)
+        tree = witnesses.derivation(i, var, j)
+        assert tree.triple == (i, var, j)
+        assert tree.production.head == var
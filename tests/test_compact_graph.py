@@ -0,0 +1,121 @@
+import pytest
+from networkx import MultiDiGraph
+
+from project.boolean_adjacency_matrix import BooleanAdjacencyMatrix, to_array
+from project.cfqp import hellings, hellings_from_file, matrix_from_file, tensor
+from project.compact_graph import (
+    CompactGraph,
+    load_compact,
+    read_edge_list,
+    save_compact,
+)
+from project.graph_utils import create_labeled_two_cycles_graph
+
+
+@pytest.fixture
+def edge_file(tmp_path) -> str:
+    path = tmp_path / "graph.txt"
+    path.write_text("0 1 a\n1 2 b\n\n2 0 a\n10 2 c\n2 0 a\n")
+    return str(path)
+
+
+def edges_of(graph) -> set:
+    return set(graph.edges(data="label"))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 8, 1 << 20])
+def test_read_edge_list(edge_file: str, chunk_size: int):
+    graph = read_edge_list(edge_file, chunk_size=chunk_size)
+
+    assert graph.nodes == [0, 1, 2, 10]
+    assert set(graph.labels) == {"a", "b", "c"}
+    assert graph.number_of_edges() == 4
+    assert edges_of(graph) == {(0, 1, "a"), (1, 2, "b"), (2, 0, "a"), (10, 2, "c")}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1 << 20])
+def test_read_malformed_edge_list(tmp_path, chunk_size: int):
+    path = tmp_path / "malformed.txt"
+    path.write_text("0 1 a 5\n1 b\n")
+
+    with pytest.raises(ValueError, match="Line 1 "):
+        read_edge_list(str(path), chunk_size=chunk_size)
+
+    path.write_text("0 1 a\n\n1 b\n")
+    with pytest.raises(ValueError, match="Line 3 "):
+        read_edge_list(str(path), chunk_size=chunk_size)
+
+
+def test_read_empty_edge_list(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_text("")
+    graph = read_edge_list(str(path))
+
+    assert graph.number_of_nodes() == 0
+    assert graph.number_of_edges() == 0
+
+
+def test_from_graph_round_trip():
+    graph = create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    compact = CompactGraph.from_graph(graph)
+
+    assert compact.nodes == list(graph.nodes)
+    assert edges_of(compact) == edges_of(graph)
+    assert edges_of(compact.to_networkx()) == edges_of(graph)
+
+
+def test_subgraph():
+    graph = CompactGraph.from_graph(
+        create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    )
+    subgraph_nx = graph.to_networkx().subgraph([0, 1, 2, 4])
+    subgraph = graph.subgraph([0, 1, 2, 4, 100])
+
+    assert set(subgraph.nodes) == {0, 1, 2, 4}
+    assert edges_of(subgraph) == edges_of(subgraph_nx)
+
+
+def test_boolean_matrix_from_compact_graph():
+    graph = create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    expected = BooleanAdjacencyMatrix.from_graph(graph, start=[0, 7], final=[1])
+    matrix = BooleanAdjacencyMatrix.from_graph(
+        CompactGraph.from_graph(graph), start=[0, 7], final=[1]
+    )
+
+    assert matrix.states == expected.states
+    assert matrix.adj_matrices.keys() == expected.adj_matrices.keys()
+    for label, adjacency in expected.adj_matrices.items():
+        assert (to_array(matrix.adj_matrices[label]) == to_array(adjacency)).all()
+    assert (to_array(matrix.start_states) == to_array(expected.start_states)).all()
+    assert (to_array(matrix.final_states) == to_array(expected.final_states)).all()
+
+
+@pytest.mark.parametrize("solver", [hellings_from_file, matrix_from_file])
+def test_solvers_from_file(edge_file: str, solver):
+    cfg = "S -> a b | S a\n"
+    graph = MultiDiGraph()
+    graph.add_edges_from(
+        [(0, 1, {"label": "a"}), (1, 2, {"label": "b"}), (2, 0, {"label": "a"})]
+    )
+    graph.add_edge(10, 2, label="c")
+
+    assert solver(cfg, edge_file) == hellings(cfg, graph)
+
+
+def test_tensor_on_compact_graph():
+    cfg = "S -> a S b | a b\n"
+    graph = create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+
+    assert tensor(cfg, CompactGraph.from_graph(graph)) == tensor(cfg, graph)
+
+
+def test_save_and_load_compact(tmp_path):
+    graph = CompactGraph.from_graph(
+        create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    )
+    save_compact(graph, str(tmp_path))
+    loaded = load_compact(str(tmp_path))
+
+    assert loaded.nodes == graph.nodes
+    assert edges_of(loaded) == edges_of(graph)
+    assert hellings("S -> a S b | a b", loaded) == hellings("S -> a S b | a b", graph)
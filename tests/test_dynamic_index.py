@@ -0,0 +1,65 @@
+import pytest
+from networkx import MultiDiGraph
+
+from project.cfqp import matrix
+from project.dynamic_index import DynamicCFPQIndex, DynamicRPQIndex
+from project.graph_utils import create_labeled_two_cycles_graph
+from project.reg_querying import regular_query
+
+
+@pytest.fixture
+def graph() -> MultiDiGraph:
+    return create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+
+
+def apply(graph: MultiDiGraph, inserted=(), deleted=()):
+    for u, v, label in deleted:
+        key = next(k for k, d in graph[u][v].items() if d["label"] == label)
+        graph.remove_edge(u, v, key)
+    for u, v, label in inserted:
+        graph.add_edge(u, v, label=label)
+
+
+@pytest.mark.parametrize("start, final", [(None, None), ({0, 1}, {3, 5}), ({6}, None)])
+def test_dynamic_rpq(graph, start, final):
+    regex = "a* b b*"
+    index = DynamicRPQIndex(regex, graph, start, final)
+    assert index.results() == regular_query(regex, graph, start, final)
+
+    batches = [
+        ([(3, 6, "b"), (6, 7, "a")], []),
+        ([], [(0, 4, "b"), (6, 7, "a")]),
+        ([(0, 4, "b"), (0, 4, "b")], [(3, 0, "a")]),
+        ([], [(0, 4, "b")]),
+    ]
+    for inserted, deleted in batches:
+        index.delete_edges(deleted)
+        index.insert_edges(inserted)
+        apply(graph, inserted, deleted)
+        assert index.results() == regular_query(regex, graph, start, final)
+
+
+def test_dynamic_cfpq(graph):
+    cfg = "S -> a S b | a b | $"
+    index = DynamicCFPQIndex(cfg, graph)
+    assert index.results() == matrix(cfg, graph)
+
+    batches = [
+        ([(3, 7, "b"), (7, 0, "b")], []),
+        ([], [(1, 2, "a")]),
+        ([(1, 2, "a")], [(0, 4, "b"), (7, 0, "b")]),
+    ]
+    for inserted, deleted in batches:
+        index.delete_edges(deleted)
+        index.insert_edges(inserted)
+        apply(graph, inserted, deleted)
+        assert index.results() == matrix(cfg, graph)
+
+
+def test_delete_missing_edge(graph):
+    index = DynamicCFPQIndex("S -> a", graph)
+    before = index.results()
+
+    with pytest.raises(ValueError):
+        index.delete_edges([(0, 1, "a"), (0, 1, "b")])
+    assert index.results() == before
@@ -1,3 +1,5 @@
+import pytest
+
 from project.fa_building import *
 from project.graph_utils import create_labeled_two_cycles_graph
 
@@ -94,3 +96,46 @@ def test_build_nfa_from_graph_two_cycled():
 
 def test_build_nfa_from_graph_empty():
     assert build_nfa_from_graph(MultiDiGraph()).is_empty()
+
+
+@pytest.fixture
+def regex_cache():
+    clear_regex_cache()
+    yield
+    set_regex_cache_size(REGEX_CACHE_SIZE)
+    clear_regex_cache()
+
+
+def test_compile_regex_is_cached(regex_cache):
+    compiled = compile_regex("a (b|c)* d")
+
+    assert compile_regex("  a   (b|c)*\td ") is compiled
+    assert compiled.matrix("csr") is compiled.matrix("csr")
+    assert compiled.dfa.is_equivalent_to(build_minimal_dfa_by_regex("a (b|c)* d"))
+    assert regex_cache_info() == CacheInfo(
+        hits=1, misses=1, maxsize=REGEX_CACHE_SIZE, currsize=1
+    )
+
+
+def test_regex_cache_eviction(regex_cache):
+    set_regex_cache_size(2)
+    first = compile_regex("a")
+    compile_regex("b")
+    compile_regex("c")
+
+    assert compile_regex("a") is not first
+    assert regex_cache_info().currsize == 2
+
+
+def test_save_and_load_regex_cache(regex_cache, tmp_path):
+    regexes = ["a (b|c)* d", "a*b*", "x y | $"]
+    expected = [compile_regex(regex).dfa for regex in regexes]
+    path = str(tmp_path / "regexes.json")
+    save_regex_cache(path)
+    clear_regex_cache()
+
+    load_regex_cache(path)
+
+    for regex, dfa in zip(regexes, expected):
+        assert compile_regex(regex).dfa.is_equivalent_to(dfa)
+    assert regex_cache_info().misses == 0
@@ -1,5 +1,8 @@
 import os
 from textwrap import dedent
+import pytest
+
+import cfpq_data
 
 from project.graph_utils import *
 
@@ -87,3 +90,79 @@ def test_create_and_save_labeled_two_cycles_graph():
         contents = dedent(contents)
         assert expected == contents
     os.remove(path)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_and_load_compact_graph(tmp_path, mmap: bool):
+    graph = create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    path = str(tmp_path / "graph")
+    save_compact_graph(graph, path)
+
+    loaded = load_compact_graph(path, mmap=mmap)
+
+    assert sorted(loaded.nodes) == sorted(graph.nodes)
+    assert set(loaded.edges(data="label")) == set(graph.edges(data="label"))
+
+
+def test_save_and_load_compact_graph_with_string_vertices(tmp_path):
+    graph = MultiDiGraph()
+    graph.add_edge("x", "y", label="a")
+    graph.add_node("z")
+    path = str(tmp_path / "graph")
+    save_compact_graph(graph, path)
+
+    loaded = load_compact_graph(path)
+
+    assert loaded.nodes == ["x", "y", "z"]
+    assert set(loaded.edges(data="label")) == {("x", "y", "a")}
+
+
+@pytest.fixture
+def offline_dataset(tmp_path, monkeypatch):
+    # Serves a local edge list instead of the cfpq_data dataset and counts the downloads
+    csv_path = tmp_path / "graph.csv"
+    csv_path.write_text("0 1 a\n1 2 b\n1 2 b\n2 0 a\n")
+    downloads = []
+
+    def download(name):
+        downloads.append(name)
+        return str(csv_path)
+
+    monkeypatch.setattr(cfpq_data, "download", download)
+    clear_graph_cache()
+    yield str(tmp_path / "cache"), csv_path, downloads
+    clear_graph_cache()
+
+
+def test_load_cached_graph(offline_dataset):
+    cache_dir, _, downloads = offline_dataset
+
+    cached = load_cached_graph("g", cache_dir=cache_dir)
+    assert downloads == ["g"]
+    assert cached.info == GraphInfo(3, 4, {"a", "b"})
+    assert set(cached.graph.edges(data="label")) == {
+        (0, 1, "a"),
+        (1, 2, "b"),
+        (2, 0, "a"),
+    }
+
+    assert load_cached_graph("g", cache_dir=cache_dir) is cached
+    clear_graph_cache()
+    from_disk = load_cached_graph("g", cache_dir=cache_dir)
+    assert downloads == ["g"]
+    assert from_disk.info == cached.info
+    assert from_disk.checksum == cached.checksum
+
+
+def test_load_cached_graph_refresh(offline_dataset):
+    cache_dir, csv_path, downloads = offline_dataset
+    cached = load_cached_graph("g", cache_dir=cache_dir)
+
+    assert load_cached_graph("g", cache_dir=cache_dir, refresh=True) is cached
+    csv_path.write_text("0 1 c\n")
+    refreshed = load_cached_graph("g", cache_dir=cache_dir, refresh=True)
+
+    assert downloads == ["g", "g", "g"]
+    assert refreshed.checksum != cached.checksum
+    assert refreshed.info == GraphInfo(2, 1, {"c"})
+    assert load_cached_graph("g", cache_dir=cache_dir) is refreshed
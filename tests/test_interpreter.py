@@ -0,0 +1,113 @@
+import pytest
+
+from project.interpreter import *
+
+
+@pytest.fixture
+def graph_path(tmp_path) -> str:
+    path = tmp_path / "graph.txt"
+    path.write_text("0 1 a\n1 2 b\n2 0 a\n2 3 c\n")
+    return str(path)
+
+
+def test_values():
+    lines = interpret(
+        """
+        s = {1, 2, 3..5};
+        l = [1, "x", true];
+        print(s);
+        print(l[1]);
+        print(2 in s);
+        print(!(7 in s));
+        print(null);
+        print(!l[2]);
+        """
+    )
+    assert lines == ["{1, 2, 3, 4, 5}", "x", "true", "true", "null", "false"]
+
+
+def test_map_and_filter():
+    lines = interpret(
+        """
+        pairs = {[1, 2], [3, 4]};
+        print(map(((a, b)) => b, pairs));
+        print(filter((x) => x in {1, 3}, map((p) => p[0], pairs)));
+        """
+    )
+    assert lines == ["{2, 4}", "{1, 3}"]
+
+
+def test_reachable(graph_path: str):
+    lines = interpret(
+        f"""
+        g = start(load("{graph_path}"), {{0}});
+        q = "a" . ("b" | "c");
+        print(get_reachable(g & q));
+        print(get_reachable(g & q & ("a" . "b")));
+        print(get_vertices(g));
+        print(get_labels(g));
+        print(get_start(add_start(g, {{1}})));
+        """
+    )
+    assert lines == [
+        "{(0, 2)}",
+        "{(0, 2)}",
+        "{0, 1, 2, 3}",
+        "{a, b, c}",
+        "{0, 1}",
+    ]
+
+
+def test_filter_of_reachable_is_pushed_down(graph_path: str):
+    evaluator = PlanEvaluator()
+    lines = interpret(
+        f"""
+        g = load("{graph_path}");
+        q = ("a" | "b" | "c")*;
+        s = {{0, 3}};
+        print(filter((p) => p[0] in s, get_reachable(g & q)));
+        print(filter(((u, v)) => v in {{3}}, get_reachable(g & q)));
+        print(filter((s) => s[1] in s, get_reachable(g & "c")));
+        """,
+        evaluator=evaluator,
+    )
+
+    assert lines == [
+        "{(0, 0), (0, 1), (0, 2), (0, 3)}",
+        "{(0, 3), (1, 3), (2, 3)}",
+        "{(2, 3)}",
+    ]
+    # The first two filters seed the BFS, the last one uses its pattern in the set
+    assert {(start, final) for _, start, final in evaluator._reachable} == {
+        (frozenset({0, 3}), None),
+        (None, frozenset({3})),
+        (None, None),
+    }
+
+
+def test_example_program(graph_path: str):
+    lines = interpret(
+        f"""
+        gg = load("{graph_path}");
+        intermediate = start(final(gg, get_vertices(gg)), {{0, 2}});
+        q1 = ("a" | "b")*;
+        q2 = "a" . "b";
+        start_nodes = get_start(intermediate);
+        v1 = filter((node) => node in start_nodes, map((edge) => edge[0][0], get_edges(intermediate & q1)));
+        v2 = filter((node) => node in start_nodes, map((edge) => edge[0][0], get_edges(intermediate & q2)));
+        print(v1 & v2);
+        """
+    )
+    assert lines == ["{0, 2}"]
+
+
+def test_errors():
+    with pytest.raises(InterpretationError):
+        interpret("print(x);")
+    with pytest.raises(InterpretationError):
+        interpret("print(1 & {1});")
+    with pytest.raises(ParseCancellationException, match="line 1:"):
+        interpret("a = start(;")
+    # The tail left after the first error does not run as a program
+    with pytest.raises(ParseCancellationException):
+        interpret("print(1); a = start(")
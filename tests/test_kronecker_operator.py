@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from project.kronecker_operator import KroneckerOperator
+
+
+@pytest.fixture
+def operands():
+    lhs = sparse.random(6, 5, density=0.4, random_state=1).astype(bool)
+    rhs = sparse.random(3, 4, density=0.5, random_state=2).astype(bool)
+    return lhs, rhs
+
+
+def boolean_product(lhs: np.ndarray, rhs: np.ndarray) -> np.ndarray:
+    return lhs.astype(int) @ rhs.astype(int) > 0
+
+
+def test_shape(operands):
+    lhs, rhs = operands
+    assert KroneckerOperator(lhs, rhs).shape == sparse.kron(lhs, rhs).shape
+
+
+def test_matmat(operands):
+    op = KroneckerOperator(*operands)
+    x = sparse.random(op.shape[1], 4, density=0.3, random_state=3).astype(bool)
+    expected = boolean_product(op.toarray(), x.toarray())
+    assert np.array_equal(op.matmat(x).toarray(), expected)
+    assert np.array_equal((op @ x).toarray(), expected)
+
+
+def test_rmatmat(operands):
+    op = KroneckerOperator(*operands)
+    x = sparse.random(op.shape[0], 2, density=0.3, random_state=4).astype(bool)
+    expected = boolean_product(op.toarray().T, x.toarray())
+    assert np.array_equal(op.rmatmat(x).toarray(), expected)
+    assert np.array_equal((x.T @ op).toarray(), expected.T)
+
+
+def test_matvec_dense(operands):
+    op = KroneckerOperator(*operands)
+    x = np.arange(op.shape[1]) % 3 == 0
+    assert np.array_equal(op.matvec(x), boolean_product(op.toarray(), x))
+
+
+def test_dimension_mismatch(operands):
+    op = KroneckerOperator(*operands)
+    with pytest.raises(ValueError):
+        op.matmat(sparse.csr_matrix((op.shape[1] + 1, 1), dtype=bool))
@@ -0,0 +1,24 @@
+from project.lru_cache import CacheInfo, LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.info() == CacheInfo(hits=1, misses=1, maxsize=2, currsize=2)
+
+
+def test_lru_cache_clear():
+    cache = LRUCache(maxsize=1)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.info() == CacheInfo(hits=0, misses=0, maxsize=1, currsize=0)
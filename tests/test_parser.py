@@ -1,3 +1,5 @@
+import io
+
 import pytest
 
 from project.parser import *
@@ -110,3 +112,175 @@ def test_generate_dot_text_example():
         expected = file.read()
     output = generate_dot_text(example_code) + "\n"  # ci
     assert output == expected
+
+
+def test_parse_program_reuses_parser():
+    for input_string, expected in [
+        ("a = 1;", True),
+        ("a = start(", False),
+        (example_code, True),
+        ("a = {1, 2, ;", False),
+        ("a = b & c;", True),
+    ]:
+        result = parse_program(InputStream(input_string))
+        assert result.is_valid is expected
+        assert bool(result.errors) is not expected
+        assert check_correction_string(input_string) is expected
+    assert parse_program(InputStream("a = b;")).tree.getText() == "a=b;<EOF>"
+
+
+def test_parse_result_keeps_its_tokens():
+    first = parse_program(InputStream("a = b;"))
+    second = parse_program(InputStream("c = start(d, e);"))
+
+    assert [token.text for token in first.token_stream.tokens] == [
+        "a",
+        "=",
+        "b",
+        ";",
+        "<EOF>",
+    ]
+    assert first.tree.getText() == "a=b;<EOF>"
+    assert second.token_stream.tokens[2].text == "start"
+
+
+@pytest.fixture
+def program_cache():
+    clear_program_cache()
+    yield
+    set_program_cache_size(PROGRAM_CACHE_SIZE)
+    clear_program_cache()
+
+
+def test_compile_program_is_cached(program_cache, monkeypatch):
+    compiled = compile_program(example_code)
+    assert compiled.is_valid
+    assert compile_program("a = start(").errors
+
+    # Warm requests do not parse the program again
+    monkeypatch.setattr("project.parser.parse_program", None)
+    assert compile_program(example_code) is compiled
+    assert check_correction_string("a = start(") is False
+    assert program_cache_info() == CacheInfo(
+        hits=2, misses=2, maxsize=PROGRAM_CACHE_SIZE, currsize=2
+    )
+
+
+def test_cached_dot_text_agrees_with_visitor(program_cache, monkeypatch):
+    result = parse_program(InputStream(example_code))
+    visitor = DotGeneratingVisitor()
+    visitor.visit(result.tree)
+    compiled = compile_program(example_code)
+
+    assert compiled.text(compiled.ast) == result.tree.getText()
+    assert generate_dot_text(example_code) == visitor.get_dot_graph()
+    with pytest.raises(ParseCancellationException):
+        generate_dot_text("a = start((a,b);")
+    monkeypatch.setattr("project.parser.parse_program", None)
+    assert generate_dot_text(example_code) == visitor.get_dot_graph()
+    with pytest.raises(ParseCancellationException):
+        generate_dot_text("a = start((a,b);")
+
+
+def test_program_cache_eviction(program_cache):
+    set_program_cache_size(2)
+    first = compile_program("a = 1;")
+    compile_program("b = 2;")
+    compile_program("c = 3;")
+
+    assert compile_program("a = 1;") is not first
+    assert program_cache_info().currsize == 2
+
+
+def test_save_and_load_program_cache(program_cache, tmp_path, monkeypatch):
+    programs = [example_code, "a = b & c;", "a = {1, 2, ;"]
+    expected = [compile_program(program) for program in programs]
+    expected_dot = generate_dot_text(example_code)
+    path = str(tmp_path / "programs.pickle")
+    save_program_cache(path)
+    clear_program_cache()
+
+    monkeypatch.setattr("project.parser.parse_program", None)
+    load_program_cache(path)
+
+    for program, compiled in zip(programs, expected):
+        assert compile_program(program).ast == compiled.ast
+        assert compile_program(program).errors == compiled.errors
+    assert generate_dot_text(example_code) == expected_dot
+    assert program_cache_info().misses == 0
+
+
+def test_dot_visitor_writes_to_sink(tmp_path):
+    tree = parse_program(InputStream(example_code)).tree
+    with open("tests//language_example_dot.dot", "r") as file:
+        expected = file.read()
+    path = tmp_path / "example.dot"
+    with open(path, "w") as file:
+        DotGeneratingVisitor(file).visit(tree)
+
+    assert path.read_text() + "\n" == expected
+    visitor = DotGeneratingVisitor()
+    visitor.visit(tree)
+    assert visitor.get_dot_graph() + "\n" == expected
+
+
+def test_write_dot(program_cache, tmp_path):
+    program = "x = " + " & ".join(f'"l{i}"' for i in range(100)) + ";"
+    sink = io.StringIO()
+    write_dot(program, sink)
+    visitor = DotGeneratingVisitor()
+    visitor.visit(parse_program(InputStream(program)).tree)
+
+    assert sink.getvalue() == visitor.get_dot_graph()
+    assert generate_dot_text(program) == sink.getvalue()
+    path = str(tmp_path / "output.dot")
+    generate_dot(program, output=path)
+    with open(path) as file:
+        assert file.read() == sink.getvalue()
+    with pytest.raises(ParseCancellationException):
+        write_dot("a = start((a,b);", io.StringIO())
+
+
+def test_dot_visitor_renders_older_parse_result():
+    first = parse_program(InputStream("var = start(s1, s2);"))
+    expected = generate_dot_text("var = start(s1, s2);")
+    parse_program(InputStream("x = 1;"))
+
+    visitor = DotGeneratingVisitor()
+    visitor.visit(first.tree)
+    assert visitor.get_dot_graph() == expected
+
+
+def test_dot_visitor_on_subtrees():
+    tree = parse_program(InputStream("a = b; c = d;")).tree
+    first, second = tree.getChild(0), tree.getChild(2)
+    sink = io.StringIO()
+    visitor = DotGeneratingVisitor(sink)
+    visitor.visit(first)
+    visitor.visit(second)
+    visitor.close()
+
+    assert sink.getvalue().splitlines() == [
+        "digraph {",
+        '0 [label="Stmt"]',
+        '1 [label="="]',
+        "0 -> 1",
+        '2 [label="Var: a"]',
+        "1 -> 2",
+        '3 [label="Expr: b"]',
+        "1 -> 3",
+        '4 [label="Var: b"]',
+        "3 -> 4",
+        '5 [label="Stmt"]',
+        '6 [label="="]',
+        "5 -> 6",
+        '7 [label="Var: c"]',
+        "6 -> 7",
+        '8 [label="Expr: d"]',
+        "6 -> 8",
+        '9 [label="Var: d"]',
+        "8 -> 9",
+        "}",
+    ]
+    with pytest.raises(ValueError):
+        visitor.visit(first)
@@ -0,0 +1,93 @@
+import pytest
+from pyformlang.cfg import Variable
+
+from project.boolean_adjacency_matrix import STORAGE_BACKENDS, to_array
+from project.cfqp import reachability_with_nonterminal, tensor
+from project.graph_utils import create_labeled_two_cycles_graph
+from project.prepared_graph import PreparedGraph
+from project.reg_querying import find_accessible_vertices, regular_query
+
+
+@pytest.fixture
+def graph():
+    return create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+
+
+def test_prepared_graph_stats(graph):
+    prepared = PreparedGraph(graph)
+
+    assert prepared.nodes == list(graph.nodes)
+    assert prepared.info.edge_labels == {"a", "b"}
+    assert prepared.label_counts == {"a": 4, "b": 3}
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+@pytest.mark.parametrize(
+    "start, final", [(None, None), ({0}, {3, 5}), ({1, 2}, None), ({0, 100}, {100})]
+)
+def test_regular_query_on_prepared_graph(graph, backend, start, final):
+    prepared = PreparedGraph(graph)
+    regex = "a* b (a | b)*"
+
+    assert regular_query(
+        regex, prepared, start, final, backend=backend
+    ) == regular_query(regex, graph, start, final, backend=backend)
+
+
+@pytest.mark.parametrize("for_each", [False, True])
+def test_find_accessible_on_prepared_graph(graph, for_each):
+    prepared = PreparedGraph(graph)
+    for start, final in [({0}, {3, 4}), ({1, 4}, set(graph.nodes))]:
+        assert find_accessible_vertices(
+            "a* b", prepared, start, final, for_each
+        ) == find_accessible_vertices("a* b", graph, start, final, for_each)
+
+
+def test_queries_do_not_change_prepared_graph(graph):
+    prepared = PreparedGraph(graph)
+    labels = set(prepared.matrix().adj_matrices)
+    start_states = to_array(prepared.matrix().start_states)
+
+    tensor("S -> a S b | a b", prepared)
+    regular_query("a b", prepared, {0}, {2})
+
+    assert set(prepared.matrix().adj_matrices) == labels
+    assert (to_array(prepared.matrix().start_states) == start_states).all()
+
+
+@pytest.mark.parametrize("algo", ["hellings", "matrix", "tensor"])
+def test_cfpq_on_prepared_graph(graph, algo):
+    prepared = PreparedGraph(graph)
+    cfg = "S -> a S b | a b"
+
+    assert reachability_with_nonterminal(
+        cfg, prepared, {0, 1}, {0, 4}, Variable("S"), algo
+    ) == reachability_with_nonterminal(cfg, graph, {0, 1}, {0, 4}, Variable("S"), algo)
+
+
+@pytest.mark.parametrize("backend", ["csr", "dense"])
+def test_compact_subgraph(graph, backend):
+    prepared = PreparedGraph(graph, backend=backend)
+    subgraph = prepared.compact_subgraph([prepared.index[v] for v in (0, 1, 2)])
+
+    assert subgraph.nodes == [0, 1, 2]
+    assert set(subgraph.edges(data="label")) == {
+        (u, v, label)
+        for u, v, label in graph.edges(data="label")
+        if u in (0, 1, 2) and v in (0, 1, 2)
+    }
+
+
+def test_cfpq_does_not_convert_prepared_graph(graph, monkeypatch):
+    prepared = PreparedGraph(graph)
+    expected = reachability_with_nonterminal(
+        "S -> a S b | a b", graph, {0, 1}, {0, 4}, Variable("S")
+    )
+    monkeypatch.setattr(graph, "subgraph", None)
+
+    assert (
+        reachability_with_nonterminal(
+            "S -> a S b | a b", prepared, {0, 1}, {0, 4}, Variable("S")
+        )
+        == expected
+    )
@@ -0,0 +1,181 @@
+import pytest
+from networkx import MultiDiGraph
+
+from project.graph_utils import create_labeled_two_cycles_graph
+from project.query_plan import *
+from project.reg_querying import regular_query
+
+
+@pytest.fixture
+def graph() -> MultiDiGraph:
+    return create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+
+
+@pytest.fixture
+def evaluator(graph: MultiDiGraph) -> PlanEvaluator:
+    return PlanEvaluator(loader=lambda source: graph)
+
+
+def test_plans_of_different_kinds_differ():
+    assert ConcatNode(LabelNode("a"), LabelNode("b")) != UnionNode(
+        LabelNode("a"), LabelNode("b")
+    )
+    assert LoadNode("a") != LabelNode("a")
+
+
+def test_intersection_chain_is_flattened():
+    g = LoadNode("g")
+    plan = intersect_values(intersect_values(g, "a"), star_value("b"))
+
+    assert plan == IntersectNode((g, LabelNode("a"), StarNode(LabelNode("b"))))
+    assert intersect_values({1, 2}, {2, 3}) == {2}
+    assert union_values({1}, {2}) == {1, 2}
+
+
+@pytest.mark.parametrize("start", [None, {0}, {1, 4}])
+def test_reachable_agrees_with_regular_query(
+    graph: MultiDiGraph, evaluator: PlanEvaluator, start
+):
+    g = LoadNode("g")
+    if start is not None:
+        g = states_value(g, "start", start)
+    queries = {
+        "a*": star_value("a"),
+        "a b": concat_values("a", "b"),
+        "(a|b)* b": concat_values(star_value(union_values("a", "b")), "b"),
+    }
+    for regex, plan in queries.items():
+        expected = regular_query(regex, graph, start, None)
+        assert evaluator.reachable(intersect_values(g, plan)) == expected
+        # A chain of languages is fused into one automaton
+        fused = intersect_values(intersect_values(g, plan), plan)
+        assert evaluator.reachable(fused) == expected
+
+
+def test_fused_intersection_agrees_with_product(evaluator: PlanEvaluator):
+    g = states_value(LoadNode("g"), "start", {0})
+    plan = intersect_values(
+        intersect_values(g, star_value(union_values("a", "b"))),
+        concat_values("a", star_value("a")),
+    )
+
+    product = states_value(plan, "add_start", set())
+
+    assert evaluator.reachable(plan) == {
+        (u[0], v[0]) for u, v in evaluator.reachable(product)
+    }
+    assert evaluator.reachable(plan) == {(0, 1), (0, 2), (0, 3), (0, 0)}
+
+
+def test_graph_queries(graph: MultiDiGraph, evaluator: PlanEvaluator):
+    g = LoadNode("g")
+    started = states_value(states_value(g, "start", {0, 1}), "add_start", {2})
+
+    assert evaluator.vertices(g) == set(graph.nodes)
+    assert evaluator.edges(g) == set(graph.edges(data="label"))
+    assert evaluator.labels(g) == {"a", "b"}
+    assert evaluator.start_states(started) == {0, 1, 2}
+    assert evaluator.final_states(started) == set(graph.nodes)
+    assert evaluator.labels(intersect_values(g, "b")) == {"b"}
+    # The product states are (vertex, automaton state) pairs
+    assert {u for (u, _), _, _ in evaluator.edges(intersect_values(g, "b"))} == {
+        u for u, _, label in graph.edges(data="label") if label == "b"
+    }
+
+
+def test_graph_is_loaded_once(graph: MultiDiGraph):
+    loaded = []
+    evaluator = PlanEvaluator(loader=lambda source: loaded.append(source) or graph)
+    g = LoadNode("g")
+
+    evaluator.reachable(intersect_values(g, "a"))
+    evaluator.reachable(intersect_values(states_value(g, "final", {0}), "b"))
+
+    assert loaded == ["g"]
+
+
+def test_type_errors():
+    with pytest.raises(InterpretationError):
+        intersect_values({1}, 1)
+    with pytest.raises(InterpretationError):
+        states_value(LoadNode("g"), "start", "a")
+
+
+def test_load_edge_list(tmp_path):
+    path = tmp_path / "graph.txt"
+    path.write_text("0 1 a\n1 2 b\n2 0 a\n")
+    evaluator = PlanEvaluator()
+    g = states_value(LoadNode(str(path)), "start", {0})
+
+    assert evaluator.reachable(intersect_values(g, concat_values("a", "b"))) == {(0, 2)}
+
+
+@pytest.mark.parametrize("start, final", [({0}, None), (None, {1, 2}), ({0, 4}, {0})])
+def test_seeds_are_pushed_down(
+    graph: MultiDiGraph, evaluator: PlanEvaluator, start, final
+):
+    g = LoadNode("g")
+    plan = intersect_values(g, concat_values(star_value("a"), "b"))
+    expected = {
+        (u, v)
+        for u, v in regular_query("a* b", graph, None, None)
+        if (start is None or u in start) and (final is None or v in final)
+    }
+
+    assert evaluator.reachable(plan, start, final) == expected
+    # Vertices outside the graph are not seeds
+    assert evaluator.reachable(plan, {-1}) == set()
+    # Without a graph the seeds filter the pairs of DFA states
+    language = concat_values("a", "b")
+    assert evaluator.reachable(language, {0}) <= evaluator.reachable(language)
+
+
+def test_languages_are_intersected_smallest_first(evaluator: PlanEvaluator):
+    large = star_value(concat_values(concat_values("a", "b"), concat_values("a", "b")))
+    small = concat_values("a", "b")
+    g = LoadNode("g")
+    query = evaluator.plan_query(intersect_values(intersect_values(g, large), small))
+
+    assert query.languages == (small, large)
+    assert evaluator.estimate(g) == CostEstimate(6, {"a": 4, "b": 3})
+    assert evaluator.estimate(intersect_values(g, small)) == CostEstimate(
+        18, {"a": 4, "b": 3}
+    )
+
+
+def test_empty_intersection_is_not_traversed(evaluator: PlanEvaluator):
+    g = LoadNode("g")
+
+    assert evaluator.reachable(intersect_values(intersect_values(g, "a"), "b")) == set()
+    assert evaluator.reachable(intersect_values(g, "c")) == set()
+
+
+def test_equal_subexpressions_are_computed_once(graph: MultiDiGraph):
+    evaluator = PlanEvaluator(loader=lambda source: graph)
+    first = evaluator.reachable(intersect_values(LoadNode("g"), star_value("a")))
+    first.clear()
+
+    # The same expression built again is the same plan
+    assert evaluator.reachable(intersect_values(LoadNode("g"), star_value("a")))
+    assert evaluator.dfa(star_value("a")) is evaluator.dfa(star_value("a"))
+    assert evaluator.automaton("a") is evaluator.automaton(LabelNode("a"))
+
+
+def test_explain(evaluator: PlanEvaluator):
+    g = states_value(LoadNode("g"), "start", {0})
+    plan = intersect_values(
+        intersect_values(g, star_value(union_values("a", "b"))),
+        concat_values("a", star_value("a")),
+    )
+
+    assert evaluator.explain(plan, final={1, 2}).splitlines() == [
+        "reachable: one BFS over the graph and the query automaton, "
+        "at most 12 states, 8 transitions",
+        '  graph start(load("g"), 1 vertices), start: 1 vertices, '
+        "final: 2 vertices: 6 states, 7 transitions",
+        "  languages, in intersection order:",
+        '    ("a" | "b")*: 1 states, 2 transitions',
+        '    ("a" . "a"*): 2 states, 2 transitions',
+        "  intersected languages: 2 states, 2 transitions",
+    ]
+    assert evaluator.reachable(plan, final={1, 2}) == {(0, 1), (0, 2)}
@@ -2,6 +2,8 @@ import pytest
 from typing import List
 
 from project.reg_querying import *
+from project.boolean_adjacency_matrix import STORAGE_BACKENDS
+from project.graph_utils import create_labeled_two_cycles_graph
 
 
 @pytest.mark.parametrize(
@@ -51,30 +53,48 @@ def graph_2() -> MultiDiGraph:
     return graph
 
 
-def test_regular_query(graph: MultiDiGraph):
+@pytest.mark.parametrize("lazy", [False, True])
+def test_regular_query(graph: MultiDiGraph, lazy: bool):
     regex = "a*(b|c)*e"
     start_states = [0]
     final_states = [4]
 
-    result = regular_query(regex, graph, start_states, final_states)
+    result = regular_query(regex, graph, start_states, final_states, lazy=lazy)
     expected = {(0, 4)}
 
     assert result == expected
 
     # Test with no start_states and final_states
-    result = regular_query(regex, graph)
+    result = regular_query(regex, graph, lazy=lazy)
     expected = {(0, 4), (3, 4), (1, 4)}
 
     assert result == expected
 
     # Test with empty result
     regex = "a(b|c)+e"
-    result = regular_query(regex, graph, start_states, final_states)
+    result = regular_query(regex, graph, start_states, final_states, lazy=lazy)
     expected = set()
 
     assert result == expected
 
 
+@pytest.mark.parametrize("closure_strategy", ["squaring", "delta"])
+def test_regular_query_closure_stats(graph: MultiDiGraph, closure_strategy: str):
+    stats = []
+    result = regular_query(
+        "a*(b|c)*e", graph, closure_strategy=closure_strategy, stats=stats
+    )
+
+    assert result == {(0, 4), (3, 4), (1, 4)}
+    assert len(stats) == 1
+    assert stats[0].strategy == closure_strategy
+    assert len(stats[0].nnz_per_step) == stats[0].iterations + 1
+
+    stats = []
+    regular_query("a*(b|c)*e", graph, lazy=True, stats=stats)
+    assert stats == []
+
+
 def test_accessible_query_for_any(graph_2: MultiDiGraph):
     # Test for_any=True with specified start state
     start_states = {"A"}
@@ -155,3 +175,136 @@ def test_accessible_query_for_each(graph_2: MultiDiGraph):
     start_states = {"A", "B", "C", "D"}
     result = find_accessible_vertices("(x|z)*", graph_2, start_states, for_each=True)
     assert result == {"A": {"D", "C", "B"}, "D": {"C"}, "B": {"D", "C"}}
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+def test_query_backends(graph_2: MultiDiGraph, backend: str):
+    result = regular_query("x (z|y)*", graph_2, {"A"}, backend=backend)
+    assert result == regular_query("x (z|y)*", graph_2, {"A"}, backend="dok")
+
+    result = find_accessible_vertices(
+        "y*x", graph_2, {"A", "D"}, for_each=True, backend=backend
+    )
+    assert result == {"D": {"A"}, "A": {"B", "A"}}
+
+
+def test_accessible_for_each_agrees_with_single_sources():
+    graph = create_labeled_two_cycles_graph(20, 15, ("a", "b"))
+    graph.add_edge(5, 30, label="b")
+    regex = "a* b b* a"
+    result = find_accessible_vertices(regex, graph, None, for_each=True)
+    for start in graph.nodes:
+        expected = find_accessible_vertices(regex, graph, {start})
+        assert result.get(start, set()) == expected
+
+
+@pytest.mark.parametrize("for_each", [False, True])
+@pytest.mark.parametrize("chunk_size,workers", [(1, None), (2, None), (None, 2)])
+def test_accessible_query_in_chunks(
+    graph_2: MultiDiGraph, for_each: bool, chunk_size, workers
+):
+    for regex in ["(x|y)*", "y*x", "x z y"]:
+        expected = find_accessible_vertices(regex, graph_2, None, for_each=for_each)
+        result = find_accessible_vertices(
+            regex,
+            graph_2,
+            None,
+            for_each=for_each,
+            chunk_size=chunk_size,
+            workers=workers,
+        )
+        assert result == expected
+
+
+@pytest.mark.parametrize("backend", STORAGE_BACKENDS)
+@pytest.mark.parametrize("for_each", [False, True])
+def test_accessible_batch_agrees_with_single_queries(backend: str, for_each: bool):
+    graph = create_labeled_two_cycles_graph(3, 2, labels=("a", "b"))
+    regexes = ["a*", "b a", "(a | b)* b", "c", "a a a"]
+    start_states, final_states = {0, 2, 4}, {0, 1, 3, 5}
+
+    results = find_accessible_vertices_batch(
+        regexes, graph, start_states, final_states, for_each, backend
+    )
+
+    assert results == [
+        find_accessible_vertices(
+            regex, graph, start_states, final_states, for_each, backend
+        )
+        for regex in regexes
+    ]
+
+
+@pytest.mark.parametrize("regex", ["x* y", "(x|y)*", "x z y", "z"])
+def test_regular_query_limit_and_exists(graph_2: MultiDiGraph, regex: str):
+    expected = regular_query(regex, graph_2, None, None)
+
+    assert set(iter_regular_query(regex, graph_2)) == expected
+    assert regular_query_exists(regex, graph_2) == bool(expected)
+    for limit in [0, 1, 3, len(expected) + 1]:
+        result = regular_query(regex, graph_2, None, None, limit=limit)
+        assert len(result) == min(limit, len(expected))
+        assert result <= expected
+
+
+@pytest.mark.parametrize("for_each", [False, True])
+@pytest.mark.parametrize("regex", ["x* y", "(x|y)*", "x z y", "z"])
+def test_accessible_vertices_limit(graph_2: MultiDiGraph, regex: str, for_each: bool):
+    expected = find_accessible_vertices(regex, graph_2, None, for_each=for_each)
+    if for_each:
+        expected_items = {(s, v) for s, vs in expected.items() for v in vs}
+    else:
+        expected_items = expected
+
+    found = list(iter_accessible_vertices(regex, graph_2, for_each=for_each))
+    assert len(found) == len(expected_items)
+    assert set(found) == expected_items
+
+    for limit in [0, 1, 3]:
+        result = find_accessible_vertices(
+            regex, graph_2, None, for_each=for_each, limit=limit
+        )
+        if for_each:
+            result = {(s, v) for s, vs in result.items() for v in vs}
+        assert len(result) == min(limit, len(expected_items))
+        assert result <= expected_items
+
+
+def test_limit_rejects_batch_options(graph_2: MultiDiGraph):
+    with pytest.raises(ValueError):
+        regular_query("x* y", graph_2, None, None, closure_strategy="delta", limit=1)
+    with pytest.raises(ValueError):
+        find_accessible_vertices("x* y", graph_2, None, chunk_size=2, limit=1)
+    with pytest.raises(ValueError):
+        find_accessible_vertices("x* y", graph_2, None, workers=2, limit=1)
+    assert len(regular_query("x* y", graph_2, None, None, lazy=True, limit=1)) <= 1
+
+
+@pytest.mark.parametrize("regex", ["x* y", "(x|y)*", "x z y", "z"])
+def test_path_witnesses(graph_2: MultiDiGraph, regex: str):
+    expected = find_accessible_vertices(regex, graph_2, None, for_each=True)
+    witnesses = find_path_witnesses(regex, graph_2)
+    dfa = build_minimal_dfa_by_regex(regex)
+
+    assert witnesses.pairs() == {(s, v) for s, vs in expected.items() for v in vs}
+    for start in graph_2.nodes:
+        for final in graph_2.nodes:
+            path = witnesses.path(start, final)
+            if final not in expected.get(start, set()):
+                assert path is None
+                continue
+            assert [u for u, _, _ in path[1:]] == [v for _, _, v in path[:-1]]
+            assert path[0][0] == start and path[-1][2] == final
+            for u, label, v in path:
+                assert label in {d["label"] for d in graph_2[u][v].values()}
+            assert dfa.accepts([label for _, label, _ in path])
+
+
+@pytest.mark.parametrize("regex", ["x* y", "(x|y)*", "x z y", "z", "y*"])
+def test_single_pair_query(graph_2: MultiDiGraph, regex: str):
+    for start in graph_2.nodes:
+        for final in graph_2.nodes:
+            expected = final in find_accessible_vertices(
+                regex, graph_2, {start}, {final}
+            )
+            assert single_pair_query(regex, graph_2, start, final) == expected